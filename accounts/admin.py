@@ -1,10 +1,23 @@
 from django.contrib import admin
 from django.contrib.auth import get_user_model
 
+from tweets.purge import delete_user
+
 from .models import FriendShip
 
 # Register your models here.
 CustomUser = get_user_model()
 
-admin.site.register(CustomUser)
+
+class CustomUserAdmin(admin.ModelAdmin):
+    # 削除は deleted_at を付けるだけにして、ツイートやフォローは purge_tombstones が少しずつ削除する
+    def delete_model(self, request, obj):
+        delete_user(obj)
+
+    def delete_queryset(self, request, queryset):
+        for user in queryset:
+            delete_user(user)
+
+
+admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(FriendShip)
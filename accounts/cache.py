@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .models import UserStats
+
+
+def _header_key(user):
+    # activity_version はツイート・いいね・フォローのたびに進むので、古いヘッダーは使われずに期限切れで消える
+    return f"profile-header:{user.pk}:{user.activity_version}"
+
+
+def render_header(user):
+    """
+    プロフィールのヘッダー (ユーザー名とフォロー数・フォロワー数・ツイート数・もらったいいね数) を返す。
+    閲覧者によって変わらない部分だけなので、ユーザーごとにキャッシュする。
+    """
+    cache = caches[settings.PROFILE_HEADER_CACHE]
+    key = _header_key(user)
+    html = cache.get(key)
+    if html is None:
+        context = {"object": user, "stats": UserStats.objects.for_user(user)}
+        html = render_to_string("accounts/profile_header.html", context)
+        cache.set(key, html, timeout=settings.PROFILE_HEADER_TIMEOUT)
+    return mark_safe(html)
@@ -0,0 +1,64 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from accounts.models import FriendShip
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "follower_count / following_count を FriendShip から数え直す (削除済みのユーザーとのフォローは数えない)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="1 トランザクションで更新するユーザー数")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        actual = {
+            f"actual_{field}": Coalesce(
+                Subquery(
+                    # 削除済みのユーザーとのフォローは、delete_user で数から除いてある
+                    FriendShip.objects.filter(**{lookup: OuterRef("pk"), f"{other}__deleted_at__isnull": True})
+                    .order_by()
+                    .values(lookup)
+                    .annotate(count=Count("pk"))
+                    .values("count")
+                ),
+                0,
+            )
+            for field, lookup, other in (
+                ("follower_count", "following", "follower"),
+                ("following_count", "follower", "following"),
+            )
+        }
+        last_pk = 0
+        updated = 0
+        fixed = 0
+        while True:
+            # 主キー順に chunk_size 件ずつ区切って、書き込みロックを短く保つ
+            user_ids = list(
+                User.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:chunk_size]
+            )
+            if not user_ids:
+                break
+            with transaction.atomic():
+                # ずれていたユーザーだけを直し、キャッシュしたプロフィールのヘッダーと ETag を作り直させる
+                drifted = list(
+                    User.objects.filter(pk__in=user_ids)
+                    .alias(**actual)
+                    .exclude(follower_count=F("actual_follower_count"), following_count=F("actual_following_count"))
+                    .values_list("pk", flat=True)
+                )
+                if drifted:
+                    User.objects.filter(pk__in=drifted).update(
+                        follower_count=actual["actual_follower_count"],
+                        following_count=actual["actual_following_count"],
+                        activity_version=F("activity_version") + 1,
+                    )
+            last_pk = user_ids[-1]
+            updated += len(user_ids)
+            fixed += len(drifted)
+        self.stdout.write(self.style.SUCCESS(f"{updated} 人のカウンターを再計算し、{fixed} 人を修正しました。"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from accounts import recommendations
+
+
+class Command(BaseCommand):
+    help = "フォロー関係から「おすすめユーザー」を計算し直す (cron で定期的に実行する)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="1 トランザクションで更新するユーザー数")
+        parser.add_argument("--limit", type=int, default=None, help="1 ユーザーあたりに保存するおすすめの数")
+
+    def handle(self, *args, **options):
+        created = recommendations.rebuild(batch_size=options["batch_size"], limit=options["limit"])
+        self.stdout.write(self.style.SUCCESS(f"{created} 件のおすすめを保存しました。"))
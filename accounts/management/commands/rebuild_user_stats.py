@@ -0,0 +1,50 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from accounts.models import UserStats, bump_activity_version
+from tweets.models import Tweet
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "UserStats (ツイート数・もらったいいね数) を Tweet から数え直す"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="1 トランザクションで更新するユーザー数")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        last_pk = 0
+        updated = 0
+        while True:
+            # 主キー順に chunk_size 件ずつ区切って、書き込みロックを短く保つ
+            user_ids = list(
+                User.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:chunk_size]
+            )
+            if not user_ids:
+                break
+            with transaction.atomic():
+                # 数えるのと書き込むのを同じトランザクションで行い、その間の書き込みを取りこぼさない
+                counts = {
+                    user_id: (tweet_count, likes_received)
+                    for user_id, tweet_count, likes_received in Tweet.objects.filter(user_id__in=user_ids)
+                    .order_by()
+                    .values("user_id")
+                    .annotate(tweet_count=Count("pk"), likes_received=Sum("like_count"))
+                    .values_list("user_id", "tweet_count", "likes_received")
+                }
+                UserStats.objects.filter(user_id__in=user_ids).delete()
+                UserStats.objects.bulk_create(
+                    [
+                        UserStats(user_id=user_id, tweet_count=tweet_count, likes_received=likes_received)
+                        for user_id, (tweet_count, likes_received) in counts.items()
+                    ]
+                )
+                # キャッシュしたプロフィールのヘッダーを作り直させる
+                bump_activity_version(user_ids)
+            last_pk = user_ids[-1]
+            updated += len(user_ids)
+        self.stdout.write(self.style.SUCCESS(f"{updated} 人の集計値を再計算しました。"))
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.13 on 2026-10-18 00:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0002_friendship_friendship_unique_constraint"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="friendship",
+            index=models.Index(fields=["following", "date_created"], name="friendship_following_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="friendship",
+            index=models.Index(fields=["follower", "date_created"], name="friendship_follower_idx"),
+        ),
+    ]
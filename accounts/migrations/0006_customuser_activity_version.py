@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0005_recommendation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customuser",
+            name="activity_version",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
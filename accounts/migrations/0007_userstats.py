@@ -0,0 +1,53 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:40
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.deletion
+
+
+def backfill_user_stats(apps, schema_editor):
+    Tweet = apps.get_model("tweets", "Tweet")
+    UserStats = apps.get_model("accounts", "UserStats")
+    rows = (
+        Tweet.objects.order_by()
+        .values("user_id")
+        .annotate(tweet_count=Count("pk"), likes_received=Sum("like_count"))
+        .values_list("user_id", "tweet_count", "likes_received")
+    )
+    UserStats.objects.bulk_create(
+        [
+            UserStats(user_id=user_id, tweet_count=tweet_count, likes_received=likes_received)
+            for user_id, tweet_count, likes_received in rows.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0006_customuser_activity_version"),
+        ("tweets", "0007_trending"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserStats",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("tweet_count", models.PositiveIntegerField(default=0)),
+                ("likes_received", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_user_stats, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,39 @@
+from collections import Counter
+
 from django.conf import settings
-from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.contrib.auth.models import AbstractUser, UserManager
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+
+
+class CustomUserManager(UserManager):
+    def live(self):
+        # 削除済み (tweets.purge.delete_user で deleted_at を付けた) ユーザーを除く
+        # 認証で使うので、objects 自体では除外しない (削除したユーザーは is_active=False でログインできない)
+        return self.filter(deleted_at__isnull=True)
 
 
 class CustomUser(AbstractUser):
     email = models.EmailField()
+    # FriendShip の追加・削除と同じトランザクションで更新するカウンター
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    # いいね・フォローのたびに加算する。ページの ETag に使う (tweets.conditional)
+    activity_version = models.PositiveBigIntegerField(default=0)
+    # 削除した日時。関連する行は purge_tombstones が少しずつ削除し、最後にこの行を削除する
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = CustomUserManager()
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=["deleted_at"], condition=Q(deleted_at__isnull=False), name="user_tombstone_idx"),
+        ]
+
+
+def bump_activity_version(user_ids):
+    CustomUser.objects.filter(pk__in=user_ids).update(activity_version=F("activity_version") + 1)
 
 
 """
@@ -22,13 +51,148 @@ class CustomUser(AbstractUser):
 """
 
 
+class FriendShipManager(models.Manager):
+    def follow(self, follower, following):
+        # フォローを作成し、新規作成のときだけ両者のカウンターを加算する
+        with transaction.atomic():
+            _, created = self.get_or_create(follower=follower, following=following)
+            if created:
+                CustomUser.objects.filter(pk=follower.pk).update(
+                    following_count=F("following_count") + 1, activity_version=F("activity_version") + 1
+                )
+                CustomUser.objects.filter(pk=following.pk).update(
+                    follower_count=F("follower_count") + 1, activity_version=F("activity_version") + 1
+                )
+                # フォローしたユーザーは次の再計算を待たずにおすすめから外す
+                Recommendation.objects.filter(user=follower, recommended=following).delete()
+        return created
+
+    def unfollow(self, follower, following):
+        # フォローを削除し、実際に削除できたときだけ両者のカウンターを減算する
+        with transaction.atomic():
+            deleted, _ = self.filter(follower=follower, following=following).delete()
+            if deleted:
+                CustomUser.objects.filter(pk=follower.pk).update(
+                    following_count=Greatest(F("following_count") - deleted, 0),
+                    activity_version=F("activity_version") + 1,
+                )
+                CustomUser.objects.filter(pk=following.pk).update(
+                    follower_count=Greatest(F("follower_count") - deleted, 0),
+                    activity_version=F("activity_version") + 1,
+                )
+        return bool(deleted)
+
+    def bulk_follow(self, pairs, batch_size=1000):
+        # (follower_id, following_id) の組をまとめてフォローし、増えた分だけカウンターを加算する
+        pairs = {(follower_id, following_id) for follower_id, following_id in pairs if follower_id != following_id}
+        with transaction.atomic():
+            existing = set(
+                self.filter(
+                    follower_id__in={follower_id for follower_id, _ in pairs},
+                    following_id__in={following_id for _, following_id in pairs},
+                ).values_list("follower_id", "following_id")
+            )
+            pairs -= existing
+            self.bulk_create(
+                [
+                    self.model(follower_id=follower_id, following_id=following_id)
+                    for follower_id, following_id in pairs
+                ],
+                batch_size=batch_size,
+            )
+            for field, counts in (
+                ("following_count", Counter(follower_id for follower_id, _ in pairs)),
+                ("follower_count", Counter(following_id for _, following_id in pairs)),
+            ):
+                by_count = {}
+                for user_id, count in counts.items():
+                    by_count.setdefault(count, []).append(user_id)
+                for count, user_ids in by_count.items():
+                    CustomUser.objects.filter(pk__in=user_ids).update(**{field: F(field) + count})
+            bump_activity_version({user_id for pair in pairs for user_id in pair})
+        return len(pairs)
+
+
 class FriendShip(models.Model):
     follower = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="followings", on_delete=models.CASCADE)
     following = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="followers", on_delete=models.CASCADE)
     date_created = models.DateTimeField(auto_now_add=True)
 
+    objects = FriendShipManager()
+
     class Meta:
         constraints = [models.UniqueConstraint(fields=["follower", "following"], name="unique_constraint")]
+        indexes = [
+            # フォロワー一覧・フォロー一覧 (フォローした日時順)
+            models.Index(fields=["following", "date_created"], name="friendship_following_idx"),
+            models.Index(fields=["follower", "date_created"], name="friendship_follower_idx"),
+        ]
 
     def __str__(self):
         return "{} : {}".format(self.follower.username, self.following.username)
+
+
+class RecommendationManager(models.Manager):
+    def for_user(self, user, limit=None):
+        # 事前に計算したおすすめを 1 回のクエリで取得する
+        return list(
+            self.filter(user=user, recommended__deleted_at__isnull=True)
+            .select_related("recommended")
+            .order_by("rank")[: limit or settings.RECOMMENDATION_PANEL_SIZE]
+        )
+
+
+class Recommendation(models.Model):
+    # rebuild_recommendations でまとめて計算する「おすすめユーザー」 (フォロー中のユーザーがフォローしている人)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="recommendations", on_delete=models.CASCADE)
+    rank = models.PositiveIntegerField()
+    recommended = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="+", on_delete=models.CASCADE)
+    # user のフォロー中のうち recommended をフォローしている人数
+    mutual_count = models.PositiveIntegerField()
+    computed_at = models.DateTimeField()
+
+    objects = RecommendationManager()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user", "rank"], name="recommendation_user_rank_unique")]
+
+
+class UserStatsManager(models.Manager):
+    def add(self, deltas):
+        """
+        deltas: {user_id: {フィールド名: 増減}} を加算する。
+        行がなければ 0 で作ってから、同じフィールド・同じ増減のユーザーをまとめて 1 回の UPDATE で加算する。
+        """
+        groups = {}
+        for user_id, fields in deltas.items():
+            for field, delta in fields.items():
+                if delta:
+                    groups.setdefault((field, delta), []).append(user_id)
+        if not groups:
+            return
+        user_ids = {user_id for ids in groups.values() for user_id in ids}
+        self.bulk_create([self.model(user_id=user_id) for user_id in user_ids], ignore_conflicts=True)
+        for (field, delta), ids in groups.items():
+            self.filter(user_id__in=ids).update(**{field: Greatest(F(field) + delta, 0)})
+
+    def for_user(self, user):
+        # select_related("stats") で取得済みならクエリを発行しない。行がまだなければすべて 0
+        try:
+            return user.stats
+        except UserStats.DoesNotExist:
+            return self.model(user_id=user.pk)
+
+
+class UserStats(models.Model):
+    """
+    プロフィールに表示するツイート数・もらったいいね数。ツイート・いいねの追加・削除と同じトランザクションで加算する。
+    フォロー数・フォロワー数は fan-out の判定にも使うので、今までどおり CustomUser に置く。
+    """
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, primary_key=True, related_name="stats", on_delete=models.CASCADE
+    )
+    tweet_count = models.PositiveIntegerField(default=0)
+    likes_received = models.PositiveIntegerField(default=0)
+
+    objects = UserStatsManager()
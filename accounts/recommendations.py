@@ -0,0 +1,93 @@
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from .models import FriendShip, Recommendation, bump_activity_version
+
+User = get_user_model()
+
+EMPTY = array("q")
+
+
+def load_graph(chunk_size=10000):
+    """
+    フォロー関係を {follower_id: following_id の昇順の配列} として読み込む。
+    1 辺あたり 8 バイトで持てるので、グラフ全体をメモリに載せて何段でもたどれる。
+    """
+    graph = {}
+    current = None
+    rows = (
+        FriendShip.objects.order_by("follower_id", "following_id")
+        .values_list("follower_id", "following_id")
+        .iterator(chunk_size=chunk_size)
+    )
+    for follower_id, following_id in rows:
+        if follower_id != current:
+            current = follower_id
+            following_ids = graph[follower_id] = array("q")
+        following_ids.append(following_id)
+    return graph
+
+
+def contains(ids, value):
+    index = bisect_left(ids, value)
+    return index < len(ids) and ids[index] == value
+
+
+def recommend(graph, user_id, limit):
+    # フォロー中のユーザーがフォローしている人を、共通のフォローが多い順に limit 人返す
+    following = graph.get(user_id, EMPTY)
+    counts = Counter()
+    for friend_id in following:
+        for candidate_id in graph.get(friend_id, EMPTY):
+            if candidate_id != user_id and not contains(following, candidate_id):
+                counts[candidate_id] += 1
+    return heapq.nsmallest(limit, counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+def rebuild(batch_size=1000, limit=None):
+    """
+    全ユーザーのおすすめを計算し直す。ユーザーを主キー順に batch_size 人ずつ区切り、
+    その分だけ古いおすすめを削除して作り直すので、書き込みロックは短く、表示が空になる時間もない。
+    おすすめが変わらなかったユーザーの行はそのまま残し、ETag やキャッシュも無効にしない。
+    """
+    limit = limit or settings.RECOMMENDATION_SIZE
+    graph = load_graph()
+    now = timezone.now()
+    last_pk = 0
+    created = 0
+    while True:
+        user_ids = list(User.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not user_ids:
+            break
+        computed = {user_id: recommend(graph, user_id, limit) for user_id in user_ids}
+        with transaction.atomic():
+            current = {user_id: [] for user_id in user_ids}
+            for user_id, recommended_id, mutual_count in (
+                Recommendation.objects.filter(user_id__in=user_ids)
+                .order_by("user_id", "rank")
+                .values_list("user_id", "recommended_id", "mutual_count")
+            ):
+                current[user_id].append((recommended_id, mutual_count))
+            changed = [user_id for user_id in user_ids if current[user_id] != computed[user_id]]
+            rows = [
+                Recommendation(
+                    user_id=user_id, rank=rank, recommended_id=candidate_id, mutual_count=count, computed_at=now
+                )
+                for user_id in changed
+                for rank, (candidate_id, count) in enumerate(computed[user_id], start=1)
+            ]
+            if changed:
+                Recommendation.objects.filter(user_id__in=changed).delete()
+                Recommendation.objects.bulk_create(rows)
+                # おすすめのパネルを表示するページの ETag を変える
+                bump_activity_version(changed)
+        last_pk = user_ids[-1]
+        created += len(rows)
+    return created
@@ -0,0 +1,8 @@
+from jobs.registry import task
+
+from . import recommendations
+
+
+@task("accounts.rebuild_recommendations")
+def rebuild_recommendations():
+    recommendations.rebuild()
@@ -1,11 +1,25 @@
+import json
+from datetime import timedelta
+from io import StringIO
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import SESSION_KEY, get_user_model
-from django.test import TestCase
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from tweets.models import Tweet
+from mysite.testing import QueryBudgetAssertionsMixin, QueryPlanAssertionsMixin
+from tweets.models import Like, Tweet
 
-from .models import FriendShip
+from . import recommendations
+from .models import FriendShip, Recommendation, UserStats
 
 User = get_user_model()
 
@@ -347,7 +361,7 @@ class TestUserProfileView(TestCase):
         )
         self.client.login(username="testuser", password="testpassword")
         Tweet.objects.create(user=self.user, content="test")
-        FriendShip.objects.create(following=self.user2, follower=self.user)
+        FriendShip.objects.follow(self.user, self.user2)
         response = self.client.get(reverse("accounts:user_profile", kwargs={"username": self.user.username}))
         self.assertQuerysetEqual(
             response.context["tweet_list"],
@@ -363,6 +377,110 @@ class TestUserProfileView(TestCase):
         )
 
 
+class TestUserProfilePagination(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        self.url = reverse("accounts:user_profile", kwargs={"username": self.user.username})
+
+    def test_success_get_with_cursor(self):
+        Tweet.objects.bulk_create([Tweet(user=self.user, content=f"test{i}") for i in range(25)])
+        tweets = Tweet.objects.order_by("-created_at", "-id")
+        response = self.client.get(self.url)
+        page = response.context["page_obj"]
+        self.assertQuerysetEqual(response.context["tweet_list"], tweets[:20])
+        self.assertTrue(page.has_next())
+        response = self.client.get(self.url, {"after": page.next_cursor})
+        self.assertQuerysetEqual(response.context["tweet_list"], tweets[20:])
+        self.assertFalse(response.context["page_obj"].has_next())
+
+    def test_success_header_updated_after_like(self):
+        tweet = Tweet.objects.create(user=self.user, content="test")
+        self.assertContains(self.client.get(self.url), "いいねされた数 0")
+        other = User.objects.create_user(username="other", password="testpassword")
+        Like.objects.like(other, tweet)
+        self.assertContains(self.client.get(self.url), "いいねされた数 1")
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(self.url, {"after": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
+
+class TestUserStats(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.other = User.objects.create_user(username="other", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+
+    def stats(self):
+        return UserStats.objects.for_user(User.objects.select_related("stats").get(pk=self.user.pk))
+
+    def test_success_tweet_and_like(self):
+        self.client.post(reverse("tweets:create"), {"content": "test"})
+        tweet = Tweet.objects.get(user=self.user)
+        Like.objects.like(self.other, tweet)
+        Like.objects.like(self.user, tweet)
+        self.assertEqual((self.stats().tweet_count, self.stats().likes_received), (1, 2))
+        Like.objects.unlike(self.other, tweet)
+        self.assertEqual(self.stats().likes_received, 1)
+        Like.objects.apply_batch(self.other, {tweet.pk: True})
+        self.assertEqual(self.stats().likes_received, 2)
+
+    def test_success_delete_tweet(self):
+        tweet = Tweet.objects.create(user=self.user, content="test")
+        UserStats.objects.add({self.user.pk: {"tweet_count": 1}})
+        Like.objects.like(self.other, tweet)
+        self.client.post(reverse("tweets:delete", kwargs={"pk": tweet.pk}))
+        self.assertEqual((self.stats().tweet_count, self.stats().likes_received), (0, 0))
+
+    def test_success_rebuild_command(self):
+        tweet = Tweet.objects.create(user=self.user, content="test")
+        Tweet.objects.filter(pk=tweet.pk).update(like_count=3)
+        call_command("rebuild_user_stats", stdout=StringIO())
+        self.assertEqual((self.stats().tweet_count, self.stats().likes_received), (1, 3))
+
+    def test_failure_stats_without_row(self):
+        self.assertEqual((self.stats().tweet_count, self.stats().likes_received), (0, 0))
+
+
+class TestUserProfileConditionalGet(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.user2 = User.objects.create_user(username="testuser2", password="testpassword2")
+        self.client.login(username="testuser", password="testpassword")
+        self.url = reverse("accounts:user_profile", kwargs={"username": self.user2.username})
+        self.etag = self.client.get(self.url)["ETag"]
+
+    def test_success_not_modified(self):
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_success_modified_by_follow(self):
+        # 別のユーザーにフォローされても、表示中のユーザーのフォロワー数が変わる
+        user3 = User.objects.create_user(username="testuser3", password="testpassword3")
+        FriendShip.objects.follow(user3, self.user2)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["follower_count"], 1)
+
+    def test_success_modified_by_new_tweet(self):
+        Tweet.objects.create(user=self.user2, content="test")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_success_not_modified_by_other_users_tweet(self):
+        user3 = User.objects.create_user(username="testuser3", password="testpassword3")
+        Tweet.objects.create(user=user3, content="test")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_failure_get_with_not_exist_user(self):
+        url = reverse("accounts:user_profile", kwargs={"username": "unknown"})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH="*")
+        self.assertEqual(response.status_code, 404)
+
+
 class TestUserProfileEditView(TestCase):
     def test_success_get(self):
         pass
@@ -398,6 +516,22 @@ class TestFollowView(TestCase):
             status_code=302,
             target_status_code=200,
         )
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user1.following_count, 1)
+        self.assertEqual(self.user2.follower_count, 1)
+
+    async def test_success_post_with_async_client(self):
+        await sync_to_async(self.async_client.force_login)(self.user1)
+        response = await self.async_client.post(reverse("accounts:follow", kwargs={"username": self.user2.username}))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(await FriendShip.objects.filter(following=self.user2, follower=self.user1).aexists())
+
+    def test_failure_post_with_followed_user(self):
+        FriendShip.objects.follow(self.user1, self.user2)
+        self.client.post(reverse("accounts:follow", kwargs={"username": self.user2.username}))
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.follower_count, 1)
 
     def test_failure_post_with_not_exist_user(self):
         response = self.client.post(reverse("accounts:follow", kwargs={"username": "empty"}))
@@ -422,7 +556,7 @@ class TestUnfollowView(TestCase):
             password="testpassword2",
         )
         self.client.login(username="testuser1", password="testpassword1")
-        FriendShip.objects.create(following=self.user2, follower=self.user1)
+        FriendShip.objects.follow(self.user1, self.user2)
 
     def test_success_post(self):
         response = self.client.post(reverse("accounts:unfollow", kwargs={"username": self.user2.username}))
@@ -433,6 +567,10 @@ class TestUnfollowView(TestCase):
             status_code=302,
             target_status_code=200,
         )
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user1.following_count, 0)
+        self.assertEqual(self.user2.follower_count, 0)
 
     def test_failure_post_with_not_exist_tweet(self):
         response = self.client.post(reverse("accounts:unfollow", kwargs={"username": "empty"}))
@@ -455,6 +593,21 @@ class TestFollowingListView(TestCase):
         response = self.client.get(reverse("accounts:following_list", kwargs={"username": self.user.username}))
         self.assertEqual(response.status_code, 200)
 
+    def test_success_get_with_flags(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        target = User.objects.create_user(username="target", password="testpassword")
+        friend = User.objects.create_user(username="friend", password="testpassword")
+        fan = User.objects.create_user(username="fan", password="testpassword")
+        for following in (friend, fan, self.user):
+            FriendShip.objects.follow(target, following)
+        FriendShip.objects.follow(self.user, friend)
+        FriendShip.objects.follow(fan, self.user)
+        self.client.login(username="testuser", password="testpassword")
+        response = self.client.get(reverse("accounts:following_list", kwargs={"username": "target"}))
+        rows = {row["username"]: (row["you_follow"], row["follows_you"]) for row in response.context["following_list"]}
+        self.assertEqual(rows, {"friend": (True, False), "fan": (False, True), "testuser": (False, False)})
+        self.assertContains(response, "フォローされています", count=1)
+
 
 class TestFollowerListView(TestCase):
     def test_success_get(self):
@@ -465,3 +618,263 @@ class TestFollowerListView(TestCase):
         self.client.login(username="testuser", password="testpassword")
         response = self.client.get(reverse("accounts:follower_list", kwargs={"username": self.user.username}))
         self.assertEqual(response.status_code, 200)
+
+    def test_success_get_with_cursor(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        followers = User.objects.bulk_create(
+            [User(username=f"user{i}", email=f"user{i}@example.com") for i in range(25)]
+        )
+        FriendShip.objects.bulk_follow((follower.pk, self.user.pk) for follower in followers)
+        self.client.login(username="testuser", password="testpassword")
+        url = reverse("accounts:follower_list", kwargs={"username": "testuser"})
+        response = self.client.get(url)
+        first = [row["username"] for row in response.context["follower_list"]]
+        self.assertEqual(len(first), 20)
+        response = self.client.get(url, {"after": response.context["page_obj"].next_cursor})
+        second = [row["username"] for row in response.context["follower_list"]]
+        self.assertEqual(len(second), 5)
+        self.assertCountEqual(first + second, [follower.username for follower in followers])
+        # 相手のユーザー名以外の列は取得しない
+        self.assertEqual(
+            set(response.context["follower_list"][0]),
+            {"id", "date_created", "user_id", "username", "you_follow", "follows_you"},
+        )
+
+    def test_failure_get_with_invalid_cursor(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        response = self.client.get(reverse("accounts:follower_list", kwargs={"username": "testuser"}), {"after": "x"})
+        self.assertEqual(response.status_code, 404)
+
+
+class TestFriendShipJsonView(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        self.others = [User.objects.create_user(username=f"other{i}") for i in range(3)]
+        FriendShip.objects.bulk_follow([(self.user.pk, other.pk) for other in self.others])
+        FriendShip.objects.follow(self.others[0], self.user)
+
+    def test_success_get_following_list(self):
+        response = self.client.get(reverse("accounts:api_following_list", kwargs={"username": "testuser"}))
+        self.assertEqual(response.status_code, 200)
+        usernames = [row["username"] for row in response.json()["results"]]
+        self.assertEqual(sorted(usernames), ["other0", "other1", "other2"])
+
+    def test_success_get_follower_list_ndjson(self):
+        response = self.client.get(
+            reverse("accounts:api_follower_list", kwargs={"username": "testuser"}), {"format": "ndjson"}
+        )
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([row["username"] for row in rows], ["other0"])
+
+
+class TestFriendShipManager(TestCase):
+    def test_bulk_follow(self):
+        users = [User.objects.create_user(username=f"testuser{i}") for i in range(3)]
+        FriendShip.objects.follow(users[0], users[1])
+        created = FriendShip.objects.bulk_follow(
+            [
+                (users[0].pk, users[1].pk),
+                (users[0].pk, users[2].pk),
+                (users[1].pk, users[2].pk),
+                (users[2].pk, users[2].pk),
+            ]
+        )
+        self.assertEqual(created, 2)
+        self.assertEqual(FriendShip.objects.count(), 3)
+        counts = User.objects.order_by("pk").values_list("following_count", "follower_count")
+        self.assertEqual(list(counts), [(2, 0), (1, 1), (0, 2)])
+
+
+class TestRebuildFollowCountsCommand(TestCase):
+    def test_success(self):
+        users = [User.objects.create_user(username=f"testuser{i}") for i in range(4)]
+        FriendShip.objects.create(follower=users[0], following=users[1])
+        FriendShip.objects.create(follower=users[0], following=users[2])
+        User.objects.filter(pk=users[2].pk).update(follower_count=10)
+        out = StringIO()
+        call_command("rebuild_follow_counts", chunk_size=2, stdout=out)
+        counts = User.objects.order_by("pk").values_list("following_count", "follower_count", "activity_version")
+        # カウンターがずれていたユーザーだけ、バージョンが進む
+        self.assertEqual(list(counts), [(2, 0, 1), (0, 1, 1), (0, 1, 1), (0, 0, 0)])
+        self.assertIn("3 人を修正", out.getvalue())
+
+
+class TestQueryPlan(QueryPlanAssertionsMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+
+    def test_follower_list(self):
+        self.assertUsesIndex(FriendShip.objects.filter(following=self.user).order_by("-date_created"))
+
+    def test_following_list(self):
+        self.assertUsesIndex(FriendShip.objects.filter(follower=self.user).order_by("-date_created"))
+
+    def test_is_following(self):
+        self.assertUsesIndex(FriendShip.objects.filter(following=self.user, follower=self.user))
+
+    def test_relation_flags(self):
+        self.assertUsesIndex(
+            FriendShip.objects.filter(
+                Q(follower=self.user, following_id__in=[1, 2]) | Q(following=self.user, follower_id__in=[1, 2])
+            ).values_list("follower_id", "following_id")
+        )
+
+    def test_follower_list_page(self):
+        self.assertUsesIndex(
+            FriendShip.objects.filter(following=self.user)
+            .values("id", "date_created", "follower__username")
+            .order_by("-date_created", "-id")[:21]
+        )
+
+
+class TestQueryBudget(QueryBudgetAssertionsMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+
+    def seed(self, size):
+        # 相互フォローするユーザーとツイートを size 件になるまで増やす
+        count = User.objects.count() - 1
+        users = User.objects.bulk_create(
+            [User(username=f"user{i}", email=f"user{i}@example.com") for i in range(count, size)]
+        )
+        FriendShip.objects.bulk_follow(
+            [(self.user.pk, user.pk) for user in users] + [(user.pk, self.user.pk) for user in users]
+        )
+        Tweet.objects.bulk_create([Tweet(user=self.user, content=f"tweet{i}") for i in range(count, size)])
+
+    def test_success_query_count_does_not_grow(self):
+        paths = [
+            reverse(f"accounts:{name}", kwargs={"username": "testuser"})
+            for name in (
+                "user_profile",
+                "following_list",
+                "follower_list",
+                "api_following_list",
+                "api_follower_list",
+            )
+        ]
+        counts = {}
+        for size in (10, 1000):
+            self.seed(size)
+            counts[size] = [self.assertWithinQueryBudget(path) for path in paths]
+        self.assertEqual(counts[10], counts[1000])
+
+
+class TestRecommendation(TestCase):
+    def setUp(self):
+        self.users = {
+            name: User.objects.create_user(username=name, email=f"{name}@example.com", password="testpassword")
+            for name in ("a", "b", "c", "d", "e")
+        }
+        FriendShip.objects.bulk_follow(
+            (self.users[follower].pk, self.users[following].pk)
+            for follower, following in (("a", "c"), ("a", "b"), ("b", "e"), ("b", "d"), ("c", "d"), ("c", "a"))
+        )
+        self.client.login(username="a", password="testpassword")
+
+    def recommended(self, name):
+        return [
+            (recommendation.recommended.username, recommendation.mutual_count)
+            for recommendation in Recommendation.objects.for_user(self.users[name])
+        ]
+
+    def test_success_load_graph(self):
+        graph = recommendations.load_graph()
+        self.assertEqual(list(graph[self.users["a"].pk]), sorted([self.users["b"].pk, self.users["c"].pk]))
+        self.assertNotIn(self.users["d"].pk, graph)
+
+    def test_success_rebuild(self):
+        call_command("rebuild_recommendations", batch_size=2, stdout=StringIO())
+        # 自分自身とフォロー中のユーザーは含めず、共通のフォローが多い順に並べる
+        self.assertEqual(self.recommended("a"), [("d", 2), ("e", 1)])
+        self.assertEqual(self.recommended("c"), [("b", 1)])
+        self.assertEqual(self.recommended("d"), [])
+        with self.assertNumQueries(1):
+            Recommendation.objects.for_user(self.users["a"])
+
+    def test_success_rebuild_replaces_old(self):
+        recommendations.rebuild()
+        FriendShip.objects.bulk_follow([(self.users["b"].pk, self.users["c"].pk)])
+        recommendations.rebuild()
+        self.assertEqual(self.recommended("a"), [("d", 2), ("e", 1)])
+        self.assertEqual(Recommendation.objects.filter(user=self.users["a"]).count(), 2)
+
+    def test_success_rebuild_bumps_only_changed_users(self):
+        recommendations.rebuild()
+        FriendShip.objects.bulk_follow([(self.users["b"].pk, self.users["a"].pk)])
+        versions = dict(User.objects.values_list("username", "activity_version"))
+        recommendations.rebuild()
+        # おすすめが変わった b (c が増える) だけ、バージョンが進む
+        self.assertEqual(
+            {
+                username
+                for username, version in User.objects.values_list("username", "activity_version")
+                if version != versions[username]
+            },
+            {"b"},
+        )
+
+    def test_success_follow_removes_recommendation(self):
+        recommendations.rebuild()
+        FriendShip.objects.follow(self.users["a"], self.users["d"])
+        self.assertEqual(self.recommended("a"), [("e", 1)])
+
+    def test_success_panel(self):
+        recommendations.rebuild()
+        for url in (reverse("tweets:home"), reverse("accounts:user_profile", kwargs={"username": "b"})):
+            response = self.client.get(url)
+            self.assertEqual(
+                [recommendation.recommended for recommendation in response.context["recommendation_list"]],
+                [self.users["d"], self.users["e"]],
+            )
+            self.assertContains(response, "フォロー中の 2 人がフォロー")
+
+
+class TestSessionProfile(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.other = User.objects.create_user(username="otheruser", password="testpassword")
+
+    def count_queries(self, engine, storage):
+        # 設定ごとに Client を作り直す (セッションのエンジンはミドルウェアの読み込み時に決まる)
+        # db セッションの比較用の計測はクエリの上限を超えるので、上限の警告は出さない
+        with self.settings(SESSION_ENGINE=engine, MESSAGE_STORAGE=storage, QUERY_BUDGETS={}):
+            client = Client()
+            client.force_login(self.user)
+            client.get(reverse("tweets:home"))
+            with CaptureQueriesContext(connection) as home:
+                client.get(reverse("tweets:home"))
+            # queries_log は次のリクエストの開始時に空になるので、ここで数えておく
+            home_count = len(home)
+            response = client.post(reverse("accounts:follow", kwargs={"username": "otheruser"}))
+            with CaptureQueriesContext(connection) as redirected:
+                response = client.get(response["Location"])
+            self.assertContains(response, "otheruser をフォローしました。")
+            FriendShip.objects.unfollow(self.user, self.other)
+        return home_count, len(redirected)
+
+    def test_success_default_profile_saves_queries(self):
+        before = self.count_queries(
+            "django.contrib.sessions.backends.db", "django.contrib.messages.storage.session.SessionStorage"
+        )
+        after = self.count_queries(settings.SESSION_ENGINE, settings.MESSAGE_STORAGE)
+        # セッションはキャッシュから読み、メッセージを表示してもセッションを書き換えない
+        self.assertEqual(after[0], before[0] - 1)
+        self.assertEqual(after[1], before[1] - 4)
+        # メッセージを表示するページは 304 にしないので、ETag を計算するクエリもない
+        self.assertEqual(after[1], after[0] - 1)
+
+
+class TestPurgeSessionsCommand(TestCase):
+    def test_success_purge(self):
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key=f"expired{i}", session_data="", expire_date=now - timedelta(days=1))
+        Session.objects.create(session_key="alive", session_data="", expire_date=now + timedelta(days=1))
+        out = StringIO()
+        call_command("purge_sessions", chunk_size=2, stdout=out)
+        self.assertEqual(list(Session.objects.values_list("session_key", flat=True)), ["alive"])
+        self.assertIn("5 件", out.getvalue())
@@ -21,4 +21,6 @@ urlpatterns = [
         views.FollowerListView.as_view(),
         name="follower_list",
     ),
+    path("<str:username>/api/following_list/", views.FollowingJsonView.as_view(), name="api_following_list"),
+    path("<str:username>/api/follower_list/", views.FollowerJsonView.as_view(), name="api_follower_list"),
 ]
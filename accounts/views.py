@@ -1,16 +1,26 @@
+from asgiref.sync import sync_to_async
 from django.contrib import messages
 from django.contrib.auth import authenticate, get_user_model, login
 from django.contrib.auth import views as auth_views
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db import transaction
+from django.db.models import F, Q
 from django.http import HttpResponseBadRequest
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy
 from django.views.generic import CreateView, DetailView, ListView, View
 
+from mysite.asyncviews import AsyncLoginRequiredMixin, aget_object_or_404
+from mysite.routers import ReplicaReadMixin
+from tweets.api import KeysetJsonView
+from tweets.conditional import ConditionalGetMixin, profile_etag
 from tweets.models import Like, Tweet
+from tweets.pagination import KeysetPaginationMixin
+from tweets.timeline import backfill, remove_following
 
+from .cache import render_header
 from .forms import CustomUserCreationForm, LoginForm
-from .models import FriendShip
+from .models import FriendShip, Recommendation
 
 User = get_user_model()
 
@@ -63,69 +73,154 @@ template_nameはログアウト後に表示する画面。
 """
 
 
-class UserProfileView(LoginRequiredMixin, DetailView):
+class UserProfileView(LoginRequiredMixin, ReplicaReadMixin, ConditionalGetMixin, KeysetPaginationMixin, DetailView):
+    # ツイートは (user, created_at, id) のインデックスでカーソルページングし、ヘッダーはユーザーごとにキャッシュする
     model = User
+    queryset = User.objects.live().select_related("stats")
     template_name = "accounts/user_profile.html"
     slug_field = "username"
     slug_url_kwarg = "username"
+    etag_func = staticmethod(profile_etag)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = self.object
-        context["tweet_list"] = Tweet.objects.select_related("user").prefetch_related("like_tweet").filter(user=user)
+        _, page, tweet_list, _ = self.paginate_queryset(Tweet.objects.filter(user=user), self.paginate_by)
+        for tweet in tweet_list:
+            tweet.user = user
+        context["page_obj"] = page
+        context["tweet_list"] = tweet_list
+        context["header_html"] = render_header(user)
         context["is_following"] = FriendShip.objects.filter(following=user, follower=self.request.user).exists()
-        context["following_count"] = FriendShip.objects.filter(follower=user).count()
-        context["follower_count"] = FriendShip.objects.filter(following=user).count()
-        context["liked_list"] = Like.objects.filter(user=self.request.user).values_list("tweet", flat=True)
+        context["following_count"] = user.following_count
+        context["follower_count"] = user.follower_count
+        context["liked_list"] = Like.objects.mark_liked(self.request.user, context["tweet_list"])
+        context["recommendation_list"] = Recommendation.objects.for_user(self.request.user)
         return context
 
 
-class FollowView(LoginRequiredMixin, View):
-    def post(self, request, *args, **kwargs):
+@sync_to_async
+def follow(follower, following):
+    # フォローとタイムラインへの取り込みを 1 トランザクションで行う
+    with transaction.atomic():
+        created = FriendShip.objects.follow(follower, following)
+        if created:
+            backfill(follower, following)
+    return created
+
+
+@sync_to_async
+def unfollow(follower, following):
+    with transaction.atomic():
+        FriendShip.objects.unfollow(follower, following)
+        remove_following(follower, following)
+
+
+class FollowView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, *args, **kwargs):
         follower = self.request.user
-        following = get_object_or_404(User, username=self.kwargs["username"])
+        following = await aget_object_or_404(User.objects.live(), username=self.kwargs["username"])
 
         if follower == following:
             return HttpResponseBadRequest("自分自身をフォローすることはできません")
-        if FriendShip.objects.filter(follower=follower, following=following).exists():
+        if not await follow(follower, following):
             messages.warning(request, f"あなたはすでに { following.username } をフォローしています。")
             return redirect("tweets:home")
-        FriendShip.objects.create(follower=follower, following=following)
         messages.info(request, f"{ following.username } をフォローしました。")
         return redirect("tweets:home")
 
 
-class UnFollowView(LoginRequiredMixin, View):
-    def post(self, request, *args, **kwargs):
+class UnFollowView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, *args, **kwargs):
         follower = self.request.user
-        following = get_object_or_404(User, username=self.kwargs["username"])
+        following = await aget_object_or_404(User.objects.live(), username=self.kwargs["username"])
 
         if follower == following:
             return HttpResponseBadRequest("無効な操作です。")
 
-        friend = FriendShip.objects.filter(following=following, follower=follower)
-        friend.delete()
+        await unfollow(follower, following)
         messages.info(request, f"{following.username} のフォローを解除しました。")
         return redirect("tweets:home")
 
 
-class FollowingListView(LoginRequiredMixin, ListView):
-    model = User
-    template_name = "accounts/following_list.html"
+class FriendShipListView(LoginRequiredMixin, ReplicaReadMixin, KeysetPaginationMixin, ListView):
+    """
+    username のユーザーのフォロー・フォロワーを FriendShip の (date_created, id) でカーソルページングする。
+    相手のユーザー名だけを取得し、ログインユーザーとの関係はページごとに 1 回のクエリで調べる。
+    削除済みのユーザーは、purge がフォローの行を削除するまでの間も一覧に表示しない。
+    """
+
+    cursor_keys = ("-date_created", "-id")
+    # filter_field で username のユーザーに絞り込み、related_field 側のユーザーを一覧にする
+    filter_field = None
+    related_field = None
+
+    def get_queryset(self):
+        self.user = get_object_or_404(User.objects.live(), username=self.kwargs["username"])
+        return FriendShip.objects.filter(
+            **{self.filter_field: self.user, f"{self.related_field}__deleted_at__isnull": True}
+        ).values(
+            "id", "date_created", user_id=F(f"{self.related_field}_id"), username=F(f"{self.related_field}__username")
+        )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = get_object_or_404(User, username=self.kwargs["username"])
-        context["following_list"] = FriendShip.objects.select_related("following").filter(follower=user)
+        rows = context["object_list"]
+        me = self.request.user
+        user_ids = [row["user_id"] for row in rows]
+        you_follow = set()
+        follows_you = set()
+        if user_ids:
+            relations = FriendShip.objects.filter(
+                Q(follower=me, following_id__in=user_ids) | Q(following=me, follower_id__in=user_ids)
+            ).values_list("follower_id", "following_id")
+            for follower_id, following_id in relations:
+                if follower_id == me.pk:
+                    you_follow.add(following_id)
+                if following_id == me.pk:
+                    follows_you.add(follower_id)
+        for row in rows:
+            row["you_follow"] = row["user_id"] in you_follow
+            row["follows_you"] = row["user_id"] in follows_you
+        context["object"] = self.user
         return context
 
 
-class FollowerListView(LoginRequiredMixin, ListView):
-    model = User
+class FollowingListView(FriendShipListView):
+    template_name = "accounts/following_list.html"
+    context_object_name = "following_list"
+    filter_field = "follower"
+    related_field = "following"
+
+
+class FollowerListView(FriendShipListView):
     template_name = "accounts/follower_list.html"
+    context_object_name = "follower_list"
+    filter_field = "following"
+    related_field = "follower"
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        user = get_object_or_404(User, username=self.kwargs["username"])
-        context["follower_list"] = FriendShip.objects.select_related("follower").filter(following=user)
-        return context
+
+class FriendShipJsonView(KeysetJsonView):
+    cursor_keys = ("-date_created", "-id")
+    # filter_field で username のユーザーに絞り込み、related_field 側のユーザー名を返す
+    filter_field = None
+    related_field = None
+
+    def get_queryset(self):
+        user = get_object_or_404(User.objects.live(), username=self.kwargs["username"])
+        return FriendShip.objects.filter(
+            **{self.filter_field: user, f"{self.related_field}__deleted_at__isnull": True}
+        ).values("id", "date_created", f"{self.related_field}__username")
+
+    def serialize(self, row):
+        return {"username": row[f"{self.related_field}__username"], "date_created": row["date_created"]}
+
+
+class FollowingJsonView(FriendShipJsonView):
+    filter_field = "follower"
+    related_field = "following"
+
+
+class FollowerJsonView(FriendShipJsonView):
+    filter_field = "following"
+    related_field = "follower"
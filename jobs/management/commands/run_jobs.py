@@ -0,0 +1,48 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from jobs.worker import Worker
+
+
+def _run_worker(threads, poll_interval, once):
+    # 子プロセスは親の DB 接続を使わずに、自分の接続を作る
+    connections.close_all()
+    return Worker(threads=threads, poll_interval=poll_interval).run(once=once)
+
+
+class Command(BaseCommand):
+    help = "データベースに登録したジョブを実行するワーカー"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=1, help="ワーカーのプロセス数")
+        parser.add_argument("--threads", type=int, default=1, help="1 プロセスあたりのスレッド数")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="実行待ちのジョブがないときに待つ秒数")
+        parser.add_argument("--once", action="store_true", help="実行できるジョブがなくなったら終了する")
+
+    def handle(self, *args, **options):
+        if options["processes"] < 1 or options["threads"] < 1:
+            raise CommandError("--processes と --threads は 1 以上を指定してください。")
+        worker_args = (options["threads"], options["poll_interval"], options["once"])
+        if options["processes"] == 1:
+            stats = _run_worker(*worker_args)
+            summary = f"成功: {stats['done']} 件, 再試行: {stats['pending']} 件, 失敗: {stats['failed']} 件"
+            self.stdout.write(self.style.SUCCESS(f"ジョブを実行しました ({summary})"))
+            return
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise CommandError("--processes を 2 以上にするには fork できる OS が必要です。")
+        # fork する前に接続を閉じて、親の接続を子プロセスと共有しないようにする
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        processes = [
+            context.Process(target=_run_worker, args=worker_args, daemon=True) for _ in range(options["processes"])
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.13 on 2026-10-18 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("jobs", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="job",
+            name="job_dedupe_unique",
+        ),
+        migrations.AddConstraint(
+            model_name="job",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status", "pending")), fields=("dedupe_key",), name="job_dedupe_unique"
+            ),
+        ),
+    ]
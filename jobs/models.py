@@ -0,0 +1,111 @@
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .registry import get_task
+
+
+class JobManager(models.Manager):
+    def enqueue(self, name, payload=None, dedupe_key=None, delay=0):
+        """
+        ジョブを 1 回の INSERT で登録する。
+        dedupe_key が同じ実行待ち (pending) のジョブがすでにあれば、何も登録しない。
+        実行中 (running) のジョブは数えないので、実行中に増えた分はあとでもう一度実行される。
+        """
+        get_task(name)
+        job = self.model(
+            name=name,
+            payload=payload or {},
+            dedupe_key=dedupe_key,
+            max_attempts=settings.JOB_MAX_ATTEMPTS,
+            run_at=timezone.now() + timedelta(seconds=delay),
+        )
+        if dedupe_key is None:
+            job.save(force_insert=True, using=self.db)
+        else:
+            self.bulk_create([job], ignore_conflicts=True)
+        return job
+
+    def claim(self, worker_id, limit):
+        """
+        実行できるジョブを limit 件まで取り出し、running にして返す。
+        ロックが JOB_LOCK_TIMEOUT より古い running のジョブ (ワーカーが落ちたもの) も取り直す。
+        """
+        now = timezone.now()
+        ready = Q(status=Job.PENDING, run_at__lte=now) | Q(
+            status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT)
+        )
+        # 取り出したジョブを見分けるための、このバッチだけの値
+        token = f"{worker_id}:{uuid.uuid4().hex}"
+        with transaction.atomic(using=self.db):
+            candidates = self.filter(ready).order_by("run_at", "id")
+            if connections[self.db].features.has_select_for_update_skip_locked:
+                # ほかのワーカーがロックしている行は待たずに飛ばす (PostgreSQL / MySQL 8)
+                ids = list(candidates.select_for_update(skip_locked=True).values_list("pk", flat=True)[:limit])
+            else:
+                # SQLite には行ロックがないので、選ぶのと取るのを 1 つの UPDATE で行う。
+                # 書き込みは 1 つずつしか実行されないので、同じジョブを 2 つのワーカーが取ることはない
+                ids = candidates.values("pk")[:limit]
+            self.filter(pk__in=ids).update(
+                status=Job.RUNNING, locked_by=token, locked_at=now, started_at=now, attempts=F("attempts") + 1
+            )
+            return list(self.filter(status=Job.RUNNING, locked_by=token).order_by("run_at", "id"))
+
+    def prune(self, batch_size=1000):
+        # 保存期間 (JOB_RETENTION_SECONDS) を過ぎた完了済みのジョブを batch_size 件だけ削除する
+        before = timezone.now() - timedelta(seconds=settings.JOB_RETENTION_SECONDS)
+        ids = list(self.filter(status=Job.DONE, finished_at__lt=before).values_list("pk", flat=True)[:batch_size])
+        if ids:
+            self.filter(pk__in=ids).delete()
+        return len(ids)
+
+
+class Job(models.Model):
+    # manage.py run_jobs が取り出して実行する、データベースに保存したジョブ
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [(status, status) for status in (PENDING, RUNNING, DONE, FAILED)]
+
+    # jobs.registry.task で登録した名前
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    dedupe_key = models.CharField(max_length=200, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=1)
+    # この時刻より後に実行する (再試行のときは待つ時間を延ばす)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # 最後の実行について、登録から実行開始までの待ち時間と、実行にかかった時間 (秒)
+    wait_seconds = models.FloatField(null=True, blank=True)
+    run_seconds = models.FloatField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    objects = JobManager()
+
+    class Meta:
+        constraints = [
+            # 同じ dedupe_key の実行待ちのジョブは 1 つだけ
+            models.UniqueConstraint(fields=["dedupe_key"], condition=Q(status="pending"), name="job_dedupe_unique"),
+        ]
+        indexes = [
+            # 実行待ちのジョブを run_at 順に取り出す
+            models.Index(fields=["run_at", "id"], condition=Q(status="pending"), name="job_pending_idx"),
+            # ロックが古くなった実行中のジョブを探す
+            models.Index(fields=["locked_at"], condition=Q(status="running"), name="job_running_idx"),
+            # 完了済みのジョブを保存期間が過ぎたら削除する
+            models.Index(fields=["finished_at"], condition=Q(status="done"), name="job_done_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
@@ -0,0 +1,26 @@
+# ジョブの名前と、実行する関数の対応表
+_tasks = {}
+
+
+class UnknownTask(Exception):
+    pass
+
+
+def task(name):
+    """
+    関数をジョブとして登録するデコレーター。各アプリの tasks.py で使う。
+    関数は Job.payload をキーワード引数として受け取る。
+    """
+
+    def decorator(func):
+        _tasks[name] = func
+        return func
+
+    return decorator
+
+
+def get_task(name):
+    try:
+        return _tasks[name]
+    except KeyError:
+        raise UnknownTask(name)
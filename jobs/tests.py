@@ -0,0 +1,214 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import FriendShip
+from jobs.models import Job
+from jobs.registry import UnknownTask, task
+from jobs.worker import Worker, run_job
+from tweets.models import TimelineEntry, Tweet
+
+User = get_user_model()
+
+calls = []
+
+
+@task("jobs.tests.record")
+def record(value=None):
+    calls.append(value)
+
+
+@task("jobs.tests.fail")
+def fail():
+    raise ValueError("失敗")
+
+
+class TestEnqueue(TestCase):
+    def test_enqueue_is_one_insert(self):
+        with self.assertNumQueries(1):
+            Job.objects.enqueue("jobs.tests.record", {"value": 1})
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.payload), (Job.PENDING, {"value": 1}))
+
+    def test_dedupe_key(self):
+        Job.objects.enqueue("jobs.tests.record", dedupe_key="record")
+        Job.objects.enqueue("jobs.tests.record", dedupe_key="record")
+        self.assertEqual(Job.objects.count(), 1)
+        # 完了したジョブは数えない
+        Job.objects.update(status=Job.DONE)
+        Job.objects.enqueue("jobs.tests.record", dedupe_key="record")
+        self.assertEqual(Job.objects.filter(status=Job.PENDING).count(), 1)
+
+    def test_dedupe_key_ignores_running(self):
+        # 実行中に増えた分を取りこぼさないように、実行中のジョブとは別に登録する
+        Job.objects.enqueue("jobs.tests.record", dedupe_key="record")
+        Job.objects.claim("worker1", 1)
+        Job.objects.enqueue("jobs.tests.record", dedupe_key="record")
+        self.assertEqual(Job.objects.filter(status=Job.PENDING).count(), 1)
+        self.assertEqual(Job.objects.filter(status=Job.RUNNING).count(), 1)
+
+    def test_unknown_task(self):
+        with self.assertRaises(UnknownTask):
+            Job.objects.enqueue("jobs.tests.missing")
+        self.assertFalse(Job.objects.exists())
+
+
+class TestClaim(TestCase):
+    def test_claims_do_not_overlap(self):
+        for value in range(5):
+            Job.objects.enqueue("jobs.tests.record", {"value": value})
+        first = Job.objects.claim("worker1", 3)
+        second = Job.objects.claim("worker2", 3)
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertFalse({job.pk for job in first} & {job.pk for job in second})
+        self.assertTrue(all(job.status == Job.RUNNING and job.attempts == 1 for job in first + second))
+        self.assertEqual(Job.objects.claim("worker3", 3), [])
+
+    def test_skips_future_jobs(self):
+        Job.objects.enqueue("jobs.tests.record", delay=60)
+        self.assertEqual(Job.objects.claim("worker1", 1), [])
+
+    def test_reclaims_stale_lock(self):
+        Job.objects.enqueue("jobs.tests.record")
+        (job,) = Job.objects.claim("worker1", 1)
+        self.assertEqual(Job.objects.claim("worker2", 1), [])
+        with override_settings(JOB_LOCK_TIMEOUT=0):
+            (reclaimed,) = Job.objects.claim("worker2", 1)
+        self.assertEqual((reclaimed.pk, reclaimed.attempts), (job.pk, 2))
+        # 取り直されたあとは、最初のワーカーの結果で上書きしない
+        run_job(job)
+        reclaimed.refresh_from_db()
+        self.assertEqual(reclaimed.status, Job.RUNNING)
+
+    def test_prune(self):
+        Job.objects.enqueue("jobs.tests.record")
+        Job.objects.update(status=Job.DONE, finished_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(Job.objects.prune(), 1)
+        self.assertFalse(Job.objects.exists())
+
+
+@override_settings(JOB_MAX_ATTEMPTS=2, JOB_RETRY_DELAY=10)
+class TestRunJob(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_success(self):
+        Job.objects.enqueue("jobs.tests.record", {"value": "ok"})
+        (job,) = Job.objects.claim("worker1", 1)
+        self.assertEqual(run_job(job), Job.DONE)
+        self.assertEqual(calls, ["ok"])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (Job.DONE, ""))
+        self.assertIsNotNone(job.finished_at)
+        self.assertGreaterEqual(job.wait_seconds, 0)
+        self.assertGreaterEqual(job.run_seconds, 0)
+
+    def test_retry_then_fail(self):
+        Job.objects.enqueue("jobs.tests.fail")
+        (job,) = Job.objects.claim("worker1", 1)
+        self.assertEqual(run_job(job), Job.PENDING)
+        job.refresh_from_db()
+        self.assertIn("ValueError", job.last_error)
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=5))
+        # 待ち時間が過ぎるまでは取り出さない
+        self.assertEqual(Job.objects.claim("worker1", 1), [])
+        Job.objects.update(run_at=timezone.now())
+        (job,) = Job.objects.claim("worker1", 1)
+        self.assertEqual(run_job(job), Job.FAILED)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_retry_with_pending_duplicate(self):
+        Job.objects.enqueue("jobs.tests.fail", dedupe_key="fail")
+        (job,) = Job.objects.claim("worker1", 1)
+        Job.objects.enqueue("jobs.tests.fail", dedupe_key="fail")
+        # 実行待ちの同じジョブがあるので、pending には戻さない
+        self.assertEqual(run_job(job), Job.FAILED)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(Job.objects.filter(status=Job.PENDING).count(), 1)
+
+    def test_unregistered_task_fails_immediately(self):
+        Job.objects.create(name="jobs.tests.removed", max_attempts=3)
+        (job,) = Job.objects.claim("worker1", 1)
+        self.assertEqual(run_job(job), Job.FAILED)
+
+
+class TestWorker(TransactionTestCase):
+    # ワーカーのスレッドは別の接続を使うので、テストのデータをコミットしておく
+    def setUp(self):
+        calls.clear()
+
+    def test_survives_database_error(self):
+        Job.objects.enqueue("jobs.tests.record", {"value": "ok"})
+        claim = Job.objects.claim
+        errors = [OperationalError("database is locked")]
+
+        def flaky_claim(*args):
+            # 1 回目だけ "database is locked" で失敗する
+            if errors:
+                raise errors.pop()
+            return claim(*args)
+
+        with mock.patch.object(Job.objects, "claim", side_effect=flaky_claim):
+            with self.assertLogs("jobs.worker", "ERROR"):
+                stats = Worker(poll_interval=0).run(once=True)
+        self.assertEqual(stats[Job.DONE], 1)
+        self.assertEqual(calls, ["ok"])
+
+
+class TestRunJobsCommand(TransactionTestCase):
+    # ワーカーのスレッドは別の接続を使うので、テストのデータをコミットしておく
+    def setUp(self):
+        calls.clear()
+        # ほかのテストで同じ id のツイートのカードがキャッシュされていることがある
+        cache.clear()
+
+    def test_once_drains_queue(self):
+        for value in range(3):
+            Job.objects.enqueue("jobs.tests.record", {"value": value})
+        out = StringIO()
+        call_command("run_jobs", "--once", "--threads", "2", stdout=out)
+        self.assertEqual(sorted(calls), [0, 1, 2])
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 3)
+        self.assertIn("成功: 3 件", out.getvalue())
+
+    @override_settings(TIMELINE_FANOUT_ASYNC=True)
+    def test_async_fan_out(self):
+        author = User.objects.create_user(username="author", password="testpassword")
+        follower = User.objects.create_user(username="follower", password="testpassword")
+        FriendShip.objects.follow(follower, author)
+        self.client.login(username="author", password="testpassword")
+        self.client.post(reverse("tweets:create"), {"content": "later"})
+        tweet = Tweet.objects.get()
+        # 本人の inbox にはすぐ書き込み、フォロワーの分はジョブに回す
+        self.assertTrue(TimelineEntry.objects.filter(user=author, tweet=tweet).exists())
+        self.assertFalse(TimelineEntry.objects.filter(user=follower, tweet=tweet).exists())
+        self.assertTrue(Job.objects.filter(name="tweets.fan_out", dedupe_key=f"tweets.fan_out:{tweet.pk}").exists())
+        # ジョブが書き込む前に表示したタイムラインは、書き込んだ後に 304 にならない
+        self.client.login(username="follower", password="testpassword")
+        etag = self.client.get(reverse("tweets:timeline"))["ETag"]
+        call_command("run_jobs", "--once", stdout=StringIO())
+        self.assertTrue(TimelineEntry.objects.filter(user=follower, tweet=tweet).exists())
+        response = self.client.get(reverse("tweets:timeline"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "later")
+
+    def test_delete_enqueues_purge(self):
+        user = User.objects.create_user(username="author", password="testpassword")
+        self.client.login(username="author", password="testpassword")
+        tweets = [Tweet.objects.create(user=user, content=str(i)) for i in range(2)]
+        for tweet in tweets:
+            self.client.post(reverse("tweets:delete", kwargs={"pk": tweet.pk}))
+        self.assertEqual(Job.objects.filter(name="tweets.purge_tombstones").count(), 1)
+        call_command("run_jobs", "--once", stdout=StringIO())
+        self.assertFalse(Tweet.all_objects.exists())
@@ -0,0 +1,143 @@
+import logging
+import os
+import socket
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, OperationalError, close_old_connections, transaction
+from django.utils import timezone
+
+from .models import Job
+from .registry import UnknownTask, get_task
+
+logger = logging.getLogger(__name__)
+
+# ジョブの結果の保存を "database is locked" で失敗したときに、やり直す回数
+SAVE_RETRIES = 3
+
+
+def retry_delay(attempts):
+    # 1 回目の失敗は JOB_RETRY_DELAY 秒後、以降は倍々に待つ
+    return settings.JOB_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+def run_job(job):
+    """
+    ジョブを実行し、結果と時間を保存して、最終的な status を返す。
+    失敗したときは max_attempts に達するまで、待つ時間を延ばしながら pending に戻す。
+    同じ dedupe_key のジョブがすでに実行待ちなら、そちらに任せて pending には戻さない。
+    """
+    started = time.monotonic()
+    error = None
+    try:
+        if job.attempts > job.max_attempts:
+            # ワーカーが落ちて取り直したジョブも、試行回数に数える
+            raise RuntimeError(f"試行回数の上限 ({job.max_attempts} 回) を超えました。")
+        get_task(job.name)(**job.payload)
+    except UnknownTask:
+        error = f"登録されていないジョブです: {job.name}"
+        job.attempts = job.max_attempts
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        close_old_connections()
+    now = timezone.now()
+    fields = {
+        "locked_by": "",
+        "locked_at": None,
+        "finished_at": now,
+        "wait_seconds": (job.started_at - job.created_at).total_seconds(),
+        "run_seconds": time.monotonic() - started,
+        "last_error": error or "",
+    }
+    if error is None:
+        fields["status"] = Job.DONE
+    elif job.attempts < job.max_attempts:
+        fields.update(status=Job.PENDING, run_at=now + timedelta(seconds=retry_delay(job.attempts)))
+    else:
+        fields["status"] = Job.FAILED
+    save_result(job, fields)
+    logger.info(
+        "%s #%s %s (attempt %s/%s, wait %.3fs, run %.3fs)",
+        job.name,
+        job.pk,
+        fields["status"],
+        job.attempts,
+        job.max_attempts,
+        fields["wait_seconds"],
+        fields["run_seconds"],
+    )
+    return fields["status"]
+
+
+def save_result(job, fields):
+    # 実行中にロックが古くなって、ほかのワーカーに取り直されていたら上書きしない
+    current = Job.objects.filter(pk=job.pk, locked_by=job.locked_by)
+    for retry in range(SAVE_RETRIES + 1):
+        try:
+            with transaction.atomic():
+                current.update(**fields)
+            return
+        except IntegrityError:
+            # 実行中に同じ dedupe_key のジョブが登録されていて、pending に戻せない
+            fields.update(status=Job.FAILED, run_at=job.run_at)
+        except OperationalError:
+            if retry == SAVE_RETRIES:
+                raise
+            time.sleep(0.1 * 2**retry)
+
+
+class Worker:
+    """
+    threads 個のスレッドでジョブを実行するワーカー。
+    空いているスレッドの数だけジョブをまとめて取り出し、実行待ちがなければ poll_interval 秒待つ。
+    """
+
+    def __init__(self, threads=1, poll_interval=1.0, worker_id=None):
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.stats = {Job.DONE: 0, Job.PENDING: 0, Job.FAILED: 0}
+
+    def run(self, once=False):
+        # once のときは、実行できるジョブがなくなったら終わる
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            running = set()
+            while True:
+                jobs = []
+                if len(running) < self.threads:
+                    try:
+                        jobs = Job.objects.claim(self.worker_id, self.threads - len(running))
+                    except DatabaseError:
+                        self.back_off("ジョブを取り出せませんでした。")
+                        continue
+                running.update(executor.submit(run_job, job) for job in jobs)
+                if not running:
+                    if once:
+                        return self.stats
+                    try:
+                        Job.objects.prune()
+                    except DatabaseError:
+                        self.back_off("保存期間を過ぎたジョブを削除できませんでした。")
+                        continue
+                    close_old_connections()
+                    time.sleep(self.poll_interval)
+                    continue
+                # スレッドが空いているときは、新しいジョブを取りに行けるように poll_interval 秒で戻る
+                timeout = None if len(running) >= self.threads else self.poll_interval
+                done, running = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        self.stats[future.result()] += 1
+                    except DatabaseError:
+                        # 結果を保存できなかったジョブは、ロックが古くなってから取り直される
+                        self.back_off("ジョブの結果を保存できませんでした。")
+
+    def back_off(self, message):
+        # "database is locked" などの一時的なエラーでは止まらずに、poll_interval 秒待ってやり直す
+        logger.exception(message)
+        close_old_connections()
+        time.sleep(self.poll_interval)
@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from tweets.events import EventStreamApp
+
+# /tweets/events/ の Server-Sent Events だけは Django を通さずに長時間の接続として処理する
+application = EventStreamApp(django_application)
@@ -0,0 +1,22 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import Http404
+from django.shortcuts import _get_queryset
+
+
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+    # async def のハンドラを持つビュー用。request.user の読み込み(セッション・DB)だけをスレッドで行う
+    async def dispatch(self, request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return self.handle_no_permission()
+        handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+        return await handler(request, *args, **kwargs)
+
+
+async def aget_object_or_404(klass, *args, **kwargs):
+    # get_object_or_404 の非同期版
+    queryset = _get_queryset(klass)
+    try:
+        return await queryset.aget(*args, **kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404("No %s matches the given query." % queryset.model._meta.object_name)
@@ -0,0 +1,18 @@
+from django.conf import settings
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    connection_created で呼ばれ、新しい SQLite の接続に SQLITE_PRAGMAS を設定する。
+    SQLITE_TRANSACTION_MODE が "IMMEDIATE" なら、atomic() を BEGIN IMMEDIATE で始めて最初に書き込みロックを取る。
+    BEGIN (DEFERRED) のまま読んでから書くと、途中で他の接続が書き込んだときに busy_timeout を待たずに
+    "database is locked" になるため (Django 5.1 以降は OPTIONS の transaction_mode で同じことができる)。
+    """
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    mode = settings.SQLITE_TRANSACTION_MODE
+    if mode:
+        connection._start_transaction_under_autocommit = lambda: connection.cursor().execute(f"BEGIN {mode}")
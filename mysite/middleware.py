@@ -0,0 +1,64 @@
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    # connection.execute_wrapper に渡して、リクエスト中のクエリ数・時間・重複を数える
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        # パラメーターだけが違う同じ SQL が 2 回目以降に実行された回数 (N+1 の目安)
+        return sum(count - 1 for count in self.statements.values())
+
+
+class QueryBudgetMiddleware:
+    """
+    リクエストごとのクエリ数・DB 時間・重複 SQL を Server-Timing ヘッダーで返し、
+    QUERY_BUDGETS で URL 名ごとに決めたクエリ数を超えたら警告を出す。
+    同期のミドルウェアなので、非同期ビューの ORM 呼び出しもこのスレッドの接続で数えられる。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        timing = f'db;dur={stats.duration * 1000:.2f};desc="{stats.count} queries, {stats.duplicates} duplicates"'
+        response["Server-Timing"] = timing
+        match = request.resolver_match
+        budget = settings.QUERY_BUDGETS.get(match.view_name) if match else None
+        if budget is not None and stats.count > budget:
+            logger.warning(
+                "%s (%s) exceeded its query budget: %d queries (budget %d, %d duplicates, %.2f ms)",
+                match.view_name,
+                request.path,
+                stats.count,
+                budget,
+                stats.duplicates,
+                stats.duration * 1000,
+            )
+        return response
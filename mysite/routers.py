@@ -0,0 +1,85 @@
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# リクエストごとの振り分けの状態 (ReplicaRoutingMiddleware が作る。リクエストの外では None)
+_state = ContextVar("replica_routing_state", default=None)
+# プライマリから読む期限 (UNIX 時刻) を入れておくセッションのキー
+STICKY_SESSION_KEY = "_db_primary_until"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class RoutingState:
+    def __init__(self):
+        self.read_replica = False
+        self.wrote = False
+        # このリクエストで読むレプリカ (遅れ具合の違うレプリカを混ぜて読まないように、最初の読み取りで 1 つに決める)
+        self.replica = None
+
+
+class ReplicaRouter:
+    """
+    書き込みは常にプライマリ (default) に送る。
+    読み取りは ReplicaReadMixin を付けたビューの中だけ、DATABASE_REPLICAS のどれか 1 つに送る。
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state and state.read_replica and settings.DATABASE_REPLICAS:
+            if state.replica is None:
+                state.replica = random.choice(settings.DATABASE_REPLICAS)
+            return state.replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        # セッション自体の保存は「自分の書き込み」に数えない (数えると毎回プライマリに張り付く)
+        if state and model._meta.app_label != "sessions":
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカはプライマリの複製なので、どの組み合わせでも同じデータを指す
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # スキーマはレプリケーションで複製されるので、レプリカにはマイグレーションしない
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    # SessionMiddleware より内側に置く。書き込んだリクエストのあとは DATABASE_STICKY_SECONDS だけプライマリから読む
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = RoutingState()
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        # いいねのバッファのように書き込みを後回しにする処理もあるので、成功した POST なども書き込みとみなす
+        wrote = state.wrote or (request.method not in SAFE_METHODS and response.status_code < 400)
+        if wrote and hasattr(request, "session") and request.user.is_authenticated:
+            request.session[STICKY_SESSION_KEY] = time.time() + settings.DATABASE_STICKY_SECONDS
+        return response
+
+
+def is_sticky(request):
+    until = request.session.get(STICKY_SESSION_KEY) if hasattr(request, "session") else None
+    return until is not None and until > time.time()
+
+
+class ReplicaReadMixin:
+    # 読み取り専用のビューに付ける。GET などの安全なメソッドで、直前に書き込んでいなければレプリカから読む
+    def dispatch(self, request, *args, **kwargs):
+        state = _state.get()
+        if state and request.method in SAFE_METHODS and not is_sticky(request):
+            state.read_replica = True
+        return super().dispatch(request, *args, **kwargs)
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -37,14 +39,18 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "mysite.apps.MySiteConfig",
     "accounts.apps.AccountsConfig",
     "tweets.apps.TweetsConfig",
+    "jobs.apps.JobsConfig",
     "welcome.apps.WelcomeConfig",
 ]
 
 MIDDLEWARE = [
+    "mysite.middleware.QueryBudgetMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
+    "mysite.routers.ReplicaRoutingMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
@@ -76,12 +82,93 @@ WSGI_APPLICATION = "mysite.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# 環境変数 DJANGO_DB_PROFILE で切り替える
+# "development": SQLite の既定の設定で、リクエストごとに接続し直す
+# "production": WAL で読み書きを並行させ、書き込みはロックを待って順番に行い、接続を使い回す (DJANGO_CONN_MAX_AGE 秒)
+DATABASE_PROFILES = {
+    "development": {
+        "CONN_MAX_AGE": 0,
+        "PRAGMAS": {},
+        "TRANSACTION_MODE": None,
+    },
+    "production": {
+        "CONN_MAX_AGE": 60,
+        "PRAGMAS": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            # 負の値は KiB 単位 (64 MiB)
+            "cache_size": -64000,
+            "mmap_size": 256 * 1024 * 1024,
+            "busy_timeout": 5000,
+            "temp_store": "MEMORY",
+        },
+        "TRANSACTION_MODE": "IMMEDIATE",
+    },
+}
+DATABASE_PROFILE = os.environ.get("DJANGO_DB_PROFILE", "development")
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": os.environ.get("DJANGO_DB_NAME", BASE_DIR / "db.sqlite3"),
+        "CONN_MAX_AGE": int(
+            os.environ.get("DJANGO_CONN_MAX_AGE", DATABASE_PROFILES[DATABASE_PROFILE]["CONN_MAX_AGE"])
+        ),
+        # 使い回す接続は、リクエストの最初に使えるかどうかを確かめる
+        "CONN_HEALTH_CHECKS": True,
     }
 }
+# 読み取り専用のレプリカ (DJANGO_DB_REPLICAS にカンマ区切りで SQLite のファイルを指定する)
+# ファイルの複製 (Litestream など) はこのアプリの外で行う
+DATABASE_REPLICAS = []
+for index, name in enumerate(filter(None, os.environ.get("DJANGO_DB_REPLICAS", "").split(",")), start=1):
+    DATABASES[f"replica{index}"] = {**DATABASES["default"], "NAME": name, "TEST": {"MIRROR": "default"}}
+    DATABASE_REPLICAS.append(f"replica{index}")
+DATABASE_ROUTERS = ["mysite.routers.ReplicaRouter"]
+# 自分が書き込んだあと、この秒数のあいだはレプリカを使わずプライマリから読む (read-your-writes)
+DATABASE_STICKY_SECONDS = 10
+
+# 新しい接続ごとに mysite.db.configure_sqlite で設定する PRAGMA
+SQLITE_PRAGMAS = DATABASE_PROFILES[DATABASE_PROFILE]["PRAGMAS"]
+SQLITE_TRANSACTION_MODE = DATABASE_PROFILES[DATABASE_PROFILE]["TRANSACTION_MODE"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # セッション用 (ツイートカードのキャッシュを消してもログイン状態が消えないように分ける)
+    "sessions": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "sessions",
+    },
+    # ETag に使う全体のバージョン (削除・いいね) 用。プロセスごとの LocMemCache だと、
+    # ほかのプロセスで進めたバージョンが見えずに 304 を返してしまうので、すべてのプロセスで共有する。
+    # 複数のホストで動かすときは Redis や Memcached などに置き換える
+    "versions": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get("DJANGO_VERSION_CACHE_DIR", os.path.join(tempfile.gettempdir(), "mysite-versions")),
+    },
+}
+
+
+# Sessions
+# https://docs.djangoproject.com/en/4.0/topics/http/sessions/
+
+# "db": 毎リクエストでデータベースを読む
+# "cached_db": キャッシュにあればデータベースを読まない (書き込みは両方に行う)
+# "signed_cookies": データベースもキャッシュも使わず、署名付きの Cookie に保存する
+SESSION_PROFILES = {
+    "db": "django.contrib.sessions.backends.db",
+    "cached_db": "django.contrib.sessions.backends.cached_db",
+    "signed_cookies": "django.contrib.sessions.backends.signed_cookies",
+}
+SESSION_PROFILE = "cached_db"
+SESSION_ENGINE = SESSION_PROFILES[SESSION_PROFILE]
+SESSION_CACHE_ALIAS = "sessions"
 
 
 # Password validation
@@ -126,7 +213,8 @@ STATIC_ROOT = BASE_DIR
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
-MESSAGE_STORAGE = "django.contrib.messages.storage.session.SessionStorage"
+# フラッシュメッセージは Cookie に保存し、表示のたびにセッションを書き換えない
+MESSAGE_STORAGE = "django.contrib.messages.storage.cookie.CookieStorage"
 
 AUTH_USER_MODEL = "accounts.CustomUser"
 
@@ -135,6 +223,72 @@ LOGIN_URL = "accounts:login"
 LOGIN_REDIRECT_URL = "tweets:home"
 LOGOUT_REDIRECT_URL = "welcome:index"
 
+# フォロー中タイムライン
+# フォロワー数がこの値以上のユーザーのツイートは inbox に書き込まず、読み出し時にマージする
+TIMELINE_FANOUT_THRESHOLD = 10000
+# フォローしたときに inbox へ取り込む直近のツイート数
+TIMELINE_BACKFILL_SIZE = 20
+# フォロワーの inbox への書き込みをジョブ (tweets.fan_out) に回し、投稿のリクエストでは本人の inbox だけに書き込む
+TIMELINE_FANOUT_ASYNC = False
+
+# ツイートカードのフラグメントキャッシュ (カードには変わらない内容しか入れないので、プロセスごとのキャッシュでよい)
+TWEET_CARD_CACHE = "default"
+# ETag に使う全体のバージョンを置くキャッシュ (プロセス間で共有するもの)
+TWEET_VERSION_CACHE = "versions"
+TWEET_CARD_TIMEOUT = 60 * 60 * 24
+# プロフィールのヘッダーのキャッシュ (accounts.cache.render_header)
+PROFILE_HEADER_CACHE = "default"
+PROFILE_HEADER_TIMEOUT = 60 * 60
+
+# 削除したツイート・ユーザーの行を purge_tombstones が 1 トランザクションで削除する件数
+PURGE_BATCH_SIZE = 500
+
+# バックグラウンドジョブ (jobs アプリ。manage.py run_jobs で実行する)
+# 失敗したときに実行する回数の上限 (初回を含む)
+JOB_MAX_ATTEMPTS = 3
+# 1 回目の再試行までの秒数 (以降は倍々に延ばす)
+JOB_RETRY_DELAY = 10
+# 実行中のままこの秒数が過ぎたジョブは、ワーカーが落ちたとみなして取り直す
+JOB_LOCK_TIMEOUT = 60 * 10
+# 完了したジョブを残しておく秒数
+JOB_RETENTION_SECONDS = 60 * 60 * 24
+
+# いいねの書き込みをメモリに溜めてまとめて反映する (プロセスが落ちると書き込み待ちの分は失われる)
+LIKE_BUFFER_ENABLED = False
+# 書き込む間隔 (秒)
+LIKE_BUFFER_FLUSH_INTERVAL = 1.0
+# 書き込み待ちがこの件数に達したら間隔を待たずに書き込む
+LIKE_BUFFER_MAX_PENDING = 1000
+
+# トレンドの集計 (いいね数を数える時間帯の長さと、期間ごとに保存する順位の数)
+TRENDING_BUCKET_SECONDS = 60 * 10
+TRENDING_SIZE = 50
+# 集計の間に削除されたツイートの分を埋めるために、TRENDING_SIZE より余分に保存する順位の数
+TRENDING_SPARE = 10
+
+# おすすめユーザー (ユーザーごとに保存する数と、パネルに表示する数)
+RECOMMENDATION_SIZE = 20
+RECOMMENDATION_PANEL_SIZE = 5
+
+# URL 名ごとの 1 リクエストあたりのクエリ数の上限 (セッション・ログインユーザーの取得も含む)
+# 超えたら mysite.middleware のロガーで警告する
+QUERY_BUDGETS = {
+    "tweets:home": 5,
+    "tweets:home_fragment": 4,
+    "tweets:timeline": 7,
+    "tweets:detail": 4,
+    "tweets:search": 5,
+    "tweets:trending": 4,
+    "tweets:api_search": 4,
+    "tweets:api_home": 3,
+    "tweets:api_user_tweets": 4,
+    "accounts:user_profile": 7,
+    "accounts:following_list": 5,
+    "accounts:follower_list": 5,
+    "accounts:api_following_list": 4,
+    "accounts:api_follower_list": 4,
+}
+
 SQL_DEBUG = False
 
 if SQL_DEBUG:
@@ -0,0 +1,33 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+# インデックスを使わないテーブルの全件走査 (例: "SCAN tweets_tweet")
+FULL_SCAN = re.compile(r"\bSCAN \w+$")
+
+
+class QueryPlanAssertionsMixin:
+    # TestCase に混ぜて EXPLAIN QUERY PLAN の結果を検証する
+    def assertUsesIndex(self, queryset):
+        if connection.vendor != "sqlite":
+            self.skipTest("EXPLAIN QUERY PLAN の検証は SQLite のみ")
+        plan = queryset.explain()
+        for line in plan.splitlines():
+            self.assertIsNone(FULL_SCAN.search(line), f"全件走査しています:\n{plan}")
+            self.assertNotIn("USE TEMP B-TREE", line, f"インデックスを使わずに並べ替えています:\n{plan}")
+
+
+class QueryBudgetAssertionsMixin:
+    # TestCase に混ぜて、GET 1 回のクエリ数が QUERY_BUDGETS の上限以内かを検証する
+    def assertWithinQueryBudget(self, path, data=None):
+        view_name = resolve(path).view_name
+        budget = settings.QUERY_BUDGETS[view_name]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path, data)
+        self.assertEqual(response.status_code, 200)
+        queries = "\n".join(query["sql"] for query in context.captured_queries)
+        self.assertLessEqual(len(context), budget, f"{view_name} のクエリ数が上限 {budget} を超えています:\n{queries}")
+        return len(context)
@@ -0,0 +1,118 @@
+import os
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from mysite.db import configure_sqlite
+from mysite.routers import STICKY_SESSION_KEY, ReplicaRouter, RoutingState, _state
+from tweets.models import Tweet
+
+User = get_user_model()
+
+
+class TestConfigureSqlite(TestCase):
+    def setUp(self):
+        self.connection = connections[DEFAULT_DB_ALIAS]
+        if self.connection.vendor != "sqlite":
+            self.skipTest("SQLite のみ")
+        # テスト用の接続の設定を、テストのあとで元に戻す
+        self.saved = {name: self.pragma(name) for name in ("cache_size", "busy_timeout")}
+        self.saved_begin = self.connection.__dict__.get("_start_transaction_under_autocommit")
+
+    def tearDown(self):
+        with self.connection.cursor() as cursor:
+            for name, value in self.saved.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        self.connection.__dict__.pop("_start_transaction_under_autocommit", None)
+        if self.saved_begin:
+            self.connection._start_transaction_under_autocommit = self.saved_begin
+
+    def pragma(self, name):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    @override_settings(
+        SQLITE_PRAGMAS={"cache_size": -32000, "busy_timeout": 1234},
+        SQLITE_TRANSACTION_MODE="IMMEDIATE",
+    )
+    def test_success_production_profile(self):
+        self.connection.__dict__.pop("_start_transaction_under_autocommit", None)
+        configure_sqlite(None, self.connection)
+        self.assertEqual(self.pragma("cache_size"), -32000)
+        self.assertEqual(self.pragma("busy_timeout"), 1234)
+        self.assertIn("_start_transaction_under_autocommit", self.connection.__dict__)
+
+    @override_settings(SQLITE_PRAGMAS={}, SQLITE_TRANSACTION_MODE=None)
+    def test_success_development_profile(self):
+        self.connection.__dict__.pop("_start_transaction_under_autocommit", None)
+        configure_sqlite(None, self.connection)
+        self.assertEqual(self.pragma("cache_size"), self.saved["cache_size"])
+        self.assertNotIn("_start_transaction_under_autocommit", self.connection.__dict__)
+
+
+@override_settings(DATABASE_REPLICAS=["replica"], DATABASE_STICKY_SECONDS=60)
+class TestReplicaRouter(TransactionTestCase):
+    def setUp(self):
+        if connections[DEFAULT_DB_ALIAS].vendor != "sqlite":
+            self.skipTest("SQLite のみ")
+        self.user = User.objects.create_user(username="tester", password="testpassword")
+        self.tweet = Tweet.objects.create(user=self.user, content="replicated")
+        self.client.force_login(self.user)
+        # プライマリをそのまま一時ファイルに複製して、レプリカとして登録する
+        fd, self.path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(fd)
+        connections.settings["replica"] = {**connections.settings[DEFAULT_DB_ALIAS], "NAME": self.path}
+        primary = connections[DEFAULT_DB_ALIAS]
+        primary.ensure_connection()
+        replica = connections["replica"]
+        replica.ensure_connection()
+        primary.connection.backup(replica.connection)
+        # 以降にプライマリだけに書き込んだツイート
+        self.new_tweet = Tweet.objects.create(user=self.user, content="not replicated yet")
+
+    def tearDown(self):
+        if "replica" in connections.settings:
+            connections["replica"].close()
+            del connections["replica"]
+            del connections.settings["replica"]
+            os.remove(self.path)
+
+    def test_success_read_from_replica(self):
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": self.new_tweet.pk}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_success_read_your_writes_after_write(self):
+        response = self.client.post(reverse("tweets:like", kwargs={"pk": self.new_tweet.pk}))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": self.new_tweet.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["tweet"].like_count, 1)
+
+    def test_success_back_to_replica_after_sticky_window(self):
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.new_tweet.pk}))
+        session = self.client.session
+        session[STICKY_SESSION_KEY] = 0
+        session.save()
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": self.new_tweet.pk}))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(DATABASE_REPLICAS=["replica1", "replica2", "replica3"])
+    def test_success_one_replica_per_request(self):
+        state = RoutingState()
+        state.read_replica = True
+        token = _state.set(state)
+        try:
+            aliases = {ReplicaRouter().db_for_read(Tweet) for _ in range(30)}
+        finally:
+            _state.reset(token)
+        self.assertEqual(aliases, {state.replica})
+
+    def test_failure_migrate_replica(self):
+        self.assertFalse(ReplicaRouter().allow_migrate("replica", "tweets"))
+        self.assertIsNone(ReplicaRouter().allow_migrate(DEFAULT_DB_ALIAS, "tweets"))
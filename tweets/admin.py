@@ -1,8 +1,20 @@
 from django.contrib import admin
 
 from .models import Like, Tweet
+from .purge import delete_tweet
 
-admin.site.register(Tweet)
+
+class TweetAdmin(admin.ModelAdmin):
+    # 削除は deleted_at を付けるだけにして、いいねや inbox の行は purge_tombstones が少しずつ削除する
+    def delete_model(self, request, obj):
+        delete_tweet(obj)
+
+    def delete_queryset(self, request, queryset):
+        for tweet in queryset:
+            delete_tweet(tweet)
+
+
+admin.site.register(Tweet, TweetAdmin)
 admin.site.register(Like)
 
 
@@ -0,0 +1,51 @@
+import json
+
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.views.generic import View
+
+from mysite.routers import ReplicaReadMixin
+
+from .pagination import InvalidCursor, KeysetPaginator
+
+
+class KeysetJsonView(LoginRequiredMixin, ReplicaReadMixin, View):
+    """
+    読み取り専用の JSON API。
+    通常は paginate_by 件ずつのページを返し、?format=ndjson のときはカーソル以降を 1 行 1 件で最後まで流す。
+    get_queryset() は values() で必要な列だけを返すこと。
+    """
+
+    paginate_by = 20
+    cursor_keys = ("-created_at", "-id")
+    stream_chunk_size = 500
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    def get_paginator(self, queryset):
+        return KeysetPaginator(queryset, self.paginate_by, self.cursor_keys)
+
+    def serialize(self, row):
+        return row
+
+    def get(self, request, *args, **kwargs):
+        paginator = self.get_paginator(self.get_queryset())
+        try:
+            if request.GET.get("format") == "ndjson":
+                rows = paginator.iterator(after=request.GET.get("after"), chunk_size=self.stream_chunk_size)
+                return StreamingHttpResponse(self.stream(rows), content_type="application/x-ndjson")
+            page = paginator.page(after=request.GET.get("after"), before=request.GET.get("before"))
+        except InvalidCursor:
+            raise Http404("無効なカーソルです。")
+        context = {
+            "results": [self.serialize(row) for row in page],
+            "next_cursor": page.next_cursor,
+            "previous_cursor": page.previous_cursor,
+        }
+        return JsonResponse(context)
+
+    def stream(self, rows):
+        for row in rows:
+            yield json.dumps(self.serialize(row), cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.models.signals import post_migrate
+
+
+def install_search(using, **kwargs):
+    # SQLite ではテーブルを作り直すマイグレーションで同期用のトリガーが消えるので、migrate のたびに作り直す
+    from . import search
+
+    search.install(connections[using])
 
 
 class TweetsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "tweets"
+
+    def ready(self):
+        post_migrate.connect(install_search, sender=self)
@@ -0,0 +1,144 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .models import Like
+
+logger = logging.getLogger(__name__)
+
+
+class LikeBuffer:
+    """
+    いいね・いいね解除をメモリに溜めて、まとめて書き込むバッファ (LIKE_BUFFER_ENABLED のときだけ使う)。
+    (ユーザー, ツイート) ごとに最後の状態だけを残すので、いいね→解除→いいね の連打は 1 件の書き込みになる。
+    書き込み待ちの状態はこのプロセスの中にしかないので、プロセスが落ちると失われる。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # flush を 1 つずつ実行して、古いまとまりが新しいまとまりの後にコミットされないようにする
+        self._flush_lock = threading.Lock()
+        # {tweet_id: {user_id: いいねするか}}
+        self._pending = {}
+        # 書き込み中のまとまり。コミットされるまでは、読み出し時に _pending と同じように重ねる
+        self._flushing = {}
+        self._thread = None
+
+    def __len__(self):
+        with self._lock:
+            tweet_ids = self._flushing.keys() | self._pending.keys()
+            return sum(len(self._states(tweet_id)) for tweet_id in tweet_ids)
+
+    def _states(self, tweet_id):
+        # _lock を取ってから呼ぶ。書き込み中の状態に、その後に記録された状態を上書きしたもの
+        return {**self._flushing.get(tweet_id, {}), **self._pending.get(tweet_id, {})}
+
+    def record(self, user_id, tweet_id, liked):
+        self.record_many(user_id, {tweet_id: liked})
+
+    def record_many(self, user_id, states):
+        # states: {tweet_id: いいねするか}
+        with self._lock:
+            for tweet_id, liked in states.items():
+                self._pending.setdefault(tweet_id, {})[user_id] = liked
+            size = sum(len(users) for users in self._pending.values())
+        if size >= settings.LIKE_BUFFER_MAX_PENDING:
+            self.flush()
+        else:
+            self._start()
+
+    def toggle(self, user_id, tweet, liked):
+        # いいね・いいね解除を記録し、本人に返すいいね数を返す
+        self.record(user_id, tweet.pk, liked)
+        return self.like_count(tweet.pk, tweet.like_count)
+
+    def toggle_many(self, user_id, like_counts, states):
+        """
+        いいね・いいね解除をまとめて記録し、本人に返す {tweet_id: いいね数} を返す。
+        like_counts: 存在するツイートの {tweet_id: DB の like_count}。states のうち、ここにないツイートは記録しない。
+        """
+        self.record_many(user_id, {tweet_id: states[tweet_id] for tweet_id in like_counts})
+        return self.like_counts(like_counts)
+
+    def pending(self, user_id, tweet_ids):
+        # user_id の書き込み待ちの状態 {tweet_id: いいねするか}
+        with self._lock:
+            states = {tweet_id: self._states(tweet_id) for tweet_id in tweet_ids}
+        return {tweet_id: users[user_id] for tweet_id, users in states.items() if user_id in users}
+
+    def has_pending(self, user_id):
+        # user_id の書き込み待ち (書き込み中を含む) の状態があるか
+        with self._lock:
+            return any(user_id in users for users in (*self._flushing.values(), *self._pending.values()))
+
+    def like_count(self, tweet_id, like_count):
+        # DB の like_count に、書き込み待ちの分の増減を重ねた値
+        return self.like_counts({tweet_id: like_count})[tweet_id]
+
+    def like_counts(self, like_counts):
+        # {tweet_id: DB の like_count} のそれぞれに、書き込み待ちの分の増減を重ねる (DB の読み出しは 1 回)
+        with self._lock:
+            states = {tweet_id: self._states(tweet_id) for tweet_id in like_counts}
+        states = {tweet_id: users for tweet_id, users in states.items() if users}
+        if not states:
+            return dict(like_counts)
+        liked = set(
+            Like.objects.filter(
+                tweet_id__in=states, user_id__in={user_id for users in states.values() for user_id in users}
+            ).values_list("tweet_id", "user_id")
+        )
+        counts = dict(like_counts)
+        for tweet_id, users in states.items():
+            delta = sum(1 for user_id, is_liked in users.items() if is_liked and (tweet_id, user_id) not in liked)
+            delta -= sum(1 for user_id, is_liked in users.items() if not is_liked and (tweet_id, user_id) in liked)
+            counts[tweet_id] = max(counts[tweet_id] + delta, 0)
+        return counts
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending = self._flushing = self._pending
+                self._pending = {}
+            states = {
+                (user_id, tweet_id): liked for tweet_id, users in pending.items() for user_id, liked in users.items()
+            }
+            try:
+                if states:
+                    Like.objects.apply_states(states)
+            except Exception:
+                # 書き込めなかった分は戻す。その間に記録された新しい状態のほうを優先する
+                with self._lock:
+                    for tweet_id, users in pending.items():
+                        for user_id, liked in users.items():
+                            self._pending.setdefault(tweet_id, {}).setdefault(user_id, liked)
+                    self._flushing = {}
+                raise
+            with self._lock:
+                self._flushing = {}
+            return len(states)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="like-buffer", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(settings.LIKE_BUFFER_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("いいねのバッファを書き込めませんでした。")
+            finally:
+                connection.close()
+
+
+like_buffer = LikeBuffer()
@@ -0,0 +1,121 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+# キャッシュしたカードの中で、閲覧者ごとに変わるいいねボタンを差し込む位置
+LIKE_BUTTON_PLACEHOLDER = "<!-- like-button -->"
+# いいね数を差し込む位置。いいね数はリクエストごとに行から埋めるので、いいねでカードを作り直さなくてよい
+LIKE_COUNT_PLACEHOLDER = "<!-- like-count -->"
+
+
+class CardCacheStats:
+    # プロセス内のヒット・ミス数
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def as_dict(self):
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate}
+
+
+stats = CardCacheStats()
+
+
+def get_cache():
+    return caches[settings.TWEET_CARD_CACHE]
+
+
+def _version_key(tweet_id):
+    return f"tweet-card-version:{tweet_id}"
+
+
+def _card_key(tweet_id, version):
+    return f"tweet-card:{tweet_id}:{version}"
+
+
+def bump_version(tweet_id):
+    # 削除のときに呼び、古いバージョンのカードを使われないようにする。
+    # カードにはツイートの変わらない内容しか入れないので、キャッシュがプロセスごとでもずれない
+    cache = get_cache()
+    try:
+        cache.incr(_version_key(tweet_id))
+    except ValueError:
+        # バージョンが追い出されていたら、過去に使った値と重ならないように時刻から作り直す
+        cache.set(_version_key(tweet_id), time.time_ns(), timeout=None)
+
+
+def _versions(tweet_ids):
+    cache = get_cache()
+    keys = {tweet_id: _version_key(tweet_id) for tweet_id in tweet_ids}
+    versions = cache.get_many(list(keys.values()))
+    raced = []
+    for key in keys.values():
+        if key not in versions:
+            versions[key] = time.time_ns()
+            if not cache.add(key, versions[key], timeout=None):
+                # ほかのリクエストが先に作っていたら、そちらの値を使う
+                raced.append(key)
+    if raced:
+        versions.update(cache.get_many(raced))
+    return {tweet_id: versions[key] for tweet_id, key in keys.items()}
+
+
+def _render(tweet):
+    context = {
+        "tweet": tweet,
+        "like_button_placeholder": mark_safe(LIKE_BUTTON_PLACEHOLDER),
+        "like_count_placeholder": mark_safe(LIKE_COUNT_PLACEHOLDER),
+    }
+    return {
+        "card": render_to_string("tweets/tweet_card.html", context),
+        "like": render_to_string("tweets/like_button.html", {"tweet": tweet, "is_liked": False}),
+        "unlike": render_to_string("tweets/like_button.html", {"tweet": tweet, "is_liked": True}),
+    }
+
+
+def render_cards(tweets):
+    """
+    tweet.card_html に描画済みのカードを設定する。
+    カードは (ツイート id, バージョン) ごとにキャッシュし、いいねボタンは閲覧者に合わせて、
+    いいね数は tweet.like_count から、リクエストごとに差し込む。
+    tweets には Like.objects.mark_liked で is_liked を付けておくこと。
+    """
+    if not tweets:
+        return
+    cache = get_cache()
+    versions = _versions([tweet.pk for tweet in tweets])
+    keys = {tweet.pk: _card_key(tweet.pk, versions[tweet.pk]) for tweet in tweets}
+    cards = cache.get_many(list(keys.values()))
+    missing = {}
+    for tweet in tweets:
+        key = keys[tweet.pk]
+        if key not in cards:
+            cards[key] = missing[key] = _render(tweet)
+    if missing:
+        cache.set_many(missing, timeout=settings.TWEET_CARD_TIMEOUT)
+    stats.record(hits=len(tweets) - len(missing), misses=len(missing))
+    for tweet in tweets:
+        card = cards[keys[tweet.pk]]
+        button = card["unlike"] if getattr(tweet, "is_liked", False) else card["like"]
+        html = card["card"].replace(LIKE_BUTTON_PLACEHOLDER, button)
+        tweet.card_html = mark_safe(html.replace(LIKE_COUNT_PLACEHOLDER, str(tweet.like_count)))
@@ -0,0 +1,71 @@
+from django.contrib.auth import get_user_model
+from django.contrib.messages import get_messages
+from django.db.models import Max, OuterRef, Subquery
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .buffer import like_buffer
+from .models import Tweet
+from .versions import global_versions
+
+User = get_user_model()
+
+
+def _latest_tweet_id():
+    return Tweet.objects.filter(user=OuterRef("pk")).order_by("-id").values("id")[:1]
+
+
+def home_etag(request, *args, **kwargs):
+    # 最大のツイート id、閲覧者とそのバージョン、削除といいねのバージョン
+    latest_id = Tweet.objects.aggregate(latest_id=Max("id"))["latest_id"]
+    user = request.user
+    deletion_version, like_version = global_versions()
+    return f"home-{latest_id}-{user.pk}.{user.activity_version}-{deletion_version}.{like_version}"
+
+
+def profile_etag(request, *args, **kwargs):
+    # プロフィールのユーザーのバージョンと、そのユーザーの最大のツイート id を 1 回のクエリで取得する
+    row = (
+        User.objects.live()
+        .filter(username=kwargs["username"])
+        .annotate(latest_id=Subquery(_latest_tweet_id()))
+        .values("pk", "activity_version", "latest_id")
+        .first()
+    )
+    if row is None:
+        return None
+    user = request.user
+    deletion_version, like_version = global_versions()
+    return (
+        f"profile-{row['pk']}.{row['activity_version']}-{row['latest_id']}-"
+        f"{user.pk}.{user.activity_version}-{deletion_version}.{like_version}"
+    )
+
+
+def detail_etag(request, *args, **kwargs):
+    # いいねすると投稿者のバージョンも進むので、いいね数の変化も拾える
+    row = Tweet.objects.filter(pk=kwargs["pk"]).values("user__activity_version").first()
+    if row is None:
+        return None
+    user = request.user
+    return f"tweet-{kwargs['pk']}.{row['user__activity_version']}-{user.pk}.{user.activity_version}"
+
+
+class ConditionalGetMixin:
+    """
+    etag_func で計算した ETag が If-None-Match と一致すれば、テンプレートを描画せずに 304 を返す。
+    ETag は閲覧者ごとに違うので、共有キャッシュには保存させず、ブラウザには毎回確認させる。
+    表示待ちのメッセージや、閲覧者の書き込み待ちのいいね (LikeBuffer) があるときは、
+    304 にするとそれが表示されないので、毎回描画する。
+    """
+
+    etag_func = None
+
+    def get(self, request, *args, **kwargs):
+        # len() はメッセージを表示済みにしない
+        if len(get_messages(request)) or like_buffer.has_pending(request.user.pk):
+            response = super().get(request, *args, **kwargs)
+        else:
+            response = condition(etag_func=self.etag_func)(super().get)(request, *args, **kwargs)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
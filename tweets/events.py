@@ -0,0 +1,146 @@
+import asyncio
+import json
+import threading
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.http.cookie import parse_cookie
+
+# Server-Sent Events の配信先 (ASGI で動かすときは EventStreamApp がこのパスを処理する)
+EVENTS_PATH = "/tweets/events/"
+# 1 接続で購読できるツイート数
+MAX_SUBSCRIBED_TWEETS = 100
+# 1 接続で溜めておくイベント数 (溢れた分は捨てる)
+QUEUE_SIZE = 100
+KEEPALIVE_SECONDS = 15
+
+
+class Subscription:
+    def __init__(self, loop, tweet_ids):
+        self.loop = loop
+        self.tweet_ids = tweet_ids
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def wants(self, event):
+        return event["event"] == "tweet" or event["data"]["tweet_id"] in self.tweet_ids
+
+    def put(self, event):
+        # イベントループのスレッドで呼ばれる
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+
+class EventBroker:
+    # プロセス内の pub/sub。同期ビューのスレッドから publish し、ASGI のイベントループで受け取る
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+    def subscribe(self, loop, tweet_ids):
+        subscription = Subscription(loop, set(tweet_ids))
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event, data):
+        event = {"event": event, "data": data}
+        with self._lock:
+            subscriptions = [subscription for subscription in self._subscriptions if subscription.wants(event)]
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.put, event)
+
+
+broker = EventBroker()
+
+
+def publish_like_count(tweet_id, like_count):
+    broker.publish("like", {"tweet_id": tweet_id, "like_count": like_count})
+
+
+def publish_tweet(tweet):
+    broker.publish("tweet", {"tweet_id": tweet.pk, "user": tweet.user.username})
+
+
+def format_event(event):
+    data = json.dumps(event["data"], ensure_ascii=False)
+    return f"event: {event['event']}\ndata: {data}\n\n".encode()
+
+
+async def _get_user(scope):
+    # ASGI のスコープからセッションを読み、ログイン中のユーザーを返す
+    cookies = {}
+    for name, value in scope.get("headers", []):
+        if name == b"cookie":
+            cookies.update(parse_cookie(value.decode("latin-1")))
+    engine = import_module(settings.SESSION_ENGINE)
+    session = engine.SessionStore(cookies.get(settings.SESSION_COOKIE_NAME))
+    return await sync_to_async(get_user)(SimpleNamespace(session=session))
+
+
+def _tweet_ids(scope):
+    query = parse_qs(scope.get("query_string", b"").decode())
+    values = ",".join(query.get("tweets", [])).split(",")
+    return {int(value) for value in values if value.isdigit()}
+
+
+class EventStreamApp:
+    """
+    EVENTS_PATH への GET を Server-Sent Events として処理し、それ以外は Django の ASGI アプリに渡す。
+    ?tweets=1,2,3 で指定したツイートのいいね数と、新しいツイートの投稿を 1 本の接続で流す。
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == EVENTS_PATH and scope["method"] == "GET":
+            return await self.stream(scope, receive, send)
+        return await self.application(scope, receive, send)
+
+    async def stream(self, scope, receive, send):
+        user = await _get_user(scope)
+        if not user.is_authenticated:
+            await send({"type": "http.response.start", "status": 403, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        tweet_ids = sorted(_tweet_ids(scope))[:MAX_SUBSCRIBED_TWEETS]
+        subscription = broker.subscribe(asyncio.get_running_loop(), tweet_ids)
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")],
+                }
+            )
+            await send({"type": "http.response.body", "body": b": connected\n\n", "more_body": True})
+            while not disconnected.done():
+                next_event = asyncio.ensure_future(subscription.queue.get())
+                done, _ = await asyncio.wait(
+                    {next_event, disconnected}, timeout=KEEPALIVE_SECONDS, return_when=asyncio.FIRST_COMPLETED
+                )
+                if next_event in done:
+                    body = format_event(next_event.result())
+                else:
+                    next_event.cancel()
+                    body = b": keepalive\n\n"
+                if not disconnected.done():
+                    await send({"type": "http.response.body", "body": body, "more_body": True})
+        finally:
+            broker.unsubscribe(subscription)
+            disconnected.cancel()
+
+    async def _wait_disconnect(self, receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
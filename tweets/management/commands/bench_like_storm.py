@@ -0,0 +1,86 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test import AsyncClient, Client
+from django.urls import reverse
+
+from mysite.benchmark import summarize, temporary_database
+from tweets.models import Tweet
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "1 つのツイートへのいいね・いいね解除の連打で、WSGI と ASGI のスループットとレイテンシを比べる"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=20, help="同時にいいねするユーザー数")
+        parser.add_argument("--requests", type=int, default=50, help="ユーザーごとのリクエスト数")
+
+    def handle(self, *args, **options):
+        concurrency = options["concurrency"]
+        requests = options["requests"]
+        with temporary_database():
+            author = User.objects.create_user(username="author")
+            tweet = Tweet.objects.create(user=author, content="hot tweet")
+            users = User.objects.bulk_create([User(username=f"liker{i}") for i in range(concurrency)])
+            urls = [reverse(name, kwargs={"pk": tweet.pk}) for name in ("tweets:like", "tweets:unlike")]
+            results = {
+                "config": {"concurrency": concurrency, "requests_per_user": requests},
+                "wsgi": self.run_wsgi(users, urls, requests),
+                "asgi": asyncio.run(self.run_asgi(users, urls, requests)),
+            }
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def run_wsgi(self, users, urls, requests):
+        # ユーザーごとに 1 スレッド。スレッドごとに Client を持ち、WSGI ハンドラーを通してリクエストする
+        clients = []
+        for user in users:
+            client = Client(raise_request_exception=False)
+            client.force_login(user)
+            clients.append(client)
+
+        def worker(client):
+            latencies, errors = [], 0
+            for i in range(requests):
+                started = time.perf_counter()
+                response = client.post(urls[i % 2])
+                latencies.append(time.perf_counter() - started)
+                errors += response.status_code != 200
+            close_old_connections()
+            return latencies, errors
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(users)) as executor:
+            results = list(executor.map(worker, clients))
+        return self.summarize(results, time.perf_counter() - started)
+
+    async def run_asgi(self, users, urls, requests):
+        # 1 つのイベントループで、ユーザーごとの AsyncClient から ASGI ハンドラーを通してリクエストする
+        clients = []
+        for user in users:
+            client = AsyncClient(raise_request_exception=False)
+            await asyncio.to_thread(client.force_login, user)
+            clients.append(client)
+
+        async def worker(client):
+            latencies, errors = [], 0
+            for i in range(requests):
+                started = time.perf_counter()
+                response = await client.post(urls[i % 2])
+                latencies.append(time.perf_counter() - started)
+                errors += response.status_code != 200
+            return latencies, errors
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(worker(client) for client in clients))
+        return self.summarize(results, time.perf_counter() - started)
+
+    def summarize(self, results, elapsed):
+        latencies = [latency for worker_latencies, _ in results for latency in worker_latencies]
+        return summarize(latencies, elapsed, errors=sum(errors for _, errors in results))
@@ -0,0 +1,222 @@
+import json
+import logging
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, get_resolver, reverse
+
+from accounts.models import FriendShip, UserStats
+from mysite.benchmark import peak_rss_kb, summarize, temporary_database
+from tweets import cache as card_cache
+from tweets.models import Like, TimelineEntry, Tweet
+
+User = get_user_model()
+
+# ベンチマークする URL の名前空間
+NAMESPACES = ("tweets", "accounts")
+# POST で叩く URL と、交互に叩いてデータ量を一定に保つための対になる URL
+POST_PAIRS = {
+    "tweets:like": "tweets:unlike",
+    "tweets:unlike": "tweets:like",
+    "accounts:follow": "accounts:unfollow",
+    "accounts:unfollow": "accounts:follow",
+}
+# セッションやデータを壊す、または本文が必要で GET できない URL
+SKIPPED = {"accounts:logout", "tweets:delete", "tweets:batch_like"}
+# クエリ文字列がないと 400 になる URL に付けるクエリ (シードしたツイートの本文に一致する)
+QUERY_STRINGS = {"tweets:search": "q=benchmark", "tweets:api_search": "q=benchmark"}
+BATCH_SIZE = 1000
+
+
+@contextmanager
+def quiet_request_log():
+    logger = logging.getLogger("django.request")
+    disabled = logger.disabled
+    logger.disabled = True
+    try:
+        yield
+    finally:
+        logger.disabled = disabled
+
+
+class Command(BaseCommand):
+    help = (
+        "べき分布のフォロー関係を持つデータを bulk_create で作り、tweets と accounts の各 URL を"
+        "同時接続数ごとに叩いて、スループット・レイテンシ・クエリ数・最大メモリを JSON で出力する"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000, help="ユーザー数")
+        parser.add_argument("--tweets", type=int, default=10000, help="ツイート数")
+        parser.add_argument("--likes", type=int, default=20000, help="いいね数")
+        parser.add_argument("--following", type=int, default=20, help="1 ユーザーあたりの平均フォロー数")
+        parser.add_argument("--alpha", type=float, default=1.2, help="フォロワー数のべき分布の指数")
+        parser.add_argument("--concurrency", default="1,8", help="同時接続数 (カンマ区切りで複数指定)")
+        parser.add_argument("--requests", type=int, default=20, help="接続ごとのリクエスト数")
+        parser.add_argument("--only", default="", help="ベンチマークする URL 名を絞り込む (例: tweets:home)")
+        parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+
+    def handle(self, *args, **options):
+        try:
+            levels = sorted({int(level) for level in options["concurrency"].split(",")})
+        except ValueError:
+            raise CommandError("--concurrency はカンマ区切りの整数で指定してください。")
+        if levels[0] < 1 or levels[-1] > options["users"]:
+            raise CommandError("--concurrency は 1 以上 --users 以下にしてください。")
+        only = {name for name in options["only"].split(",") if name}
+        rng = random.Random(options["seed"])
+        with temporary_database():
+            started = time.perf_counter()
+            dataset = self.seed(
+                rng, options["users"], options["tweets"], options["likes"], options["following"], options["alpha"]
+            )
+            dataset["seed_seconds"] = round(time.perf_counter() - started, 3)
+            results = {}
+            for name, method, path, pair_path in self.targets(only):
+                card_cache.stats.reset()
+                results[name] = {
+                    "method": method,
+                    "path": path,
+                    "queries": self.count_queries(method, path, pair_path),
+                    "concurrency": {
+                        level: self.run(level, method, path, pair_path, options["requests"]) for level in levels
+                    },
+                    # このプロセスで数えたツイートカードのキャッシュのヒット・ミス数
+                    "card_cache": card_cache.stats.as_dict(),
+                }
+        report = {
+            "config": {key: options[key] for key in ("following", "alpha", "requests", "seed")} | {"levels": levels},
+            "dataset": dataset,
+            "results": results,
+            "peak_rss_kb": peak_rss_kb(),
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def seed(self, rng, users, tweets, likes, following, alpha):
+        """
+        users 人のユーザーに、平均 following 人ずつフォローさせる。
+        フォローする相手は順位 r に 1 / r ** alpha の重みを付けて選ぶので、フォロワー数はべき分布になる。
+        ツイートの投稿者とテストのログインユーザーは一様に選ぶ。
+        """
+        user_ids = [
+            user.pk
+            for user in User.objects.bulk_create(
+                [User(username=f"bench{i}", email=f"bench{i}@example.com") for i in range(users)],
+                batch_size=BATCH_SIZE,
+            )
+        ]
+        weights = [1 / rank**alpha for rank in range(1, users + 1)]
+        targets = rng.choices(user_ids, weights=weights, k=users * following)
+        pairs = {(rng.choice(user_ids), following_id) for following_id in targets}
+        follows = FriendShip.objects.bulk_follow(pairs, batch_size=BATCH_SIZE)
+
+        authors = [rng.choice(user_ids) for _ in range(tweets)]
+        tweet_list = Tweet.objects.bulk_create(
+            [Tweet(user_id=author_id, content=f"benchmark tweet {i}") for i, author_id in enumerate(authors)],
+            batch_size=BATCH_SIZE,
+        )
+        UserStats.objects.add({author_id: {"tweet_count": count} for author_id, count in Counter(authors).items()})
+
+        # fan_out をツイートごとに呼ぶと遅いので、フォロワーの一覧から inbox をまとめて作る
+        followers = {}
+        for follower_id, following_id in FriendShip.objects.values_list("follower_id", "following_id"):
+            followers.setdefault(following_id, []).append(follower_id)
+        large = set(
+            User.objects.filter(follower_count__gte=settings.TIMELINE_FANOUT_THRESHOLD).values_list("pk", flat=True)
+        )
+        entries = 0
+        batch = []
+        for tweet in tweet_list:
+            readers = [tweet.user_id] + ([] if tweet.user_id in large else followers.get(tweet.user_id, []))
+            for reader_id in readers:
+                batch.append(
+                    TimelineEntry(
+                        user_id=reader_id, tweet_id=tweet.pk, author_id=tweet.user_id, created_at=tweet.created_at
+                    )
+                )
+            if len(batch) >= BATCH_SIZE:
+                entries += len(TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True))
+                batch = []
+        entries += len(TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True))
+
+        tweet_ids = [tweet.pk for tweet in tweet_list]
+        states = {(rng.choice(user_ids), rng.choice(tweet_ids)): True for _ in range(likes)} if tweet_ids else {}
+        Like.objects.apply_states(states)
+        return {
+            "users": users,
+            "follows": follows,
+            "max_follower_count": User.objects.order_by("-follower_count").values_list("follower_count", flat=True)[0],
+            "tweets": len(tweet_list),
+            "likes": Like.objects.count(),
+            "timeline_entries": entries,
+        }
+
+    def targets(self, only):
+        # (URL 名, メソッド, パス, POST のときに交互に叩くパス) を返す
+        popular = User.objects.order_by("-follower_count", "pk").first()
+        tweet = Tweet.objects.filter(user=popular).order_by("-id").first() or Tweet.objects.order_by("-id").first()
+        kwargs = {"pk": tweet.pk, "username": popular.username}
+        for namespace in NAMESPACES:
+            for pattern in get_resolver().namespace_dict[namespace][1].url_patterns:
+                if not isinstance(pattern, URLPattern) or not pattern.name:
+                    continue
+                name = f"{namespace}:{pattern.name}"
+                if name in SKIPPED or (only and name not in only):
+                    continue
+                path_kwargs = {key: kwargs[key] for key in pattern.pattern.converters}
+                path = reverse(name, kwargs=path_kwargs)
+                if name in QUERY_STRINGS:
+                    path = f"{path}?{QUERY_STRINGS[name]}"
+                if name in POST_PAIRS:
+                    yield name, "post", path, reverse(POST_PAIRS[name], kwargs=path_kwargs)
+                else:
+                    yield name, "get", path, None
+
+    def client(self, index):
+        # 人気ユーザー以外のユーザーとしてログインしたクライアント
+        client = Client(raise_request_exception=False)
+        client.force_login(User.objects.order_by("follower_count", "pk")[index])
+        return client
+
+    def count_queries(self, method, path, pair_path):
+        # 同時接続なしで 1 回叩いてクエリ数を数える (キャッシュを温める意味もある)
+        client = self.client(0)
+        # queries_log は上限 (9000 件) に達すると増えなくなるので空にしておく
+        reset_queries()
+        with CaptureQueriesContext(connection) as context:
+            getattr(client, method)(path)
+        if pair_path:
+            getattr(client, method)(pair_path)
+        return len(context)
+
+    def run(self, level, method, path, pair_path, requests):
+        clients = [self.client(index) for index in range(level)]
+
+        def worker(client):
+            latencies, errors = [], 0
+            for i in range(requests):
+                started = time.perf_counter()
+                response = getattr(client, method)(pair_path if pair_path and i % 2 else path)
+                latencies.append(time.perf_counter() - started)
+                errors += response.status_code >= 400
+            close_old_connections()
+            return latencies, errors
+
+        started = time.perf_counter()
+        # SQLite のロック待ちなどで 500 になったリクエストはエラー数として数え、ログには出さない
+        with ThreadPoolExecutor(max_workers=level) as executor, quiet_request_log():
+            results = list(executor.map(worker, clients))
+        elapsed = time.perf_counter() - started
+        latencies = [latency for worker_latencies, _ in results for latency in worker_latencies]
+        return summarize(latencies, elapsed, errors=sum(errors for _, errors in results)) | {
+            "peak_rss_kb": peak_rss_kb()
+        }
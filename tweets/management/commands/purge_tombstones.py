@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tweets import purge
+
+
+class Command(BaseCommand):
+    help = "削除したツイート・ユーザーに関係する行を少しずつ削除する (cron で実行するか、--interval で繰り返す)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None, help="1 トランザクションで削除する行数")
+        parser.add_argument("--interval", type=float, default=0, help="指定した秒数ごとに繰り返す (0 なら 1 回だけ)")
+
+    def handle(self, *args, **options):
+        while True:
+            counts = purge.purge(options["batch_size"])
+            message = f"削除済みの行を処理しました (ユーザー: {counts['users']} 行, ツイート: {counts['tweets']} 行)"
+            self.stdout.write(self.style.SUCCESS(message))
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
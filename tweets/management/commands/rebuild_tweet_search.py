@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from tweets import search
+
+
+class Command(BaseCommand):
+    help = "既存のツイートから全文検索 (FTS5) の索引を作り直す"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS, help="対象のデータベース")
+        parser.add_argument("--optimize", action="store_true", help="作り直したあとに索引の b-tree を 1 つにまとめる")
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        if not search.is_supported(connection):
+            raise CommandError("全文検索は SQLite でのみ使えます。")
+        search.rebuild(connection, optimize=options["optimize"])
+        self.stdout.write(self.style.SUCCESS("全文検索の索引を作り直しました。"))
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tweets import trending
+
+
+class Command(BaseCommand):
+    help = "トレンドの順位表を作り直す (cron で定期的に実行するか、--interval で繰り返す)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=0, help="指定した秒数ごとに繰り返す (0 なら 1 回だけ)")
+
+    def handle(self, *args, **options):
+        while True:
+            counts = trending.refresh()
+            summary = ", ".join(f"{window}: {count} 件" for window, count in counts.items())
+            self.stdout.write(self.style.SUCCESS(f"トレンドを更新しました ({summary})"))
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
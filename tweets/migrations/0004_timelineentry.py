@@ -0,0 +1,80 @@
+# Generated by Django 4.1.13 on 2026-10-18 00:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_timeline(apps, schema_editor):
+    # 既存のツイートを、投稿者本人とフォロワーの inbox に書き込む (tweets.timeline.fan_out と同じ条件)
+    Tweet = apps.get_model("tweets", "Tweet")
+    TimelineEntry = apps.get_model("tweets", "TimelineEntry")
+    FriendShip = apps.get_model("accounts", "FriendShip")
+    entries = []
+    author_id = follower_ids = None
+    for tweet_id, user_id, created_at in Tweet.objects.order_by("user_id", "id").values_list(
+        "id", "user_id", "created_at"
+    ).iterator(chunk_size=1000):
+        if user_id != author_id:
+            author_id = user_id
+            follower_ids = list(FriendShip.objects.filter(following_id=user_id).values_list("follower_id", flat=True))
+            if len(follower_ids) >= settings.TIMELINE_FANOUT_THRESHOLD:
+                follower_ids = []
+        for inbox_id in [user_id, *follower_ids]:
+            entries.append(TimelineEntry(user_id=inbox_id, tweet_id=tweet_id, author_id=user_id, created_at=created_at))
+        if len(entries) >= 1000:
+            TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+            entries = []
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("accounts", "0002_friendship_friendship_unique_constraint"),
+        ("tweets", "0003_tweet_like_count"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TimelineEntry",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("created_at", models.DateTimeField()),
+                (
+                    "author",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="+", to=settings.AUTH_USER_MODEL
+                    ),
+                ),
+                (
+                    "tweet",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="timeline_entries", to="tweets.tweet"
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="timeline_entries",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="timelineentry",
+            index=models.Index(fields=["user", "-created_at", "-tweet"], name="timeline_user_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="timelineentry",
+            index=models.Index(fields=["user", "author"], name="timeline_user_author_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="timelineentry",
+            constraint=models.UniqueConstraint(fields=("user", "tweet"), name="timeline_entry_unique"),
+        ),
+        migrations.RunPython(backfill_timeline, migrations.RunPython.noop),
+    ]
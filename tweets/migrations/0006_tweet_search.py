@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+def install(apps, schema_editor):
+    from tweets import search
+
+    search.rebuild(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    from tweets import search
+
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0005_like_like_user_tweet_idx_tweet_tweet_created_idx_and_more"),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0006_tweet_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="like",
+            name="created_at",
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name="TrendingTweet",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "window",
+                    models.CharField(choices=[("hour", "hour"), ("day", "day"), ("week", "week")], max_length=10),
+                ),
+                ("rank", models.PositiveIntegerField()),
+                ("like_count", models.PositiveIntegerField()),
+                ("computed_at", models.DateTimeField()),
+                (
+                    "tweet",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="+", to="tweets.tweet"
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="LikeBucket",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("start", models.DateTimeField()),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "tweet",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="like_buckets", to="tweets.tweet"
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="trendingtweet",
+            constraint=models.UniqueConstraint(fields=("window", "rank"), name="trending_window_rank_unique"),
+        ),
+        migrations.AddIndex(
+            model_name="likebucket",
+            index=models.Index(fields=["start", "tweet"], name="like_bucket_start_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="likebucket",
+            constraint=models.UniqueConstraint(fields=("tweet", "start"), name="like_bucket_unique"),
+        ),
+    ]
@@ -1,21 +1,263 @@
+from collections import Counter
+from datetime import datetime, timezone
+from functools import reduce
+from operator import or_
+
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone as django_timezone
+
+from accounts.models import CustomUser, UserStats, bump_activity_version
+
+from .versions import bump_like_version
+
+
+class LiveTweetManager(models.Manager):
+    # 削除済み (deleted_at を付けた) ツイートを除く。削除済みも含めるときは Tweet.all_objects を使う
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
 
 
 class Tweet(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content = models.TextField(max_length=200)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Like の追加・削除と同じトランザクションで更新するいいね数
+    like_count = models.PositiveIntegerField(default=0)
+    # 削除した日時。いいねや inbox の行は purge_tombstones が少しずつ削除し、最後にこの行を削除する
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = LiveTweetManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        base_manager_name = "all_objects"
+        indexes = [
+            # ホームのタイムライン (created_at, id の降順)。削除済みのツイートはインデックスに入れない
+            models.Index(
+                fields=["-created_at", "-id"], condition=Q(deleted_at__isnull=True), name="tweet_live_created_idx"
+            ),
+            # プロフィールのツイート一覧
+            models.Index(
+                fields=["user", "-created_at", "-id"],
+                condition=Q(deleted_at__isnull=True),
+                name="tweet_live_user_created_idx",
+            ),
+            # purge_tombstones が削除済みのツイートを探す
+            models.Index(fields=["deleted_at"], condition=Q(deleted_at__isnull=False), name="tweet_tombstone_idx"),
+        ]
 
     def __str__(self):
         return self.content
 
 
+class LikeManager(models.Manager):
+    def like(self, user, tweet):
+        # いいねを作成し、新規作成のときだけ like_count と時間帯ごとのいいね数を加算する
+        with transaction.atomic():
+            like, created = self.get_or_create(tweet=tweet, user=user)
+            # 削除済みのツイートは like_count が更新されないので、カウンターもそのままにする
+            if created and Tweet.objects.filter(pk=tweet.pk).update(like_count=F("like_count") + 1):
+                LikeBucket.objects.add({(tweet.pk, LikeBucket.start_of(like.created_at)): 1})
+                UserStats.objects.add({tweet.user_id: {"likes_received": 1}})
+                bump_activity_version({user.pk, tweet.user_id})
+                transaction.on_commit(bump_like_version)
+        return created
+
+    def unlike(self, user, tweet):
+        # いいねを削除し、実際に削除できたときだけ like_count と、いいねした時間帯のいいね数を減算する
+        with transaction.atomic():
+            created_at = self.filter(tweet=tweet, user=user).values_list("created_at", flat=True).first()
+            if created_at is None:
+                return False
+            deleted, _ = self.filter(tweet=tweet, user=user).delete()
+            if deleted and Tweet.objects.filter(pk=tweet.pk).update(like_count=Greatest(F("like_count") - deleted, 0)):
+                LikeBucket.objects.add({(tweet.pk, LikeBucket.start_of(created_at)): -1})
+                UserStats.objects.add({tweet.user_id: {"likes_received": -deleted}})
+                bump_activity_version({user.pk, tweet.user_id})
+                transaction.on_commit(bump_like_version)
+        return bool(deleted)
+
+    def apply_states(self, states):
+        """
+        states: {(user_id, tweet_id): True(いいね) / False(いいね解除)} を 1 トランザクションでまとめて反映する。
+        追加は 1 回の bulk_create、削除は 1 回の DELETE で行い、like_count は増減した分だけ更新する。
+        削除済みのユーザーのいいねは追加しない (削除の前にバッファに溜まっていた分が、purge の後に戻らないように)。
+        戻り値は存在したツイートの id。
+        """
+        with transaction.atomic():
+            authors = dict(
+                Tweet.objects.filter(pk__in={tweet_id for _, tweet_id in states}).values_list("pk", "user_id")
+            )
+            tweet_ids = set(authors)
+            states = {key: liked for key, liked in states.items() if key[1] in tweet_ids}
+            if liking := {user_id for (user_id, _), liked in states.items() if liked}:
+                live = set(CustomUser.objects.live().filter(pk__in=liking).values_list("pk", flat=True))
+                states = {key: liked for key, liked in states.items() if not liked or key[0] in live}
+            existing = {
+                (user_id, tweet_id): created_at
+                for user_id, tweet_id, created_at in self.filter(
+                    user_id__in={user_id for user_id, _ in states}, tweet_id__in=tweet_ids
+                ).values_list("user_id", "tweet_id", "created_at")
+            }
+            to_like = {key for key, liked in states.items() if liked} - existing.keys()
+            to_unlike = {key for key, liked in states.items() if not liked} & existing.keys()
+            now = LikeBucket.start_of(django_timezone.now())
+            buckets = Counter()
+            if to_like:
+                self.bulk_create(
+                    [self.model(user_id=user_id, tweet_id=tweet_id) for user_id, tweet_id in to_like],
+                    ignore_conflicts=True,
+                )
+                buckets.update((tweet_id, now) for _, tweet_id in to_like)
+            if to_unlike:
+                by_user = {}
+                for user_id, tweet_id in to_unlike:
+                    by_user.setdefault(user_id, []).append(tweet_id)
+                self.filter(
+                    reduce(or_, (Q(user_id=user_id, tweet_id__in=ids) for user_id, ids in by_user.items()))
+                ).delete()
+                buckets.subtract((key[1], LikeBucket.start_of(existing[key])) for key in to_unlike)
+            LikeBucket.objects.add(buckets)
+            deltas = Counter(tweet_id for _, tweet_id in to_like)
+            deltas.subtract(tweet_id for _, tweet_id in to_unlike)
+            by_delta = {}
+            for tweet_id, delta in deltas.items():
+                if delta:
+                    by_delta.setdefault(delta, []).append(tweet_id)
+            for delta, ids in by_delta.items():
+                Tweet.objects.filter(pk__in=ids).update(like_count=Greatest(F("like_count") + delta, 0))
+            received = Counter()
+            for tweet_id, delta in deltas.items():
+                received[authors[tweet_id]] += delta
+            UserStats.objects.add({user_id: {"likes_received": delta} for user_id, delta in received.items()})
+            if changed := to_like | to_unlike:
+                bump_activity_version({user_id for user_id, _ in changed} | {authors[key[1]] for key in changed})
+            if deltas:
+                transaction.on_commit(bump_like_version)
+        return tweet_ids
+
+    def apply_batch(self, user, actions):
+        """
+        actions: {tweet_id: True(いいね) / False(いいね解除)} を 1 トランザクションでまとめて反映する。
+        戻り値は存在したツイートについての {tweet_id: (is_liked, like_count)}。
+        """
+        with transaction.atomic():
+            tweet_ids = self.apply_states({(user.pk, tweet_id): liked for tweet_id, liked in actions.items()})
+            counts = dict(Tweet.objects.filter(pk__in=tweet_ids).values_list("pk", "like_count"))
+        return {tweet_id: (actions[tweet_id], counts[tweet_id]) for tweet_id in tweet_ids}
+
+    def mark_liked(self, user, tweets):
+        # 表示中のツイートに限って user のいいねを取得し、各ツイートに is_liked を付ける
+        from .buffer import like_buffer
+
+        tweet_ids = [tweet.pk for tweet in tweets]
+        liked = set()
+        if tweet_ids and user.is_authenticated:
+            liked = set(self.filter(user=user, tweet_id__in=tweet_ids).values_list("tweet_id", flat=True))
+            # 書き込み待ちのいいね・いいね解除を重ねて、本人のクリックをすぐに反映する
+            for tweet_id, is_liked in like_buffer.pending(user.pk, tweet_ids).items():
+                if is_liked:
+                    liked.add(tweet_id)
+                else:
+                    liked.discard(tweet_id)
+        for tweet in tweets:
+            tweet.is_liked = tweet.pk in liked
+        return liked
+
+
 class Like(models.Model):
     tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="like_tweet")
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="like_user")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = LikeManager()
 
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=["tweet", "user"], name="like_unique"),
         ]
+        indexes = [
+            # ユーザーがいいねしたツイートの一覧 (tweet まで含めてインデックスだけで返す)
+            models.Index(fields=["user", "tweet"], name="like_user_tweet_idx"),
+        ]
+
+
+class LikeBucketManager(models.Manager):
+    def add(self, deltas):
+        """
+        deltas: {(tweet_id, start): 増減} を時間帯ごとのいいね数に加算する。
+        行がなければ 0 で作ってから、同じ時間帯・同じ増減のツイートをまとめて 1 回の UPDATE で加算する。
+        """
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        self.bulk_create(
+            [self.model(tweet_id=tweet_id, start=start) for tweet_id, start in deltas], ignore_conflicts=True
+        )
+        groups = {}
+        for (tweet_id, start), delta in deltas.items():
+            groups.setdefault((start, delta), []).append(tweet_id)
+        for (start, delta), tweet_ids in groups.items():
+            self.filter(start=start, tweet_id__in=tweet_ids).update(count=Greatest(F("count") + delta, 0))
+
+
+class LikeBucket(models.Model):
+    # ツイートごと・TRENDING_BUCKET_SECONDS ごとのいいね数 (トレンドの集計用。いいね・いいね解除のたびに加算する)
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="like_buckets")
+    start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    objects = LikeBucketManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["tweet", "start"], name="like_bucket_unique"),
+        ]
+        indexes = [
+            # 直近の時間帯だけを範囲検索して集計する
+            models.Index(fields=["start", "tweet"], name="like_bucket_start_idx"),
+        ]
+
+    @staticmethod
+    def start_of(value):
+        # value を含む時間帯の開始時刻 (UTC)
+        seconds = settings.TRENDING_BUCKET_SECONDS
+        return datetime.fromtimestamp(int(value.timestamp()) // seconds * seconds, tz=timezone.utc)
+
+
+class TrendingTweet(models.Model):
+    # refresh_trending で定期的に作り直すトレンドの順位表
+    WINDOWS = {"hour": 60 * 60, "day": 60 * 60 * 24, "week": 60 * 60 * 24 * 7}
+
+    window = models.CharField(max_length=10, choices=[(window, window) for window in WINDOWS])
+    rank = models.PositiveIntegerField()
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="+")
+    # window の期間内のいいね数
+    like_count = models.PositiveIntegerField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["window", "rank"], name="trending_window_rank_unique"),
+        ]
+
+
+class TimelineEntry(models.Model):
+    # フォロー中タイムラインの inbox (ツイート作成時にフォロワー分だけ書き込む)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="timeline_entries")
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="timeline_entries")
+    author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    # ツイートの created_at のコピー (inbox だけで並べ替えられるようにする)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "tweet"], name="timeline_entry_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-created_at", "-tweet"], name="timeline_user_created_idx"),
+            models.Index(fields=["user", "author"], name="timeline_user_author_idx"),
+        ]
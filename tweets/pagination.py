@@ -0,0 +1,152 @@
+import base64
+import binascii
+import json
+from collections.abc import Sequence
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage(Sequence):
+    # Django の Page と同じように扱えるカーソルページ
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        # 最後の行より後ろ(古い方)を指すカーソル
+        if not self.has_next() or not self.object_list:
+            return None
+        return self.paginator.cursor_for(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        # 最初の行より前(新しい方)を指すカーソル
+        if not self.has_previous() or not self.object_list:
+            return None
+        return self.paginator.cursor_for(self.object_list[0])
+
+
+class KeysetPaginator:
+    """
+    OFFSET を使わず、並び順のキー(例: created_at, id)の値で次のページを絞り込むページネーター。
+    テーブルがどれだけ大きくなっても 1 ページのコストは一定になる。
+    """
+
+    def __init__(self, queryset, per_page, keys=("-created_at", "-id")):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.keys = tuple(keys)
+
+    def _fields(self):
+        return [key.lstrip("-") for key in self.keys]
+
+    def cursor_for(self, row):
+        values = []
+        for name in self._fields():
+            value = row[name] if isinstance(row, dict) else getattr(row, name)
+            values.append(value.isoformat() if hasattr(value, "isoformat") else str(value))
+        raw = json.dumps(values, separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            values = json.loads(raw)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise InvalidCursor(cursor)
+        # 並び順のキーは NULL にならないので、null の値は偽造されたカーソルとみなす
+        if not isinstance(values, list) or len(values) != len(self.keys) or None in values:
+            raise InvalidCursor(cursor)
+        try:
+            return [self._to_python(name, value) for name, value in zip(self._fields(), values)]
+        except (ValidationError, TypeError):
+            raise InvalidCursor(cursor)
+
+    def _to_python(self, name, value):
+        return self.queryset.model._meta.get_field(name).to_python(value)
+
+    def _seek(self, keys, values, reverse=False):
+        # (k1, k2, ...) > (v1, v2, ...) を OR/AND の組み合わせで表現する
+        condition = Q()
+        equal = Q()
+        bound = Q()
+        for key, value in zip(keys, values):
+            name = key.lstrip("-")
+            descending = key.startswith("-") != reverse
+            condition |= equal & Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+            equal &= Q(**{name: value})
+            if not bound:
+                # 先頭キーの範囲条件も付けて、インデックスの範囲検索を使えるようにする
+                bound = Q(**{f"{name}__{'lte' if descending else 'gte'}": value})
+        return bound & condition
+
+    def _fetch(self, queryset, keys, values=None, reverse=False):
+        # カーソルの位置から per_page + 1 件だけ取得する (1 件多いのは続きの有無の判定用)
+        if values is not None:
+            queryset = queryset.filter(self._seek(keys, values, reverse))
+        if reverse:
+            keys = [key[1:] if key.startswith("-") else f"-{key}" for key in keys]
+        return list(queryset.order_by(*keys)[: self.per_page + 1])
+
+    def _build_page(self, rows, cursor, reverse, has_more=None):
+        # has_more を渡さなければ、per_page + 1 件目があるかで続きの有無を判定する
+        if has_more is None:
+            has_more = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+        if reverse:
+            return CursorPage(rows[::-1], self, has_next=True, has_previous=has_more)
+        return CursorPage(rows, self, has_next=has_more, has_previous=bool(cursor))
+
+    def page(self, after=None, before=None):
+        cursor = before or after
+        values = self.decode_cursor(cursor) if cursor else None
+        rows = self._fetch(self.queryset, self.keys, values, reverse=bool(before))
+        return self._build_page(rows, cursor, reverse=bool(before))
+
+    def iterator(self, after=None, chunk_size=1000):
+        # カーソルの位置から最後まで、chunk_size 件ずつ読み出しながら順に返す
+        queryset = self.queryset
+        if after:
+            queryset = queryset.filter(self._seek(self.keys, self.decode_cursor(after)))
+        return queryset.order_by(*self.keys).iterator(chunk_size=chunk_size)
+
+
+class KeysetPaginationMixin:
+    # ListView の paginate_queryset をカーソル方式に置き換える
+    paginate_by = 20
+    cursor_keys = ("-created_at", "-id")
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        return KeysetPaginator(queryset, per_page, self.cursor_keys)
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = self.get_paginator(queryset, page_size)
+        try:
+            page = paginator.page(after=self.request.GET.get("after"), before=self.request.GET.get("before"))
+        except InvalidCursor:
+            raise Http404("無効なカーソルです。")
+        return (paginator, page, page.object_list, page.has_other_pages())
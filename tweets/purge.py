@@ -0,0 +1,151 @@
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from accounts.models import FriendShip, Recommendation, UserStats, bump_activity_version
+from jobs.models import Job
+
+from .cache import bump_version
+from .models import Like, LikeBucket, TimelineEntry, TrendingTweet, Tweet
+from .versions import bump_deletion_version
+
+User = get_user_model()
+
+
+def enqueue_purge():
+    # 削除のたびに呼んでも、実行待ちの purge のジョブは 1 つだけにする
+    Job.objects.enqueue("tweets.purge_tombstones", dedupe_key="tweets.purge_tombstones")
+
+
+def delete_tweet(tweet):
+    """
+    ツイートに deleted_at を付けて、すぐに表示されないようにする (いいねなどの行は purge が後で削除する)。
+    投稿者のツイート数ともらったいいね数は、ここで削除した分だけ減らす。
+    """
+    with transaction.atomic():
+        if not Tweet.objects.filter(pk=tweet.pk).update(deleted_at=timezone.now()):
+            return False
+        # 削除済みのツイートの like_count はもう変わらない (LikeManager を参照)
+        like_count = Tweet.all_objects.filter(pk=tweet.pk).values_list("like_count", flat=True).get()
+        UserStats.objects.add({tweet.user_id: {"tweet_count": -1, "likes_received": -like_count}})
+        bump_activity_version({tweet.user_id})
+        enqueue_purge()
+    bump_version(tweet.pk)
+    bump_deletion_version()
+    return True
+
+
+def delete_user(user):
+    """
+    ユーザーに deleted_at を付けてログインできなくし、ツイートもすぐに表示されないように削除済みにする。
+    フォロー・フォロワーの相手のカウンターもここで減らす (一覧からは削除済みのユーザーを除いて表示する)。
+    ツイートやフォローの行は purge が後で少しずつ削除する。
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        deleted = User.objects.live().filter(pk=user.pk).update(deleted_at=now, is_active=False)
+        if deleted:
+            Tweet.objects.filter(user_id=user.pk).update(deleted_at=now)
+            for field, other_field, counter in (
+                ("follower", "following", "follower_count"),
+                ("following", "follower", "following_count"),
+            ):
+                User.objects.filter(
+                    pk__in=FriendShip.objects.filter(**{field: user.pk}).values(f"{other_field}_id")
+                ).update(**{counter: Greatest(F(counter) - 1, 0), "activity_version": F("activity_version") + 1})
+            bump_activity_version({user.pk})
+            enqueue_purge()
+    if deleted:
+        bump_deletion_version()
+    return bool(deleted)
+
+
+def _delete_batch(queryset, batch_size):
+    # queryset のうち batch_size 件だけを削除する
+    ids = list(queryset.values_list("pk", flat=True)[:batch_size])
+    if ids:
+        queryset.model._base_manager.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def _purge_user_step(user, batch_size):
+    """
+    削除済みのユーザーに関係する行を 1 種類・batch_size 件だけ処理し、処理した件数を返す。
+    すべて処理し終えていれば (ツイートの行も purge 済みなら) ユーザーの行を削除する。
+    """
+    # 1. 削除した後に投稿されたツイートを削除済みにする (行の削除はツイートの purge で行う)
+    ids = list(Tweet.objects.filter(user=user).values_list("pk", flat=True)[:batch_size])
+    if ids:
+        Tweet.objects.filter(pk__in=ids).update(deleted_at=timezone.now())
+        bump_deletion_version()
+        return len(ids)
+    # 2. ほかのユーザーのツイートへのいいねを取り消し、like_count ともらったいいね数を減らす
+    tweet_ids = list(
+        Like.objects.filter(user=user, tweet__deleted_at__isnull=True).values_list("tweet_id", flat=True)[:batch_size]
+    )
+    if tweet_ids:
+        Like.objects.apply_states({(user.pk, tweet_id): False for tweet_id in tweet_ids})
+        return len(tweet_ids)
+    steps = (
+        # 3. 削除済みのツイートへのいいね (カウンターは削除したときに減らしてある)
+        lambda: _delete_batch(Like.objects.filter(user=user), batch_size),
+        # 4. フォロー・フォロワー (相手のフォロワー数・フォロー数は削除したときに減らしてある)
+        lambda: _delete_batch(FriendShip.objects.filter(Q(follower=user) | Q(following=user)), batch_size),
+        # 5. 自分の inbox とおすすめ
+        lambda: _delete_batch(TimelineEntry.objects.filter(user=user), batch_size),
+        lambda: _delete_batch(Recommendation.objects.filter(Q(user=user) | Q(recommended=user)), batch_size),
+    )
+    for step in steps:
+        if count := step():
+            return count
+    if Tweet.all_objects.filter(user=user).exists():
+        # ツイートの purge が終わるのを待つ
+        return 0
+    User.objects.filter(pk=user.pk).delete()
+    return 1
+
+
+def _purge_tweets_step(batch_size):
+    # 削除済みのツイートを batch_size 件取り出し、関係する行を batch_size 件ずつ削除してから、ツイートの行を削除する
+    tweet_ids = list(
+        Tweet.all_objects.filter(deleted_at__isnull=False)
+        .order_by("deleted_at")
+        .values_list("pk", flat=True)[:batch_size]
+    )
+    if not tweet_ids:
+        return 0
+    for model in (Like, TimelineEntry, LikeBucket, TrendingTweet):
+        if count := _delete_batch(model.objects.filter(tweet_id__in=tweet_ids), batch_size):
+            return count
+    Tweet.all_objects.filter(pk__in=tweet_ids).delete()
+    return len(tweet_ids)
+
+
+def _purge_users_step(batch_size):
+    for user in User.objects.filter(deleted_at__isnull=False).order_by("deleted_at"):
+        if count := _purge_user_step(user, batch_size):
+            return count
+    return 0
+
+
+def purge(batch_size=None):
+    """
+    削除済みのユーザー・ツイートに関係する行を batch_size 件ずつ、1 回ごとに別のトランザクションで削除する。
+    書き込みロックは 1 回の batch の間しか取らないので、ほかのリクエストを長く待たせない。
+    戻り値は {"users": 処理した行数, "tweets": 処理した行数}。
+    """
+    batch_size = batch_size or settings.PURGE_BATCH_SIZE
+    counts = Counter()
+    while True:
+        with transaction.atomic():
+            users = _purge_users_step(batch_size)
+        with transaction.atomic():
+            tweets = _purge_tweets_step(batch_size)
+        if not users and not tweets:
+            return {"users": counts["users"], "tweets": counts["tweets"]}
+        counts.update(users=users, tweets=tweets)
@@ -0,0 +1,161 @@
+from django.core.exceptions import ValidationError
+from django.db import connections
+
+from .pagination import KeysetPaginator
+
+# Tweet.content の全文検索用の FTS5 仮想テーブル。tweets_tweet を外部コンテンツとして参照し、トリガーで同期する
+FTS_TABLE = "tweets_tweet_fts"
+# 日本語は空白で区切られないので trigram で索引する。3 文字未満の語は索引を使って検索できない
+MIN_TERM_LENGTH = 3
+
+INSTALL_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE}
+    USING fts5(content, content='tweets_tweet', content_rowid='id', tokenize='trigram')
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON tweets_tweet BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON tweets_tweet BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF content ON tweets_tweet BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+]
+
+UNINSTALL_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+class InvalidQuery(Exception):
+    pass
+
+
+def is_supported(connection):
+    return connection.vendor == "sqlite"
+
+
+def install(connection):
+    """
+    FTS5 のテーブルと同期用のトリガーを作る (作成済みなら何もしない)。
+    SQLite ではテーブルを作り直すマイグレーションでトリガーが消えるので、migrate のたびに呼ぶ。
+    """
+    if not is_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        for sql in INSTALL_SQL:
+            cursor.execute(sql)
+
+
+def uninstall(connection):
+    if not is_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        for sql in UNINSTALL_SQL:
+            cursor.execute(sql)
+
+
+def rebuild(connection, optimize=False):
+    # tweets_tweet の内容から索引を作り直す
+    install(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        if optimize:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def parse_query(query):
+    # 空白で区切った語をそれぞれフレーズとして引用し、すべてを含むツイートを探す (FTS5 の演算子は使わせない)
+    terms = query.split()
+    if not terms:
+        raise InvalidQuery("検索語を入力してください。")
+    if any(len(term) < MIN_TERM_LENGTH for term in terms):
+        raise InvalidQuery(f"{MIN_TERM_LENGTH} 文字以上の語で検索してください。")
+    return " ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+class SearchPaginator(KeysetPaginator):
+    """
+    bm25 のスコア (小さいほど関連が強い) と id の順に検索結果を並べ、同じカーソル方式でページングする。
+    FTS5 から 1 ページ分の id だけを取り出し、ツイートはそのページの分だけ queryset から取得する。
+    """
+
+    def __init__(self, queryset, per_page, query):
+        super().__init__(queryset, per_page, keys=("rank", "id"))
+        self.match = parse_query(query)
+
+    def _to_python(self, name, value):
+        if name != "rank":
+            return super()._to_python(name, value)
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise ValidationError("invalid rank")
+
+    def _ranked(self, values=None, reverse=False, limit=None):
+        # 削除済みのツイートは、続きの有無の判定を狂わせないように SQL の中で除く
+        sql = (
+            f"SELECT {FTS_TABLE}.rowid, bm25({FTS_TABLE}) FROM {FTS_TABLE} "
+            f"JOIN tweets_tweet ON tweets_tweet.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s AND tweets_tweet.deleted_at IS NULL"
+        )
+        params = [self.match]
+        if values is not None:
+            op = "<" if reverse else ">"
+            sql += f" AND (bm25({FTS_TABLE}) {op} %s OR (bm25({FTS_TABLE}) = %s AND {FTS_TABLE}.rowid {op} %s))"
+            params += [values[0], values[0], values[1]]
+        order = "DESC" if reverse else "ASC"
+        sql += f" ORDER BY 2 {order}, 1 {order} LIMIT %s"
+        params.append(limit or self.per_page + 1)
+        with connections[self.queryset.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def _load(self, ranked):
+        # ranked の順にツイートを取得し、カーソル用に rank を付ける (values() の dict でもモデルでもよい)
+        rows = {}
+        for row in self.queryset.filter(pk__in=[tweet_id for tweet_id, _ in ranked]):
+            rows[row["id"] if isinstance(row, dict) else row.pk] = row
+        result = []
+        for tweet_id, rank in ranked:
+            if (row := rows.get(tweet_id)) is None:
+                continue
+            if isinstance(row, dict):
+                row["rank"] = rank
+            else:
+                row.rank = rank
+            result.append(row)
+        return result
+
+    def page(self, after=None, before=None):
+        cursor = before or after
+        values = self.decode_cursor(cursor) if cursor else None
+        ranked = self._ranked(values, reverse=bool(before))
+        rows = self._load(ranked[: self.per_page])
+        return self._build_page(rows, cursor, reverse=bool(before), has_more=len(ranked) > self.per_page)
+
+    def iterator(self, after=None, chunk_size=1000):
+        # カーソルの位置から最後まで chunk_size 件ずつ検索しながら返す
+        values = self.decode_cursor(after) if after else None
+
+        def rows(values):
+            while True:
+                ranked = self._ranked(values, limit=chunk_size)
+                yield from self._load(ranked)
+                if len(ranked) < chunk_size:
+                    return
+                values = [ranked[-1][1], ranked[-1][0]]
+
+        return rows(values)
@@ -0,0 +1,22 @@
+from jobs.registry import task
+
+from . import purge, timeline, trending
+from .models import Tweet
+
+
+@task("tweets.fan_out")
+def fan_out(tweet_id):
+    # TIMELINE_FANOUT_ASYNC のとき、投稿のあとでフォロワーの inbox に書き込む (何度実行しても同じ結果になる)
+    tweet = Tweet.objects.select_related("user").filter(pk=tweet_id).first()
+    if tweet is not None:
+        timeline.fan_out(tweet, bump_followers=True)
+
+
+@task("tweets.purge_tombstones")
+def purge_tombstones(batch_size=None):
+    purge.purge(batch_size)
+
+
+@task("tweets.refresh_trending")
+def refresh_trending():
+    trending.refresh()
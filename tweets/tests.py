@@ -1,8 +1,33 @@
+import base64
+import json
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 
-from tweets.models import Like, Tweet
+from accounts.models import FriendShip, UserStats
+from mysite.testing import QueryBudgetAssertionsMixin, QueryPlanAssertionsMixin
+from tweets import cache as card_cache
+from tweets import purge, trending
+from tweets.buffer import like_buffer
+from tweets.events import EventStreamApp, broker, publish_like_count
+from tweets.models import Like, LikeBucket, TimelineEntry, TrendingTweet, Tweet
+from tweets.pagination import KeysetPaginator
+from tweets.purge import delete_tweet, delete_user
+from tweets.search import FTS_TABLE, SearchPaginator
+from tweets.timeline import TimelinePaginator, fan_out
 
 User = get_user_model()
 
@@ -15,6 +40,192 @@ class TestHomeView(TestCase):
         response = self.client.get(reverse("tweets:home"))
         self.assertQuerysetEqual(response.context["tweet_list"], Tweet.objects.all(), ordered=False)
 
+    def test_success_get_with_cursor(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        Tweet.objects.bulk_create([Tweet(user=self.user, content=f"test{i}") for i in range(25)])
+        response = self.client.get(reverse("tweets:home"))
+        page = response.context["page_obj"]
+        self.assertEqual(len(response.context["tweet_list"]), 20)
+        self.assertQuerysetEqual(response.context["tweet_list"], Tweet.objects.order_by("-created_at", "-id")[:20])
+        self.assertTrue(page.has_next())
+        self.assertFalse(page.has_previous())
+
+        response = self.client.get(reverse("tweets:home"), {"after": page.next_cursor})
+        page = response.context["page_obj"]
+        self.assertQuerysetEqual(response.context["tweet_list"], Tweet.objects.order_by("-created_at", "-id")[20:])
+        self.assertFalse(page.has_next())
+        self.assertTrue(page.has_previous())
+
+        response = self.client.get(reverse("tweets:home"), {"before": page.previous_cursor})
+        self.assertQuerysetEqual(response.context["tweet_list"], Tweet.objects.order_by("-created_at", "-id")[:20])
+        self.assertFalse(response.context["page_obj"].has_previous())
+
+    def test_success_get_with_liked_list(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        Tweet.objects.bulk_create([Tweet(user=self.user, content=f"test{i}") for i in range(25)])
+        tweets = Tweet.objects.order_by("-created_at", "-id")
+        Like.objects.like(self.user, tweets[0])
+        Like.objects.like(self.user, tweets[24])
+        response = self.client.get(reverse("tweets:home"))
+        self.assertEqual(response.context["liked_list"], {tweets[0].pk})
+        self.assertEqual([tweet.is_liked for tweet in response.context["tweet_list"]], [True] + [False] * 19)
+
+    def test_failure_get_with_invalid_cursor(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        response = self.client.get(reverse("tweets:home"), {"after": "invalid"})
+        self.assertEqual(response.status_code, 404)
+        # 形式は正しいが値の型が違うカーソル
+        for values in ([1, 2], [None, None], [[], {}]):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            for name in ("tweets:home", "tweets:api_home"):
+                response = self.client.get(reverse(name), {"after": cursor})
+                self.assertEqual(response.status_code, 404)
+
+
+class TestHomeFragmentView(TestCase):
+    def test_success_get(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        Tweet.objects.bulk_create([Tweet(user=self.user, content=f"test{i}") for i in range(25)])
+        cursor = self.client.get(reverse("tweets:home")).context["page_obj"].next_cursor
+        response = self.client.get(reverse("tweets:home_fragment"), {"after": cursor})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertFalse(data["has_next"])
+        self.assertIsNone(data["next_cursor"])
+        self.assertEqual(data["html"].count("投稿者"), 5)
+
+
+class TestTweetCardCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        card_cache.stats.reset()
+        self.user1 = User.objects.create_user(username="testuser1", password="testpassword")
+        self.user2 = User.objects.create_user(username="testuser2", password="testpassword")
+        self.tweets = Tweet.objects.bulk_create([Tweet(user=self.user1, content=f"test{i}") for i in range(3)])
+        self.client.login(username="testuser1", password="testpassword")
+
+    def test_success_hit(self):
+        self.client.get(reverse("tweets:home"))
+        self.assertEqual(card_cache.stats.as_dict(), {"hits": 0, "misses": 3, "hit_rate": 0.0})
+        self.client.get(reverse("tweets:home"))
+        self.assertEqual(card_cache.stats.hits, 3)
+        self.assertEqual(card_cache.stats.misses, 3)
+
+    def test_success_like_count_per_request(self):
+        # いいね数はキャッシュしたカードに入れず、リクエストごとに差し込むので、いいねしてもカードは作り直さない
+        self.client.get(reverse("tweets:home"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("tweets:like", kwargs={"pk": self.tweets[0].pk}))
+        response = self.client.get(reverse("tweets:home"))
+        self.assertEqual(card_cache.stats.as_dict(), {"hits": 3, "misses": 3, "hit_rate": 0.5})
+        card = next(tweet.card_html for tweet in response.context["tweet_list"] if tweet.pk == self.tweets[0].pk)
+        self.assertIn(f'<span class="count_{self.tweets[0].pk}">1 </span>', card)
+        self.assertIn("いいね解除", card)
+
+    def test_success_like_button_per_viewer(self):
+        Like.objects.like(self.user1, self.tweets[0])
+        self.client.get(reverse("tweets:home"))
+        self.client.login(username="testuser2", password="testpassword")
+        response = self.client.get(reverse("tweets:home"))
+        self.assertEqual(card_cache.stats.hits, 3)
+        for tweet in response.context["tweet_list"]:
+            self.assertNotIn("いいね解除", tweet.card_html)
+
+    def test_success_with_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as location:
+            backend = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": location}
+            with self.settings(CACHES={**settings.CACHES, "default": backend}):
+                self.client.get(reverse("tweets:home"))
+                card_cache.bump_version(self.tweets[0].pk)
+                self.client.get(reverse("tweets:home"))
+        self.assertEqual(card_cache.stats.hits, 2)
+        self.assertEqual(card_cache.stats.misses, 4)
+
+
+class TestTimelineView(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="testuser1", password="testpassword")
+        self.user2 = User.objects.create_user(username="testuser2", password="testpassword")
+        self.user3 = User.objects.create_user(username="testuser3", password="testpassword")
+        FriendShip.objects.follow(self.user1, self.user2)
+
+    def post_tweet(self, username, content):
+        self.client.login(username=username, password="testpassword")
+        self.client.post(reverse("tweets:create"), {"content": content})
+
+    def test_success_get(self):
+        self.post_tweet("testuser1", "own")
+        self.post_tweet("testuser2", "following")
+        self.post_tweet("testuser3", "not following")
+        self.client.login(username="testuser1", password="testpassword")
+        response = self.client.get(reverse("tweets:timeline"))
+        self.assertEqual(response.status_code, 200)
+        self.assertQuerysetEqual(
+            response.context["tweet_list"],
+            Tweet.objects.filter(user__in=[self.user1, self.user2]).order_by("-created_at", "-id"),
+        )
+
+    def test_success_unfollow(self):
+        self.post_tweet("testuser2", "following")
+        self.client.login(username="testuser1", password="testpassword")
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": self.user2.username}))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user1).exists())
+        self.client.post(reverse("accounts:follow", kwargs={"username": self.user2.username}))
+        self.assertTrue(TimelineEntry.objects.filter(user=self.user1, author=self.user2).exists())
+
+    def test_success_delete(self):
+        self.post_tweet("testuser2", "following")
+        Tweet.objects.get(content="following").delete()
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=1)
+    def test_success_get_with_large_account(self):
+        self.post_tweet("testuser2", "following")
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user1).exists())
+        self.client.login(username="testuser1", password="testpassword")
+        response = self.client.get(reverse("tweets:timeline"))
+        self.assertQuerysetEqual(response.context["tweet_list"], Tweet.objects.filter(user=self.user2))
+
+
+class TestTimelineBackfillMigration(TransactionTestCase):
+    # user-003 より前のスキーマにデータを作ってから、TimelineEntry を作るマイグレーションを適用する
+    migrate_from = [("accounts", "0002_friendship_friendship_unique_constraint"), ("tweets", "0003_tweet_like_count")]
+    migrate_to = [("tweets", "0004_timelineentry")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_backfill_existing_tweets(self):
+        apps = self.migrate(self.migrate_from)
+        OldUser = apps.get_model("accounts", "CustomUser")
+        OldTweet = apps.get_model("tweets", "Tweet")
+        OldFriendShip = apps.get_model("accounts", "FriendShip")
+        user1 = OldUser.objects.create(username="testuser1")
+        user2 = OldUser.objects.create(username="testuser2")
+        user3 = OldUser.objects.create(username="testuser3")
+        OldFriendShip.objects.create(follower=user1, following=user2)
+        tweets = {user: OldTweet.objects.create(user=user, content=user.username) for user in (user1, user2, user3)}
+        self.migrate(self.migrate_to)
+        self.assertEqual(
+            set(TimelineEntry.objects.values_list("user_id", "tweet_id")),
+            {
+                (user1.pk, tweets[user1].pk),
+                (user1.pk, tweets[user2].pk),
+                (user2.pk, tweets[user2].pk),
+                (user3.pk, tweets[user3].pk),
+            },
+        )
+
 
 class TestTweetCreateView(TestCase):
     def setUp(self):
@@ -69,6 +280,100 @@ class TestTweetDetailView(TestCase):
         )
 
 
+class TestConditionalGet(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.other = User.objects.create_user(username="other", password="testpassword")
+        self.tweet = Tweet.objects.create(user=self.other, content="test")
+        self.client.login(username="testuser", password="testpassword")
+
+    def revalidate(self, url):
+        etag = self.client.get(url)["ETag"]
+        return etag, self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_success_not_modified(self):
+        for url in (reverse("tweets:home"), reverse("tweets:detail", kwargs={"pk": self.tweet.pk})):
+            etag = self.client.get(url)["ETag"]
+            # ログイン中のユーザーの取得と、ETag の計算だけ
+            with self.assertNumQueries(2):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertIn("private", response["Cache-Control"])
+
+    def test_success_home_modified_by_new_tweet(self):
+        etag, _ = self.revalidate(reverse("tweets:home"))
+        Tweet.objects.create(user=self.other, content="new")
+        response = self.client.get(reverse("tweets:home"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_success_home_modified_by_like(self):
+        etag, _ = self.revalidate(reverse("tweets:home"))
+        Like.objects.like(self.user, self.tweet)
+        response = self.client.get(reverse("tweets:home"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_success_modified_by_third_party_like(self):
+        # 閲覧者でも投稿者でもないユーザーのいいねで、カードのいいね数が変わる
+        third = User.objects.create_user(username="third", password="testpassword")
+        for url in (
+            reverse("tweets:home"),
+            reverse("tweets:timeline"),
+            reverse("accounts:user_profile", kwargs={"username": self.other.username}),
+        ):
+            etag, _ = self.revalidate(url)
+            with self.captureOnCommitCallbacks(execute=True):
+                Like.objects.like(third, self.tweet)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            Like.objects.unlike(third, self.tweet)
+
+    @override_settings(LIKE_BUFFER_ENABLED=True, LIKE_BUFFER_FLUSH_INTERVAL=3600)
+    def test_success_modified_by_own_buffered_like(self):
+        etag, _ = self.revalidate(reverse("tweets:home"))
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        try:
+            response = self.client.get(reverse("tweets:home"), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context["liked_list"], {self.tweet.pk})
+        finally:
+            like_buffer.flush()
+
+    def test_success_home_modified_by_delete(self):
+        old_tweet = Tweet.objects.create(user=self.user, content="old")
+        Tweet.objects.create(user=self.other, content="latest")
+        etag, _ = self.revalidate(reverse("tweets:home"))
+        self.client.post(reverse("tweets:delete", kwargs={"pk": old_tweet.pk}))
+        response = self.client.get(reverse("tweets:home"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_success_detail_modified_by_other_users_like(self):
+        url = reverse("tweets:detail", kwargs={"pk": self.tweet.pk})
+        etag, _ = self.revalidate(url)
+        Like.objects.like(self.other, self.tweet)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["tweet"].like_count, 1)
+
+    def test_success_modified_by_pending_message(self):
+        follow_url = reverse("accounts:follow", kwargs={"username": self.other.username})
+        self.client.post(follow_url)
+        # フォローしたときのメッセージを表示しておく
+        self.client.get(reverse("tweets:home"))
+        etag, _ = self.revalidate(reverse("tweets:home"))
+        # すでにフォローしているので警告だけを出してホームに戻す (ETag の材料は何も変わらない)
+        response = self.client.post(follow_url)
+        response = self.client.get(response["Location"], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "すでに other をフォローしています")
+        response = self.client.get(reverse("tweets:home"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_failure_detail_with_not_exist_tweet(self):
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": 1000}), HTTP_IF_NONE_MATCH="*")
+        self.assertEqual(response.status_code, 404)
+
+
 class TestTweetDeleteView(TestCase):
     def setUp(self):
         self.user1 = User.objects.create_user(username="testuser1", password="testpassword")
@@ -97,6 +402,109 @@ class TestTweetDeleteView(TestCase):
         self.assertEqual(response.status_code, 403)
 
 
+class TestPurge(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username="author", password="testpassword")
+        self.reader = User.objects.create_user(username="reader", password="testpassword")
+        FriendShip.objects.follow(self.reader, self.author)
+        self.tweet = Tweet.objects.create(user=self.author, content="test")
+        fan_out(self.tweet)
+        UserStats.objects.add({self.author.pk: {"tweet_count": 1}})
+        Like.objects.like(self.reader, self.tweet)
+        trending.refresh()
+        self.client.login(username="reader", password="testpassword")
+
+    def stats(self, user):
+        return UserStats.objects.get(user=user)
+
+    def test_success_delete_tweet(self):
+        self.assertTrue(delete_tweet(self.tweet))
+        self.assertFalse(delete_tweet(self.tweet))
+        self.assertEqual(self.client.get(reverse("tweets:detail", kwargs={"pk": self.tweet.pk})).status_code, 404)
+        self.assertEqual(self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk})).status_code, 404)
+        self.assertEqual(list(self.client.get(reverse("tweets:timeline")).context["tweet_list"]), [])
+        self.assertEqual(list(self.client.get(reverse("tweets:trending")).context["trending_list"]), [])
+        self.assertEqual((self.stats(self.author).tweet_count, self.stats(self.author).likes_received), (0, 0))
+        # 行はまだ残っていて、purge で削除する
+        self.assertTrue(Tweet.all_objects.filter(pk=self.tweet.pk).exists())
+        # いいね 1, inbox 2, 時間帯ごとのいいね数 1, トレンド 3 (hour / day / week), ツイート 1
+        self.assertEqual(purge.purge(batch_size=1)["tweets"], 8)
+        self.assertFalse(Tweet.all_objects.filter(pk=self.tweet.pk).exists())
+        self.assertFalse(Like.objects.exists())
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertFalse(TrendingTweet.objects.exists())
+        self.assertFalse(LikeBucket.objects.exists())
+
+    def test_success_delete_user(self):
+        other_tweet = Tweet.objects.create(user=self.reader, content="reader's tweet")
+        UserStats.objects.add({self.reader.pk: {"tweet_count": 1}})
+        Like.objects.like(self.author, other_tweet)
+        self.assertTrue(delete_user(self.author))
+        self.assertFalse(self.client.login(username="author", password="testpassword"))
+        profile = reverse("accounts:user_profile", kwargs={"username": "author"})
+        self.assertEqual(self.client.get(profile).status_code, 404)
+        # ツイートは purge を待たずに表示されなくなる
+        self.client.login(username="reader", password="testpassword")
+        self.assertEqual(list(self.client.get(reverse("tweets:timeline")).context["tweet_list"]), [])
+        self.assertFalse(Tweet.objects.filter(user=self.author).exists())
+        # フォローの一覧とカウンターからも、purge を待たずに除く
+        for name in ("accounts:following_list", "accounts:api_following_list"):
+            response = self.client.get(reverse(name, kwargs={"username": "reader"}))
+            self.assertNotContains(response, "author")
+        self.reader.refresh_from_db()
+        self.assertEqual(self.reader.following_count, 0)
+
+        purge.purge(batch_size=1)
+        self.assertFalse(User.objects.filter(pk=self.author.pk).exists())
+        self.assertFalse(Tweet.all_objects.filter(user=self.author).exists())
+        self.reader.refresh_from_db()
+        other_tweet.refresh_from_db()
+        self.assertEqual(self.reader.following_count, 0)
+        self.assertEqual(other_tweet.like_count, 0)
+        self.assertEqual(self.stats(self.reader).likes_received, 0)
+        self.assertFalse(Like.objects.exists())
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    def test_success_pages_skip_deleted_tweets(self):
+        tweets = Tweet.objects.bulk_create([Tweet(user=self.author, content=f"paged tweet {i}") for i in range(24)])
+        for tweet in tweets:
+            fan_out(tweet)
+        # 1 ページ目に入る新しいツイートを削除しても、ページは途中で終わらない
+        for tweet in tweets[-3:]:
+            delete_tweet(tweet)
+        paginators = [TimelinePaginator(Tweet.objects.all(), 20, self.reader)]
+        if connection.vendor == "sqlite":
+            paginators.append(SearchPaginator(Tweet.objects.all(), 20, "paged tweet"))
+        for paginator, total in zip(paginators, (22, 21)):
+            page = paginator.page()
+            self.assertEqual(len(page), 20)
+            self.assertTrue(page.has_next())
+            rest = paginator.page(after=page.next_cursor)
+            self.assertEqual(len(rest), total - 20)
+            self.assertFalse(rest.has_next())
+
+    @override_settings(TRENDING_SIZE=1, TRENDING_SPARE=1)
+    def test_success_trending_fills_deleted_rank(self):
+        other = Tweet.objects.create(user=self.reader, content="other")
+        Like.objects.like(self.author, other)
+        Like.objects.like(self.reader, other)
+        trending.refresh()
+        delete_tweet(other)
+        response = self.client.get(reverse("tweets:trending"))
+        self.assertEqual([entry.tweet for entry in response.context["trending_list"]], [self.tweet])
+
+    def test_success_purge_command(self):
+        delete_tweet(self.tweet)
+        out = StringIO()
+        call_command("purge_tombstones", "--batch-size", "10", stdout=out)
+        self.assertIn("ツイート: 8 行", out.getvalue())
+        self.assertFalse(Tweet.all_objects.exists())
+
+    def test_failure_purge_without_tombstones(self):
+        self.assertEqual(purge.purge(), {"users": 0, "tweets": 0})
+        self.assertTrue(Tweet.objects.filter(pk=self.tweet.pk).exists())
+
+
 class TestFavoriteView(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -111,17 +519,34 @@ class TestFavoriteView(TestCase):
         response = self.client.post(self.url)
         self.assertEqual(response.status_code, 200)
         self.assertTrue(Like.objects.count(), 1)
+        self.assertEqual(response.json()["like_count"], 1)
+        self.data.refresh_from_db()
+        self.assertEqual(self.data.like_count, 1)
 
     def test_failure_post_with_not_exist_tweet(self):
         response = self.client.post(reverse("tweets:like", kwargs={"pk": "1000"}))
         self.assertEqual(response.status_code, 404)
         self.assertEqual(Like.objects.count(), 0)
 
+    async def test_success_post_with_async_client(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.post(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["like_count"], 1)
+        self.assertEqual(await Like.objects.filter(tweet=self.data, user=self.user).acount(), 1)
+
+    def test_failure_post_with_anonymous_user(self):
+        self.client.logout()
+        response = self.client.post(self.url)
+        self.assertRedirects(response, f"{reverse('accounts:login')}?next={self.url}")
+        self.assertEqual(Like.objects.count(), 0)
+
     def test_failure_post_with_favorited_tweet(self):
-        Like.objects.create(tweet=self.data, user=self.user)
+        Like.objects.like(self.user, self.data)
         response = self.client.post(self.url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(Like.objects.count(), 1)
+        self.assertEqual(response.json()["like_count"], 1)
 
 
 class TestUnfavoriteView(TestCase):
@@ -132,13 +557,16 @@ class TestUnfavoriteView(TestCase):
         )
         self.client.login(username="testuser", password="testpassword")
         self.data = Tweet.objects.create(user=self.user, content="testtweet")
-        Like.objects.create(tweet=self.data, user=self.user)
+        Like.objects.like(self.user, self.data)
         self.url = reverse("tweets:unlike", kwargs={"pk": self.data.pk})
 
     def test_success_post(self):
         response = self.client.post(self.url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(Like.objects.count(), 0)
+        self.assertEqual(response.json()["like_count"], 0)
+        self.data.refresh_from_db()
+        self.assertEqual(self.data.like_count, 0)
 
     def test_failure_post_with_not_exist_tweet(self):
         response = self.client.post(reverse("tweets:unlike", kwargs={"pk": "1000"}))
@@ -146,6 +574,482 @@ class TestUnfavoriteView(TestCase):
         self.assertEqual(Like.objects.count(), 1)
 
     def test_failure_post_with_unfavorited_tweet(self):
-        Like.objects.filter(tweet=self.data, user=self.user).delete()
+        Like.objects.unlike(self.user, self.data)
         response = self.client.post(self.url)
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["like_count"], 0)
+
+
+class TestQueryPlan(QueryPlanAssertionsMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.paginator = KeysetPaginator(Tweet.objects.all(), 20)
+        self.cursor = [timezone.now(), 1]
+
+    def test_home_timeline(self):
+        queryset = Tweet.objects.select_related("user")
+        self.assertUsesIndex(queryset.order_by("-created_at", "-id")[:21])
+        self.assertUsesIndex(queryset.filter(self.paginator._seek(self.paginator.keys, self.cursor))[:21])
+
+    def test_user_tweets(self):
+        queryset = Tweet.objects.filter(user=self.user).order_by("-created_at", "-id")
+        self.assertUsesIndex(queryset[:21])
+        self.assertUsesIndex(queryset.filter(self.paginator._seek(self.paginator.keys, self.cursor))[:21])
+
+    def test_liked_list(self):
+        self.assertUsesIndex(
+            Like.objects.filter(user=self.user, tweet_id__in=[1, 2]).values_list("tweet_id", flat=True)
+        )
+
+    def test_following_timeline(self):
+        self.assertUsesIndex(
+            TimelineEntry.objects.filter(user=self.user)
+            .values_list("created_at", "tweet_id")
+            .order_by("-created_at", "-tweet_id")[:21]
+        )
+
+
+class TestQueryBudget(QueryBudgetAssertionsMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.other = User.objects.create_user(username="otheruser", password="testpassword")
+        FriendShip.objects.follow(self.user, self.other)
+        self.client.login(username="testuser", password="testpassword")
+
+    def seed(self, size):
+        # ツイート・いいね・inbox を size 件になるまで増やす
+        count = Tweet.objects.count()
+        tweets = Tweet.objects.bulk_create(
+            [Tweet(user=self.user if i % 2 else self.other, content=f"tweet{i}") for i in range(count, size)]
+        )
+        Like.objects.apply_states({(self.user.pk, tweet.pk): True for tweet in tweets[::2]})
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(user=self.user, tweet=tweet, author_id=tweet.user_id, created_at=tweet.created_at)
+                for tweet in tweets
+            ]
+        )
+        trending.refresh()
+
+    def test_success_query_count_does_not_grow(self):
+        paths = [
+            reverse("tweets:home"),
+            reverse("tweets:home_fragment"),
+            reverse("tweets:timeline"),
+            reverse("tweets:trending"),
+            reverse("tweets:api_home"),
+            reverse("tweets:api_user_tweets", kwargs={"username": "testuser"}),
+        ]
+        counts = {}
+        for size in (10, 1000):
+            self.seed(size)
+            detail = reverse("tweets:detail", kwargs={"pk": Tweet.objects.latest("id").pk})
+            search = [
+                self.assertWithinQueryBudget(reverse(name), {"q": "tweet"})
+                for name in ("tweets:search", "tweets:api_search")
+            ]
+            counts[size] = [self.assertWithinQueryBudget(path) for path in paths + [detail]] + search
+        self.assertEqual(counts[10], counts[1000])
+
+    def test_success_server_timing_header(self):
+        response = self.client.get(reverse("tweets:home"))
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="\d+ queries, 0 duplicates"$')
+
+    @override_settings(QUERY_BUDGETS={"tweets:home": 1})
+    def test_failure_over_budget_is_logged(self):
+        with self.assertLogs("mysite.middleware", "WARNING") as logs:
+            self.client.get(reverse("tweets:home"))
+        self.assertIn("tweets:home", logs.output[0])
+
+
+class TestBatchLikeView(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        self.tweets = Tweet.objects.bulk_create([Tweet(user=self.user, content=f"test{i}") for i in range(3)])
+        Like.objects.like(self.user, self.tweets[1])
+        Like.objects.like(self.user, self.tweets[2])
+        self.url = reverse("tweets:batch_like")
+
+    def post(self, operations):
+        return self.client.post(self.url, json.dumps({"operations": operations}), content_type="application/json")
+
+    def test_success_post(self):
+        response = self.post(
+            [
+                {"tweet_id": self.tweets[0].pk, "action": "like"},
+                {"tweet_id": self.tweets[1].pk, "action": "unlike"},
+                {"tweet_id": self.tweets[2].pk, "action": "unlike"},
+                {"tweet_id": self.tweets[2].pk, "action": "like"},
+                {"tweet_id": 1000, "action": "like"},
+            ]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            {
+                "results": [
+                    {"tweet_id": self.tweets[0].pk, "is_liked": True, "like_count": 1},
+                    {"tweet_id": self.tweets[1].pk, "is_liked": False, "like_count": 0},
+                    {"tweet_id": self.tweets[2].pk, "is_liked": True, "like_count": 1},
+                ],
+                "not_found": [1000],
+            },
+        )
+        self.assertQuerysetEqual(
+            Like.objects.order_by("tweet_id").values_list("tweet_id", flat=True),
+            [self.tweets[0].pk, self.tweets[2].pk],
+        )
+
+    def test_failure_post_with_invalid_action(self):
+        response = self.post([{"tweet_id": self.tweets[0].pk, "action": "retweet"}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Like.objects.count(), 2)
+
+    def test_failure_post_with_invalid_body(self):
+        response = self.client.post(self.url, "invalid", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_failure_post_with_too_many_operations(self):
+        response = self.post([{"tweet_id": self.tweets[0].pk, "action": "like"}] * 101)
+        self.assertEqual(response.status_code, 400)
+
+
+class TestTweetJsonView(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="testuser1", password="testpassword")
+        self.user2 = User.objects.create_user(username="testuser2", password="testpassword")
+        self.client.login(username="testuser1", password="testpassword")
+        Tweet.objects.bulk_create([Tweet(user=self.user1, content=f"test{i}") for i in range(25)])
+        Tweet.objects.create(user=self.user2, content="other")
+
+    def test_success_get(self):
+        response = self.client.get(reverse("tweets:api_home"))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(
+            [tweet["id"] for tweet in data["results"]],
+            list(Tweet.objects.order_by("-created_at", "-id").values_list("id", flat=True)[:20]),
+        )
+        self.assertEqual(set(data["results"][0]), {"id", "user", "content", "created_at", "like_count"})
+        response = self.client.get(reverse("tweets:api_home"), {"after": data["next_cursor"]})
+        self.assertEqual(len(response.json()["results"]), 6)
+        self.assertIsNone(response.json()["next_cursor"])
+
+    def test_success_get_ndjson(self):
+        response = self.client.get(
+            reverse("tweets:api_user_tweets", kwargs={"username": "testuser1"}), {"format": "ndjson"}
+        )
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        tweets = [json.loads(line) for line in lines]
+        self.assertEqual(
+            [tweet["id"] for tweet in tweets],
+            list(Tweet.objects.filter(user=self.user1).order_by("-created_at", "-id").values_list("id", flat=True)),
+        )
+        self.assertEqual({tweet["user"] for tweet in tweets}, {"testuser1"})
+
+    def test_failure_get_with_not_exist_user(self):
+        response = self.client.get(reverse("tweets:api_user_tweets", kwargs={"username": "empty"}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(reverse("tweets:api_home"), {"after": "invalid", "format": "ndjson"})
+        self.assertEqual(response.status_code, 404)
+
+
+class TestTweetSearchView(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        self.url = reverse("tweets:search")
+
+    def search_ids(self, query, url=None):
+        response = self.client.get(url or reverse("tweets:api_search"), {"q": query})
+        return [tweet["id"] for tweet in response.json()["results"]]
+
+    def test_success_get(self):
+        tweet = Tweet.objects.create(user=self.user, content="今日は東京タワーに行った")
+        Tweet.objects.create(user=self.user, content="大阪城に行った")
+        response = self.client.get(self.url, {"q": "東京タワー"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["tweet_list"]), [tweet])
+        self.assertContains(response, "今日は東京タワーに行った")
+
+    def test_success_ranked_by_relevance(self):
+        weak = Tweet.objects.create(user=self.user, content="python と django と sqlite の話をまとめて長く書いた")
+        strong = Tweet.objects.create(user=self.user, content="django django")
+        Tweet.objects.create(user=self.user, content="関係ない")
+        self.assertEqual(self.search_ids("django"), [strong.pk, weak.pk])
+        self.assertEqual(self.search_ids("django sqlite"), [weak.pk])
+
+    def test_success_index_follows_update_and_delete(self):
+        tweet = Tweet.objects.create(user=self.user, content="old content")
+        Tweet.objects.filter(pk=tweet.pk).update(content="new content")
+        self.assertEqual(self.search_ids("old"), [])
+        self.assertEqual(self.search_ids("new"), [tweet.pk])
+        Tweet.objects.filter(pk=tweet.pk).delete()
+        self.assertEqual(self.search_ids("new"), [])
+
+    def test_success_cursor_pagination(self):
+        Tweet.objects.bulk_create([Tweet(user=self.user, content=f"search {i}") for i in range(25)])
+        response = self.client.get(reverse("tweets:api_search"), {"q": "search"})
+        first = response.json()
+        self.assertEqual(len(first["results"]), 20)
+        response = self.client.get(reverse("tweets:api_search"), {"q": "search", "after": first["next_cursor"]})
+        second = response.json()
+        self.assertEqual(len(second["results"]), 5)
+        self.assertIsNone(second["next_cursor"])
+        ids = [tweet["id"] for tweet in first["results"] + second["results"]]
+        self.assertCountEqual(ids, Tweet.objects.values_list("id", flat=True))
+        response = self.client.get(reverse("tweets:api_search"), {"q": "search", "before": second["previous_cursor"]})
+        self.assertEqual(response.json()["results"], first["results"])
+
+    def test_success_get_ndjson(self):
+        Tweet.objects.bulk_create([Tweet(user=self.user, content=f"search {i}") for i in range(25)])
+        response = self.client.get(reverse("tweets:api_search"), {"q": "search", "format": "ndjson"})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 25)
+
+    def test_success_rebuild_command(self):
+        tweet = Tweet.objects.create(user=self.user, content="rebuild me")
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')")
+        self.assertEqual(self.search_ids("rebuild"), [])
+        call_command("rebuild_tweet_search", stdout=StringIO())
+        self.assertEqual(self.search_ids("rebuild"), [tweet.pk])
+
+    def test_failure_get_with_short_query(self):
+        Tweet.objects.create(user=self.user, content="ab")
+        response = self.client.get(self.url, {"q": "ab"})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "3 文字以上の語で検索してください。")
+        response = self.client.get(reverse("tweets:api_search"), {"q": "ab"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_failure_get_with_fts_syntax(self):
+        # FTS5 の演算子や引用符はそのまま文字として検索する
+        tweet = Tweet.objects.create(user=self.user, content='he said "hello" OR NOT')
+        self.assertEqual(self.search_ids('"hello" said'), [tweet.pk])
+        self.assertEqual(self.search_ids("NOT*"), [])
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(self.url, {"q": "search", "after": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
+
+class TestTrending(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        self.tweets = Tweet.objects.bulk_create([Tweet(user=self.user, content=f"test{i}") for i in range(3)])
+        self.now = timezone.now()
+
+    def buckets(self, tweet):
+        return list(LikeBucket.objects.filter(tweet=tweet).values_list("count", flat=True))
+
+    def test_success_like_and_unlike_update_bucket(self):
+        tweet = self.tweets[0]
+        Like.objects.like(self.user, tweet)
+        like = Like.objects.get()
+        self.assertEqual(LikeBucket.objects.get().start, LikeBucket.start_of(like.created_at))
+        self.assertEqual(self.buckets(tweet), [1])
+        Like.objects.unlike(self.user, tweet)
+        self.assertEqual(self.buckets(tweet), [0])
+
+    def test_success_unlike_decrements_bucket_of_like(self):
+        # 古いいいねを取り消したら、いいねした時間帯から減らす
+        tweet = self.tweets[0]
+        old = self.now - timedelta(days=2)
+        Like.objects.create(user=self.user, tweet=tweet)
+        Like.objects.update(created_at=old)
+        LikeBucket.objects.create(tweet=tweet, start=LikeBucket.start_of(old), count=1)
+        Like.objects.apply_states({(self.user.pk, tweet.pk): False})
+        self.assertEqual(self.buckets(tweet), [0])
+
+    def test_success_refresh(self):
+        hour, day, week = self.tweets
+        for tweet, age, count in (
+            (hour, timedelta(minutes=1), 2),
+            (day, timedelta(hours=5), 5),
+            (week, timedelta(days=3), 9),
+            (hour, timedelta(days=8), 1),
+        ):
+            LikeBucket.objects.create(tweet=tweet, start=LikeBucket.start_of(self.now - age), count=count)
+        self.assertEqual(trending.refresh(self.now), {"hour": 1, "day": 2, "week": 3})
+        ranks = {window: [] for window in TrendingTweet.WINDOWS}
+        for window, tweet_id, like_count in TrendingTweet.objects.order_by("rank").values_list(
+            "window", "tweet", "like_count"
+        ):
+            ranks[window].append((tweet_id, like_count))
+        self.assertEqual(ranks["hour"], [(hour.pk, 2)])
+        self.assertEqual(ranks["day"], [(day.pk, 5), (hour.pk, 2)])
+        self.assertEqual(ranks["week"], [(week.pk, 9), (day.pk, 5), (hour.pk, 2)])
+        # いちばん長い期間より古い時間帯は削除する
+        self.assertEqual(LikeBucket.objects.count(), 3)
+
+    def test_success_get(self):
+        for tweet in self.tweets[1:]:
+            Like.objects.like(self.user, tweet)
+        Like.objects.like(User.objects.create_user(username="other"), self.tweets[2])
+        call_command("refresh_trending", stdout=StringIO())
+        response = self.client.get(reverse("tweets:trending"), {"window": "hour"})
+        self.assertEqual(response.status_code, 200)
+        tweets = [entry.tweet for entry in response.context["trending_list"]]
+        self.assertEqual(tweets, [self.tweets[2], self.tweets[1]])
+        self.assertContains(response, "1 位 (2 いいね)")
+
+    def test_failure_get_with_invalid_window(self):
+        response = self.client.get(reverse("tweets:trending"), {"window": "year"})
+        self.assertEqual(response.status_code, 404)
+
+
+class ImmediateLoop:
+    # EventBroker.publish をテストの中で同期的に受け取るためのループの代わり
+    def call_soon_threadsafe(self, callback, *args):
+        callback(*args)
+
+
+class TestEventStream(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        self.tweets = Tweet.objects.bulk_create([Tweet(user=self.user, content=f"test{i}") for i in range(2)])
+
+    def scope(self, cookie=True):
+        headers = []
+        if cookie:
+            session_id = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+            headers.append((b"cookie", f"{settings.SESSION_COOKIE_NAME}={session_id}".encode()))
+        return {
+            "type": "http",
+            "method": "GET",
+            "path": "/tweets/events/",
+            "query_string": f"tweets={self.tweets[0].pk}".encode(),
+            "headers": headers,
+        }
+
+    async def test_success_stream(self):
+        communicator = ApplicationCommunicator(EventStreamApp(None), self.scope())
+        await communicator.send_input({"type": "http.request", "body": b""})
+        start = await communicator.receive_output(timeout=3)
+        self.assertEqual(start["status"], 200)
+        self.assertEqual((await communicator.receive_output(timeout=1))["body"], b": connected\n\n")
+        publish_like_count(self.tweets[1].pk, 5)
+        publish_like_count(self.tweets[0].pk, 3)
+        body = (await communicator.receive_output(timeout=1))["body"]
+        self.assertEqual(body, f'event: like\ndata: {{"tweet_id": {self.tweets[0].pk}, "like_count": 3}}\n\n'.encode())
+        await communicator.send_input({"type": "http.disconnect"})
+        await communicator.wait(timeout=1)
+        self.assertEqual(len(broker._subscriptions), 0)
+
+    async def test_failure_stream_with_anonymous_user(self):
+        communicator = ApplicationCommunicator(EventStreamApp(None), self.scope(cookie=False))
+        await communicator.send_input({"type": "http.request", "body": b""})
+        self.assertEqual((await communicator.receive_output(timeout=3))["status"], 403)
+
+    def test_success_publish_from_views(self):
+        subscription = broker.subscribe(ImmediateLoop(), [self.tweets[0].pk])
+        try:
+            self.client.post(reverse("tweets:like", kwargs={"pk": self.tweets[0].pk}))
+            self.client.post(reverse("tweets:create"), {"content": "new"})
+            events = [subscription.queue.get_nowait() for _ in range(subscription.queue.qsize())]
+        finally:
+            broker.unsubscribe(subscription)
+        self.assertEqual(
+            events,
+            [
+                {"event": "like", "data": {"tweet_id": self.tweets[0].pk, "like_count": 1}},
+                {"event": "tweet", "data": {"tweet_id": Tweet.objects.get(content="new").pk, "user": "testuser"}},
+            ],
+        )
+
+    def test_success_get_without_asgi(self):
+        response = self.client.get(reverse("tweets:events"))
+        self.assertEqual(response.status_code, 204)
+
+
+@override_settings(LIKE_BUFFER_ENABLED=True, LIKE_BUFFER_FLUSH_INTERVAL=3600)
+class TestLikeBuffer(TestCase):
+    def setUp(self):
+        like_buffer.flush()
+        self.user1 = User.objects.create_user(username="testuser1", password="testpassword")
+        self.user2 = User.objects.create_user(username="testuser2", password="testpassword")
+        self.client.login(username="testuser1", password="testpassword")
+        self.tweets = Tweet.objects.bulk_create([Tweet(user=self.user1, content=f"test{i}") for i in range(2)])
+        Like.objects.like(self.user2, self.tweets[1])
+
+    def tearDown(self):
+        like_buffer.flush()
+
+    def test_success_collapse_and_flush(self):
+        for name in ("tweets:like", "tweets:unlike", "tweets:like"):
+            response = self.client.post(reverse(name, kwargs={"pk": self.tweets[0].pk}))
+        self.assertEqual(response.json()["like_count"], 1)
+        self.assertFalse(Like.objects.filter(tweet=self.tweets[0]).exists())
+        self.assertEqual(len(like_buffer), 1)
+
+        response = self.client.get(reverse("tweets:home"))
+        self.assertEqual(response.context["liked_list"], {self.tweets[0].pk})
+
+        self.assertEqual(like_buffer.flush(), 1)
+        self.assertTrue(Like.objects.filter(tweet=self.tweets[0], user=self.user1).exists())
+        self.tweets[0].refresh_from_db()
+        self.assertEqual(self.tweets[0].like_count, 1)
+
+    def test_success_flush_unlike(self):
+        like_buffer.record(self.user2.pk, self.tweets[1].pk, False)
+        like_buffer.record(self.user1.pk, self.tweets[1].pk, True)
+        self.assertEqual(like_buffer.like_count(self.tweets[1].pk, 1), 1)
+        like_buffer.flush()
+        self.assertQuerysetEqual(
+            Like.objects.filter(tweet=self.tweets[1]).values_list("user", flat=True), [self.user1.pk]
+        )
+        self.tweets[1].refresh_from_db()
+        self.assertEqual(self.tweets[1].like_count, 1)
+
+    def test_success_pending_while_flushing(self):
+        like_buffer.record(self.user1.pk, self.tweets[0].pk, True)
+        apply_states = Like.objects.apply_states
+        seen = {}
+
+        def check_overlay(states):
+            # 書き込み中のまとまりも、コミットされるまでは本人の状態といいね数に反映される
+            seen["pending"] = like_buffer.pending(self.user1.pk, [self.tweets[0].pk])
+            seen["like_count"] = like_buffer.like_count(self.tweets[0].pk, 0)
+            apply_states(states)
+
+        with mock.patch.object(Like.objects, "apply_states", side_effect=check_overlay):
+            self.assertEqual(like_buffer.flush(), 1)
+        self.assertEqual(seen, {"pending": {self.tweets[0].pk: True}, "like_count": 1})
+        self.assertEqual(like_buffer.pending(self.user1.pk, [self.tweets[0].pk]), {})
+
+    def test_success_batch_after_buffered_like(self):
+        # バッチの解除が、バッファに溜まっている古いいいねに上書きされない
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweets[0].pk}))
+        response = self.client.post(
+            reverse("tweets:batch_like"),
+            {"operations": [{"tweet_id": self.tweets[0].pk, "action": "unlike"}]},
+            content_type="application/json",
+        )
+        result = {"tweet_id": self.tweets[0].pk, "is_liked": False, "like_count": 0}
+        self.assertEqual(response.json()["results"], [result])
+        like_buffer.flush()
+        self.assertFalse(Like.objects.filter(tweet=self.tweets[0], user=self.user1).exists())
+
+    def test_success_flush_after_delete_user(self):
+        # 削除の前に溜まっていたいいねは、purge の後に書き込んでも戻らない
+        like_buffer.record(self.user2.pk, self.tweets[0].pk, True)
+        delete_user(self.user2)
+        purge.purge()
+        like_buffer.flush()
+        self.assertFalse(Like.objects.filter(user_id=self.user2.pk).exists())
+        self.tweets[0].refresh_from_db()
+        self.assertEqual(self.tweets[0].like_count, 0)
+
+    @override_settings(LIKE_BUFFER_MAX_PENDING=2)
+    def test_success_flush_when_full(self):
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweets[0].pk}))
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweets[1].pk}))
+        self.assertEqual(len(like_buffer), 0)
+        self.assertEqual(Like.objects.filter(user=self.user1).count(), 2)
@@ -0,0 +1,112 @@
+from django.conf import settings
+
+from accounts.models import FriendShip, bump_activity_version
+from jobs.models import Job
+
+from .models import TimelineEntry, Tweet
+from .pagination import KeysetPaginator
+
+FANOUT_BATCH_SIZE = 1000
+
+
+def is_fanout_target(user):
+    # フォロワーが多すぎるユーザーは書き込み時の fan-out をしない
+    return user.follower_count < settings.TIMELINE_FANOUT_THRESHOLD
+
+
+def large_following_ids(user):
+    # user がフォローしているユーザーのうち fan-out をしない(読み出し時にマージする)ユーザー
+    return list(
+        FriendShip.objects.filter(
+            follower=user, following__follower_count__gte=settings.TIMELINE_FANOUT_THRESHOLD
+        ).values_list("following_id", flat=True)
+    )
+
+
+def fan_out(tweet, bump_followers=False):
+    """
+    投稿者本人とフォロワーの inbox にツイートを書き込む。
+    投稿とは別のトランザクション (ジョブ) で書き込むときは bump_followers を指定し、書き込んだユーザーの
+    activity_version を進める。最大のツイート id は投稿したときに変わっているので、そのままでは ETag が変わらない。
+    """
+    entries = [TimelineEntry(user_id=tweet.user_id, tweet=tweet, author_id=tweet.user_id, created_at=tweet.created_at)]
+
+    def write(entries):
+        TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+        if bump_followers:
+            bump_activity_version({entry.user_id for entry in entries})
+
+    if is_fanout_target(tweet.user):
+        follower_ids = FriendShip.objects.filter(following_id=tweet.user_id).values_list("follower_id", flat=True)
+        for follower_id in follower_ids.iterator(chunk_size=FANOUT_BATCH_SIZE):
+            entries.append(
+                TimelineEntry(user_id=follower_id, tweet=tweet, author_id=tweet.user_id, created_at=tweet.created_at)
+            )
+            if len(entries) >= FANOUT_BATCH_SIZE:
+                write(entries)
+                entries = []
+    write(entries)
+
+
+def fan_out_later(tweet):
+    # 投稿者本人の inbox にだけすぐ書き込み、フォロワーの分はジョブ (tweets.tasks.fan_out) に回す
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=tweet.user_id, tweet=tweet, author_id=tweet.user_id, created_at=tweet.created_at)],
+        ignore_conflicts=True,
+    )
+    Job.objects.enqueue("tweets.fan_out", {"tweet_id": tweet.pk}, dedupe_key=f"tweets.fan_out:{tweet.pk}")
+
+
+def backfill(follower, following):
+    # フォローした直後に、相手の直近のツイートを inbox に取り込む
+    if not is_fanout_target(following):
+        return
+    tweets = Tweet.objects.filter(user=following).order_by("-created_at", "-id")[: settings.TIMELINE_BACKFILL_SIZE]
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user=follower, tweet_id=tweet_id, author=following, created_at=created_at)
+            for tweet_id, created_at in tweets.values_list("id", "created_at")
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def remove_following(follower, following):
+    # フォロー解除したユーザーのツイートを inbox から取り除く
+    TimelineEntry.objects.filter(user=follower, author=following).delete()
+
+
+class TimelinePaginator(KeysetPaginator):
+    """
+    inbox の (created_at, tweet_id) と、fan-out しないユーザーのツイートの (created_at, id) を
+    同じカーソルで読み出してマージし、そのページのツイートだけを queryset から取得する。
+    """
+
+    def __init__(self, queryset, per_page, user):
+        super().__init__(queryset, per_page, keys=("-created_at", "-id"))
+        self.user = user
+
+    def sources(self):
+        # 削除済みのツイートはカーソルの SQL で除く (取得した後で除くと、続きがあるのにページが終わってしまう)
+        yield (
+            TimelineEntry.objects.filter(user=self.user, tweet__deleted_at__isnull=True).values_list(
+                "created_at", "tweet_id"
+            ),
+            ("-created_at", "-tweet_id"),
+        )
+        if following_ids := large_following_ids(self.user):
+            yield Tweet.objects.filter(user_id__in=following_ids).values_list("created_at", "id"), self.keys
+
+    def page(self, after=None, before=None):
+        cursor = before or after
+        values = self.decode_cursor(cursor) if cursor else None
+        reverse = bool(before)
+        keys = set()
+        for queryset, source_keys in self.sources():
+            keys.update(self._fetch(queryset, source_keys, values, reverse))
+        keys = sorted(keys, reverse=not reverse)[: self.per_page + 1]
+        # 続きの有無はキーの件数で決める (キーを読んだ後に削除されたツイートがあっても、ページを途中で終わらせない)
+        page_keys = keys[: self.per_page]
+        tweets = self.queryset.in_bulk([tweet_id for _, tweet_id in page_keys])
+        rows = [tweets[tweet_id] for _, tweet_id in page_keys if tweet_id in tweets]
+        return self._build_page(rows, cursor, reverse, has_more=len(keys) > self.per_page)
@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import LikeBucket, TrendingTweet
+
+
+def ranking(window, now):
+    """
+    window の期間に入る時間帯のいいね数を合計し、多い順に TRENDING_SIZE + TRENDING_SPARE 件を返す。
+    次の集計までに削除されるツイートがあっても TRENDING_SIZE 件を表示できるように、余分に保存しておく。
+    """
+    since = LikeBucket.start_of(now - timedelta(seconds=TrendingTweet.WINDOWS[window]))
+    return list(
+        LikeBucket.objects.filter(start__gte=since, tweet__deleted_at__isnull=True)
+        .values("tweet")
+        .annotate(total=Sum("count"))
+        .filter(total__gt=0)
+        .order_by("-total", "-tweet")
+        .values_list("tweet", "total")[: settings.TRENDING_SIZE + settings.TRENDING_SPARE]
+    )
+
+
+def refresh(now=None):
+    """
+    期間ごとの順位表を作り直し、いちばん長い期間より古い時間帯のいいね数を削除する。
+    集計は直近の時間帯の行だけを読むので、いいねの総数には比例しない。
+    """
+    now = now or timezone.now()
+    rankings = {window: ranking(window, now) for window in TrendingTweet.WINDOWS}
+    with transaction.atomic():
+        TrendingTweet.objects.all().delete()
+        TrendingTweet.objects.bulk_create(
+            [
+                TrendingTweet(window=window, rank=rank, tweet_id=tweet_id, like_count=total, computed_at=now)
+                for window, rows in rankings.items()
+                for rank, (tweet_id, total) in enumerate(rows, start=1)
+            ]
+        )
+    oldest = LikeBucket.start_of(now - timedelta(seconds=max(TrendingTweet.WINDOWS.values())))
+    LikeBucket.objects.filter(start__lt=oldest).delete()
+    return {window: len(rows) for window, rows in rankings.items()}
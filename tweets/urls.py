@@ -5,9 +5,18 @@ from . import views
 app_name = "tweets"
 urlpatterns = [
     path("home/", views.HomeView.as_view(), name="home"),
+    path("home/fragment/", views.HomeFragmentView.as_view(), name="home_fragment"),
+    path("timeline/", views.TimelineView.as_view(), name="timeline"),
+    path("trending/", views.TrendingView.as_view(), name="trending"),
+    path("search/", views.TweetSearchView.as_view(), name="search"),
     path("create/", views.TweetCreateView.as_view(), name="create"),
     path("<int:pk>/", views.TweetDetailView.as_view(), name="detail"),
     path("<int:pk>/delete/", views.TweetDeleteView.as_view(), name="delete"),
     path("<int:pk>/like/", views.LikeView.as_view(), name="like"),
     path("<int:pk>/unlike/", views.UnlikeView.as_view(), name="unlike"),
+    path("likes/batch/", views.BatchLikeView.as_view(), name="batch_like"),
+    path("events/", views.EventStreamView.as_view(), name="events"),
+    path("api/home/", views.HomeJsonView.as_view(), name="api_home"),
+    path("api/search/", views.TweetSearchJsonView.as_view(), name="api_search"),
+    path("api/users/<str:username>/", views.UserTweetJsonView.as_view(), name="api_user_tweets"),
 ]
@@ -0,0 +1,43 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+# ツイートが削除されるたびに進める、全体で 1 つのバージョン (最大のツイート id は削除では変わらないため)
+DELETION_VERSION_KEY = "tweet-deletion-version"
+# いいね・いいね解除のたびに進める、全体で 1 つのバージョン (カードに表示するいいね数が変わるため)
+LIKE_VERSION_KEY = "tweet-like-version"
+
+
+def get_cache():
+    # ETag に使うバージョンは、すべてのプロセスで同じ値を読めるキャッシュに置く (TWEET_VERSION_CACHE)
+    return caches[settings.TWEET_VERSION_CACHE]
+
+
+def _bump(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        # 追い出されていたら、過去に使った値と重ならないように時刻から作り直す
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def bump_deletion_version():
+    _bump(DELETION_VERSION_KEY)
+
+
+def bump_like_version():
+    _bump(LIKE_VERSION_KEY)
+
+
+def global_versions():
+    # (削除のバージョン, いいねのバージョン) をまとめて取得する
+    cache = get_cache()
+    keys = (DELETION_VERSION_KEY, LIKE_VERSION_KEY)
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return tuple(versions[key] for key in keys)
@@ -1,25 +1,129 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.http import JsonResponse
+from django.db import transaction
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
 from django.urls import reverse, reverse_lazy
 from django.views.generic import CreateView, DeleteView, DetailView, ListView, View
 
+from accounts.models import Recommendation, UserStats, bump_activity_version
+from mysite.asyncviews import AsyncLoginRequiredMixin, aget_object_or_404
+from mysite.routers import ReplicaReadMixin
+
+from .api import KeysetJsonView
+from .buffer import like_buffer
+from .cache import render_cards
+from .conditional import ConditionalGetMixin, detail_etag, home_etag
+from .events import publish_like_count, publish_tweet
 from .forms import TweetForm
-from .models import Like, Tweet
+from .models import Like, TrendingTweet, Tweet
+from .pagination import KeysetPaginationMixin
+from .purge import delete_tweet
+from .search import InvalidQuery, SearchPaginator
+from .timeline import TimelinePaginator, fan_out, fan_out_later
 
+User = get_user_model()
 
-class HomeView(LoginRequiredMixin, ListView):
-    # 全ユーザーのツイート表示
+
+class HomeView(LoginRequiredMixin, ReplicaReadMixin, ConditionalGetMixin, KeysetPaginationMixin, ListView):
+    # 全ユーザーのツイート表示 (created_at, id によるカーソルページング)
     model = Tweet
     template_name = "tweets/home.html"
-    ordering = "-created_at"
-    queryset = Tweet.objects.select_related("user").prefetch_related("like_tweet")
+    queryset = Tweet.objects.select_related("user")
+    etag_func = staticmethod(home_etag)
+    # おすすめユーザーのパネルを表示するか
+    recommendation_panel = True
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["liked_list"] = (
-            Like.objects.select_related("tweet").filter(user=self.request.user).values_list("tweet", flat=True)
+        context["liked_list"] = Like.objects.mark_liked(self.request.user, context["tweet_list"])
+        render_cards(context["tweet_list"])
+        if self.recommendation_panel:
+            context["recommendation_list"] = Recommendation.objects.for_user(self.request.user)
+        return context
+
+
+class HomeFragmentView(HomeView):
+    # 無限スクロール用に次のページのツイートを HTML 断片として返す
+    recommendation_panel = False
+
+    def render_to_response(self, context, **response_kwargs):
+        page = context["page_obj"]
+        html = render_to_string("tweets/tweet_list.html", context, request=self.request)
+        return JsonResponse(
+            {
+                "html": html,
+                "next_cursor": page.next_cursor,
+                "previous_cursor": page.previous_cursor,
+                "has_next": page.has_next(),
+            }
         )
+
+
+class TimelineView(HomeView):
+    # フォロー中のユーザーと自分のツイート表示 (inbox から読み出す)
+    template_name = "tweets/timeline.html"
+    recommendation_panel = False
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        return TimelinePaginator(queryset, per_page, self.request.user)
+
+
+class TweetSearchView(HomeView):
+    # ?q= に一致するツイートを関連度順に表示する (FTS5 の bm25)
+    template_name = "tweets/search.html"
+    recommendation_panel = False
+
+    def get(self, request, *args, **kwargs):
+        self.query = request.GET.get("q", "").strip()
+        self.search_error = None
+        return super().get(request, *args, **kwargs)
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        return SearchPaginator(queryset, per_page, self.query)
+
+    def paginate_queryset(self, queryset, page_size):
+        try:
+            return super().paginate_queryset(queryset, page_size)
+        except InvalidQuery as e:
+            if self.query:
+                self.search_error = str(e)
+            return (None, None, [], False)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["query"] = self.query
+        context["search_error"] = self.search_error
+        return context
+
+
+class TrendingView(LoginRequiredMixin, ReplicaReadMixin, ListView):
+    # ?window=hour / day / week の期間にいいねが多かったツイート (refresh_trending で作った順位表を読むだけ)
+    template_name = "tweets/trending.html"
+    context_object_name = "trending_list"
+
+    def get_queryset(self):
+        self.window = self.request.GET.get("window", "day")
+        if self.window not in TrendingTweet.WINDOWS:
+            raise Http404("無効な期間です。")
+        return (
+            TrendingTweet.objects.filter(window=self.window, tweet__deleted_at__isnull=True)
+            .select_related("tweet__user")
+            .order_by("rank")[: settings.TRENDING_SIZE]
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        tweets = [entry.tweet for entry in context["trending_list"]]
+        context["window"] = self.window
+        context["windows"] = list(TrendingTweet.WINDOWS)
+        context["liked_list"] = Like.objects.mark_liked(self.request.user, tweets)
+        render_cards(tweets)
         return context
 
 
@@ -33,22 +137,28 @@ class TweetCreateView(LoginRequiredMixin, CreateView):
     def form_valid(self, form):
         # 投稿ユーザーをリクエストユーザーと紐づけ
         form.instance.user = self.request.user
-        return super().form_valid(form)
+        with transaction.atomic():
+            response = super().form_valid(form)
+            if settings.TIMELINE_FANOUT_ASYNC:
+                fan_out_later(self.object)
+            else:
+                fan_out(self.object)
+            UserStats.objects.add({self.object.user_id: {"tweet_count": 1}})
+            bump_activity_version({self.object.user_id})
+        publish_tweet(self.object)
+        return response
 
 
-class TweetDetailView(LoginRequiredMixin, DetailView):
+class TweetDetailView(LoginRequiredMixin, ReplicaReadMixin, ConditionalGetMixin, DetailView):
     # 詳細機能
     model = Tweet
     template_name = "tweets/detail.html"
-    queryset = Tweet.objects.select_related("user").prefetch_related("like_tweet")
+    queryset = Tweet.objects.select_related("user")
+    etag_func = staticmethod(detail_etag)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["liked_list"] = (
-            Like.objects.select_related("tweet")
-            .filter(tweet=self.object, user=self.request.user)
-            .values_list("tweet", flat=True)
-        )
+        context["liked_list"] = Like.objects.mark_liked(self.request.user, [self.object])
         return context
 
 
@@ -57,48 +167,142 @@ class TweetDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     template_name = "tweets/delete.html"
     success_url = reverse_lazy("tweets:home")
 
+    def get_object(self, queryset=None):
+        # test_func で取得したツイートを使い回す
+        if getattr(self, "object", None) is None:
+            self.object = super().get_object(queryset)
+        return self.object
+
     def test_func(self, **kwargs):
         # アクセスできるユーザーを制限
-        tweet = self.get_object()
-        return tweet.user == self.request.user
+        return self.get_object().user_id == self.request.user.pk
+
+    def form_valid(self, form):
+        # 削除済みの印を付けるだけにして、いいねや inbox の行は purge_tombstones が少しずつ削除する
+        delete_tweet(self.object)
+        return HttpResponseRedirect(self.get_success_url())
 
 
-class LikeView(LoginRequiredMixin, View):
-    def post(self, request, *args, **kwargs):
+class LikeView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, *args, **kwargs):
         tweet_id = self.kwargs["pk"]
-        tweet = get_object_or_404(Tweet, pk=tweet_id)
+        tweet = await aget_object_or_404(Tweet, pk=tweet_id)
         user = self.request.user
-        Like.objects.get_or_create(tweet=tweet, user=user)
-        is_liked = True
-        like_url = reverse("tweets:like", kwargs={"pk": tweet_id})
-        unlike_url = reverse("tweets:unlike", kwargs={"pk": tweet_id})
-        like_count = tweet.like_tweet.count()
+        if settings.LIKE_BUFFER_ENABLED:
+            like_count = await sync_to_async(like_buffer.toggle)(user.pk, tweet, True)
+        else:
+            # Django 4.1 の非同期 ORM はトランザクションを扱えないので、いいねと like_count の更新は 1 回のスレッド切り替えで行う
+            await sync_to_async(Like.objects.like)(user, tweet)
+            like_count = await Tweet.objects.filter(pk=tweet_id).values_list("like_count", flat=True).aget()
+        publish_like_count(tweet_id, like_count)
         context = {
             "like_count": like_count,
             "tweet_id": tweet_id,
-            "is_liked": is_liked,
-            "like_url": like_url,
-            "unlike_url": unlike_url,
+            "is_liked": True,
+            "like_url": reverse("tweets:like", kwargs={"pk": tweet_id}),
+            "unlike_url": reverse("tweets:unlike", kwargs={"pk": tweet_id}),
         }
         return JsonResponse(context)
 
 
-class UnlikeView(LoginRequiredMixin, View):
-    def post(self, request, *args, **kwargs):
+class UnlikeView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, *args, **kwargs):
         tweet_id = self.kwargs["pk"]
-        tweet = get_object_or_404(Tweet, pk=tweet_id)
+        tweet = await aget_object_or_404(Tweet, pk=tweet_id)
         user = self.request.user
-        if like := Like.objects.filter(user=user, tweet=tweet):
-            like.delete()
-        is_liked = False
-        like_url = reverse("tweets:like", kwargs={"pk": tweet_id})
-        unlike_url = reverse("tweets:unlike", kwargs={"pk": tweet_id})
-        like_count = tweet.like_tweet.count()
+        if settings.LIKE_BUFFER_ENABLED:
+            like_count = await sync_to_async(like_buffer.toggle)(user.pk, tweet, False)
+        else:
+            await sync_to_async(Like.objects.unlike)(user, tweet)
+            like_count = await Tweet.objects.filter(pk=tweet_id).values_list("like_count", flat=True).aget()
+        publish_like_count(tweet_id, like_count)
         context = {
             "like_count": like_count,
             "tweet_id": tweet_id,
-            "is_liked": is_liked,
-            "like_url": like_url,
-            "unlike_url": unlike_url,
+            "is_liked": False,
+            "like_url": reverse("tweets:like", kwargs={"pk": tweet_id}),
+            "unlike_url": reverse("tweets:unlike", kwargs={"pk": tweet_id}),
         }
         return JsonResponse(context)
+
+
+class BatchLikeView(LoginRequiredMixin, View):
+    # [{"tweet_id": 1, "action": "like"}, ...] をまとめて反映する
+    max_operations = 100
+
+    def post(self, request, *args, **kwargs):
+        try:
+            operations = json.loads(request.body)["operations"]
+            # 同じツイートへの操作は後のものを優先する
+            actions = {int(operation["tweet_id"]): operation["action"] for operation in operations}
+        except (ValueError, KeyError, TypeError):
+            return HttpResponseBadRequest("リクエストの形式が正しくありません。")
+        if len(operations) > self.max_operations:
+            return HttpResponseBadRequest(f"一度に送信できる操作は {self.max_operations} 件までです。")
+        if any(action not in ("like", "unlike") for action in actions.values()):
+            return HttpResponseBadRequest("action には like か unlike を指定してください。")
+        states = {tweet_id: action == "like" for tweet_id, action in actions.items()}
+        if settings.LIKE_BUFFER_ENABLED:
+            # LikeView と同じバッファに記録して、バッファの古い状態が後から上書きしないようにする
+            like_counts = dict(Tweet.objects.filter(pk__in=states).values_list("pk", "like_count"))
+            like_counts = like_buffer.toggle_many(request.user.pk, like_counts, states)
+            results = {tweet_id: (states[tweet_id], like_count) for tweet_id, like_count in like_counts.items()}
+        else:
+            results = Like.objects.apply_batch(request.user, states)
+        for tweet_id, (_, like_count) in results.items():
+            publish_like_count(tweet_id, like_count)
+        context = {
+            "results": [
+                {"tweet_id": tweet_id, "is_liked": is_liked, "like_count": like_count}
+                for tweet_id, (is_liked, like_count) in sorted(results.items())
+            ],
+            "not_found": sorted(set(actions) - set(results)),
+        }
+        return JsonResponse(context)
+
+
+class EventStreamView(LoginRequiredMixin, View):
+    # ASGI では EventStreamApp が先に処理する。WSGI で動かしているときは 204 を返して EventSource の再接続を止める
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(status=204)
+
+
+class TweetJsonView(KeysetJsonView):
+    fields = ("id", "user__username", "content", "created_at", "like_count")
+
+    def serialize(self, row):
+        return {
+            "id": row["id"],
+            "user": row["user__username"],
+            "content": row["content"],
+            "created_at": row["created_at"],
+            "like_count": row["like_count"],
+        }
+
+
+class HomeJsonView(TweetJsonView):
+    # 全ユーザーのツイート (HomeView の JSON 版)
+    def get_queryset(self):
+        return Tweet.objects.values(*self.fields)
+
+
+class TweetSearchJsonView(TweetJsonView):
+    # ?q= に一致するツイート (TweetSearchView の JSON 版)
+    def get_queryset(self):
+        return Tweet.objects.values(*self.fields)
+
+    def get_paginator(self, queryset):
+        return SearchPaginator(queryset, self.paginate_by, self.request.GET.get("q", ""))
+
+    def get(self, request, *args, **kwargs):
+        try:
+            return super().get(request, *args, **kwargs)
+        except InvalidQuery as e:
+            return HttpResponseBadRequest(str(e))
+
+
+class UserTweetJsonView(TweetJsonView):
+    # ユーザーのツイート (UserProfileView の tweet_list の JSON 版)
+    def get_queryset(self):
+        user = get_object_or_404(User.objects.live(), username=self.kwargs["username"])
+        return Tweet.objects.filter(user=user).values(*self.fields)